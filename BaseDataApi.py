@@ -1,33 +1,93 @@
+import hashlib
+import io
 import os
 import platform
 import re
 import shutil
 import tarfile
 import time
+import threading
 import traceback
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from multiprocessing import cpu_count
 from random import randint
+from urllib.parse import urlparse
 
+import numpy as np
 import pandas as pd
 import py7zr
+import pyarrow as pa
+import pyarrow.feather as feather
 import rarfile
 from joblib import Parallel, delayed
 from retrying import retry
 from tqdm import tqdm
 
 from plugins.StockStrategy.common import *
+from plugins.StockStrategy.http_client import CircuitOpenError, HttpClient, TokenBucket
+from plugins.StockStrategy.job_store import JobStore
+from plugins.StockStrategy.journal import MergeJournal
+from plugins.StockStrategy.local_strategy import LocalStrategy
+from plugins.StockStrategy.metrics import capture_call, metrics
+from plugins.StockStrategy.panel import PanelStore
+from plugins.StockStrategy.query import DataQuery
+from plugins.StockStrategy.schema import SchemaRegistry
+from plugins.StockStrategy.storage import align_float_dtypes, get_storage, write_feather
+from plugins.StockStrategy.strategy_cache import StrategyCache
+from plugins.StockStrategy.strategy_store import StrategyStore, get_period_type
+
+# 策略结果接口返回的错误码
+strategy_code_dict = {
+    1003: '策略无获取权限',
+    1004: '策略不存在',
+    1005: '策略无数据',
+    1006: '策略获取数据参数错误',
+}
+# 各压缩格式文件开头的magic bytes，tar包单独判断
+archive_magic_dict = {
+    'zip': [b'PK\x03\x04', b'PK\x05\x06'],
+    '7z': [b'7z\xbc\xaf\x27\x1c'],
+    'rar': [b'Rar!\x1a\x07'],
+    'tar': [b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00'],  # 压缩过的tar包
+}
+# 各压缩格式对应的解压函数
+archive_uncompress_dict = {
+    'zip': 'zip_uncompress',
+    '7z': 'uncompress',
+    'rar': 'rar_uncompress',
+    'tar': 'tar_uncompress',
+}
 
 
 class BaseDataApi(object):
 
-    def __init__(self, hid: str, api_key: str, all_data_path: str, strategy_result_path: str):
+    def __init__(self, hid: str, api_key: str, all_data_path: str, strategy_result_path: str,
+                 storage_type: str = 'csv', host_concurrency: int = 4, http_timeout=(5, 30),
+                 strategy_publish_time: str = '17:00', strategy_disk_cache: bool = True,
+                 data_info_max_age: int = 24 * 60 * 60, metrics_path: str = '', job_max_attempts: int = 5,
+                 job_retry_delay: int = 300, query_cache_bytes: int = 512 * 1024 * 1024,
+                 panel_fields_dict: dict = None, local_strategy_dict: dict = None, local_strategy_fallback=True):
         """
         构建函数，实例化对象的时候传入的参数
         :param hid: 个人中心的uuid
         :param api_key: 人中心生成的apikey
         :param all_data_path: 全量数据保存的路径
         :param up_data_info: 更新数据的配置
+        :param storage_type: 全量数据的存储格式，csv或者parquet
+        :param host_concurrency: 同一个域名同时进行的请求数量上限
+        :param http_timeout: 请求的（连接超时，读取超时），单位秒
+        :param strategy_publish_time: 每个交易日策略结果的发布时间，策略结果的缓存在该时间过期
+        :param strategy_disk_cache: 策略结果是否在硬盘上也缓存一份
+        :param data_info_max_age: 更新数据的配置在本地缓存的有效时间，单位秒
+        :param metrics_path: 各阶段耗时统计的导出路径，为空字符串时导出到data/metrics，为None时不导出
+        :param job_max_attempts: 数据更新任务失败次数达到该值后不再自动重试
+        :param job_retry_delay: 数据更新任务第一次失败后的重试间隔，单位秒，之后每次失败翻倍
+        :param query_cache_bytes: 读取全量数据时内存缓存的上限，单位字节
+        :param panel_fields_dict: 需要生成截面数据的产品与字段，{产品ID: [字段]}
+        :param local_strategy_dict: 可以在本地计算的因子选股策略，{策略ID: {'factor': 因子字段, 'ascending': 是否从小到大排序}}
+        :param local_strategy_fallback: 接口没有获取权限或者熔断时，是否使用本地计算的策略结果
         """
         self.url = 'https://api.quantclass.cn/api/data/'  # 获取数据的url
         self.api_key = api_key  # 个人中心生成的apikey
@@ -40,6 +100,28 @@ class BaseDataApi(object):
         if not strategy_result_path:
             strategy_result_path = './策略结果'
         self.strategy_result_path = strategy_result_path  # 最新策略结果保存路径
+        # 策略结果的缓存
+        self.strategy_cache = StrategyCache(
+            cache_path=os.path.join(strategy_result_path, 'cache') if strategy_disk_cache else None,
+            publish_time=strategy_publish_time)
+        # 策略结果的历史记录，第一次创建时导入原有的策略结果csv
+        self.strategy_store = StrategyStore(os.path.join(strategy_result_path, 'strategy_result.db'),
+                                            csv_path=strategy_result_path)
+        self.storage = get_storage(storage_type)  # 全量数据的存储方式
+        self.index_storage = get_storage('csv')  # 指数数据始终保存为单个csv
+        # 每个产品的数据格式，按照格式一次解析csv
+        self.schema_registry = SchemaRegistry(os.path.join(root_path, 'data', 'schema'))
+        # 全量数据的读取接口，按标的、日期范围与列读取，并缓存最近读取的数据
+        self.data_query = DataQuery(self, cache_bytes=query_cache_bytes)
+        # （日期 × 标的）的截面数据，第一次使用时创建
+        self.panel_fields_dict = panel_fields_dict or {}
+        self.panel_dict = {}
+        # 本地计算的因子选股策略，使用截面数据
+        self.local_strategy = LocalStrategy(self, local_strategy_dict or {})
+        self.local_strategy_fallback = local_strategy_fallback
+        self.host_concurrency = host_concurrency  # 同一个域名同时进行的请求数量上限
+        self.host_semaphore_dict = {}  # 每个域名的并发控制
+        self.host_lock = threading.Lock()
 
         # 定义请求头
         self.headers = {
@@ -47,21 +129,126 @@ class BaseDataApi(object):
             'content-type': 'application/json',
             'api-key': self.api_key
         }
+        # 所有请求共用一个带连接池的客户端
+        self.http_timeout = http_timeout
+        self.client = HttpClient(headers=self.headers, proxies=proxies, pool_size=max(host_concurrency * 2, 10),
+                                 timeout=http_timeout)
 
-        # 更新数据的配置
-        self.up_data_info = self.request_data('GET', 'https://api.quantclass.cn/api/data/get-data-info').json()
+        # 更新数据的配置，第一次使用时再获取，并在本地缓存
+        self._up_data_info = None
+        self.data_info_path = os.path.join(root_path, 'data', 'up_data_info.json')
+        self.data_info_max_age = data_info_max_age
+        self.data_info_lock = threading.Lock()
 
-        # 定义error的数据
-        self.last_error_df = pd.DataFrame(columns=['product', 'date_time', 'error'])
         # 定义error的保存路径
         self.error_path = os.path.join(root_path, 'error.csv')
-        if os.path.exists(self.error_path):  # 判断error路径是否存在
-            # 如果存在直接读取数据
-            self.last_error_df = pd.read_csv(self.error_path, encoding='gbk').drop_duplicates(
-                subset=['product', 'date_time'])
+        # （产品，日期）数据更新任务的记录，第一次创建时导入原有的error.csv
+        self.job_store = JobStore(os.path.join(root_path, 'data', 'update_job.db'), error_path=self.error_path,
+                                  max_attempts=job_max_attempts, retry_delay=job_retry_delay)
+        # 各阶段耗时统计的导出路径
+        self.metrics_path = os.path.join(root_path, 'data', 'metrics') if metrics_path == '' else metrics_path
 
         record_log(f'{"=" * 40}初始化成功{"=" * 40}')
 
+    def __getstate__(self):
+        """
+        并行时对象会被复制到joblib的子进程，锁与连接池不能复制，在子进程中重新创建。
+        子进程只负责合并数据，不获取策略结果，不复制策略结果的缓存与历史记录
+        :return:
+        """
+        state = self.__dict__.copy()
+        for key in ['client', 'host_lock', 'data_info_lock', 'strategy_cache', 'strategy_store', 'job_store',
+                    'data_query']:
+            state[key] = None
+        state['host_semaphore_dict'] = {}
+        state['panel_dict'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.host_lock = threading.Lock()
+        self.data_info_lock = threading.Lock()
+        self.client = HttpClient(headers=self.headers, proxies=proxies, pool_size=max(self.host_concurrency * 2, 10),
+                                 timeout=self.http_timeout)
+
+    @property
+    def up_data_info(self):
+        """
+        更新数据的配置，第一次使用时获取
+        :return:
+        """
+        if self._up_data_info is None:
+            with self.data_info_lock:
+                if self._up_data_info is None:
+                    self._up_data_info = self.load_data_info()
+        return self._up_data_info
+
+    @up_data_info.setter
+    def up_data_info(self, value):
+        self._up_data_info = value
+
+    def load_data_info(self):
+        """
+        获取更新数据的配置，本地缓存未过期时直接使用，过期后带上ETag与Last-Modified校验是否有更新
+        :return:
+        """
+        cache = None
+        if os.path.exists(self.data_info_path):
+            try:
+                with open(self.data_info_path, mode='r', encoding='utf8') as f:
+                    cache = json.load(f)
+            except ValueError:  # 缓存文件损坏时重新获取
+                cache = None
+        if cache and time.time() - cache['fetch_time'] < self.data_info_max_age:
+            return cache['data']
+
+        headers = {}
+        if cache and cache.get('etag'):
+            headers['If-None-Match'] = cache['etag']
+        if cache and cache.get('last_modified'):
+            headers['If-Modified-Since'] = cache['last_modified']
+        try:
+            res = self.request_data('GET', self.url + 'get-data-info', headers=headers)
+        except Exception as e:
+            if cache:  # 网络异常时使用本地缓存
+                record_log(f'获取更新数据的配置失败，使用本地缓存，错误信息为{e}', log_type='waring')
+                return cache['data']
+            raise
+        data = self.parse_data_info(res) if res.status_code == 200 else None
+        if res.status_code == 304 and cache:  # 没有更新
+            cache['fetch_time'] = time.time()
+        elif data is not None:
+            cache = {
+                'data': data,
+                'etag': res.headers.get('ETag'),
+                'last_modified': res.headers.get('Last-Modified'),
+                'fetch_time': time.time(),
+            }
+        elif cache:  # 接口出错时不覆盖本地缓存
+            record_log(f'获取更新数据的配置失败，使用本地缓存，状态码为{res.status_code}', log_type='waring')
+            return cache['data']
+        else:
+            raise ValueError(f'获取更新数据的配置失败，状态码为{res.status_code}，返回内容为{res.text[:200]}')
+        os.makedirs(os.path.dirname(self.data_info_path), exist_ok=True)
+        with open(self.data_info_path, mode='w', encoding='utf8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        return cache['data']
+
+    @staticmethod
+    def parse_data_info(res):
+        """
+        解析更新数据的配置，内容不是合法的json或者不是以产品为键的配置时（例如接口返回的错误信息）返回None
+        :param res: 状态码为200的响应
+        :return:
+        """
+        try:
+            data = res.json()
+        except ValueError:
+            return None
+        if not isinstance(data, dict) or not data or not all(isinstance(value, dict) for value in data.values()):
+            return None
+        return data
+
     @retry(stop_max_attempt_number=5)
     def zip_uncompress(self, path, save_path):
         """
@@ -112,17 +299,88 @@ class BaseDataApi(object):
         f.close()
         pass
 
-    @retry(stop_max_attempt_number=5)
+    @staticmethod
+    def get_archive_type(path):
+        """
+        根据文件开头的magic bytes判断压缩格式，不是压缩包时返回None
+        :param path:
+        :return:
+        """
+        with open(path, mode='rb') as f:
+            head = f.read(512)
+        for archive_type, magic_list in archive_magic_dict.items():
+            if any(head.startswith(magic) for magic in magic_list):
+                return archive_type
+        # tar包的标识在第257个字节
+        if head[257:262] == b'ustar':
+            return 'tar'
+        return None
+
+    def iter_archive(self, path, end_with='csv'):
+        """
+        逐个读取压缩包内的文件，不解压到硬盘
+        :param path: 压缩包路径
+        :param end_with: 只读取指定后缀的文件
+        :return: (压缩包内的相对路径, 文件内容)
+        """
+        archive_type = self.get_archive_type(path)
+        if archive_type == 'zip':
+            with zipfile.ZipFile(path) as f:
+                for info in f.infolist():
+                    if not info.is_dir() and info.filename.endswith(end_with):
+                        yield info.filename, f.read(info)
+        elif archive_type == 'tar':
+            with tarfile.open(path) as f:
+                for member in f:
+                    if member.isfile() and member.name.endswith(end_with):
+                        yield member.name, f.extractfile(member).read()
+        elif archive_type == 'rar':
+            with rarfile.RarFile(path) as f:
+                for info in f.infolist():
+                    if not info.is_dir() and info.filename.endswith(end_with):
+                        yield info.filename, f.read(info)
+        elif archive_type == '7z':
+            # 7z一般为固实压缩，需要整体解压到内存中
+            with py7zr.SevenZipFile(path, 'r') as f:
+                name_list = [name for name in f.getnames() if name.endswith(end_with)]
+                try:
+                    # py7zr.io是新版本才有的模块，旧版本使用SevenZipFile.read
+                    from py7zr.io import BytesIOFactory
+                except ImportError:
+                    for name, bio in f.read(name_list).items():
+                        yield name, bio.read()
+                else:
+                    factory = BytesIOFactory(limit=1 << 40)
+                    f.extract(targets=name_list, factory=factory)
+                    for name in name_list:
+                        bio = factory.get(name)
+                        bio.seek(0)
+                        yield name, bio.read()
+        else:
+            raise ValueError(f'{path}不是支持的压缩格式')
+
     def request_data(self, method, url, **kwargs) -> requests.models.Response:
         """
-        请求数据
+        请求数据，重试与熔断由self.client处理
         :param method: 请求方法
         :param url: 请求的url
         :return:
         """
-
-        res = requests.request(method=method, url=url, headers=self.headers, proxies=proxies, timeout=5, **kwargs)
-        if res.status_code == 200:
+        try:
+            if kwargs.get('stream'):  # 流式下载由调用方控制并发
+                res = self.client.request(method=method, url=url, **kwargs)
+            else:
+                with self.host_limit(url):
+                    res = self.client.request(method=method, url=url, **kwargs)
+        except CircuitOpenError as e:
+            # 熔断期间不再发送通知，避免刷屏
+            record_log(f'请求被熔断，{e}', log_type='waring')
+            raise
+        if res.status_code in [200, 206]:
+            return res
+        elif res.status_code == 416:  # 断点续传的范围无效，由调用方重新下载
+            return res
+        elif res.status_code == 304:  # 数据没有更新，由调用方使用本地缓存
             return res
         elif res.status_code == 404:
             if 'upyun' in url:
@@ -194,25 +452,26 @@ class BaseDataApi(object):
         else:
             return tqdm(data)
 
-    def read_file(self, path, product):
+    def read_file(self, path, product, columns=None, content=None, downcast=False):
         """
         读取数据返回一个df
         :param path:
         :param product:
+        :param columns: 只读取指定的列，为空时读取所有列
+        :param content: 文件内容，不为空时直接从内存中读取，path只用于判断文件类型
+        :param downcast: 是否使用float32减少内存占用，只用于查询，合并与写出的数据需要保持float64的精度
         :return:
         """
         # 获取文件类型，即.后面所有的字段
         file_type = path.split('.')[-1]
         all_df = pd.DataFrame()
         # 判断文件是否存在
-        if os.path.exists(path):
+        if content is not None or os.path.exists(path):
+            source = io.BytesIO(content) if content is not None else path
             if file_type == 'csv':
-                try:
-                    all_df = pd.read_csv(path, encoding='gbk', skiprows=1,
-                                         parse_dates=self.up_data_info[product]['parse_dates'])
-                except:
-                    all_df = pd.read_csv(path, encoding='gbk',
-                                         parse_dates=self.up_data_info[product]['parse_dates'])
+                all_df = self.read_csv_file(source, product, columns=columns, downcast=downcast)
+            elif file_type == 'parquet':
+                all_df = get_storage(file_type).read(path, columns=columns)
 
             elif file_type == 'pkl':
                 all_df = pd.read_pickle(path)
@@ -221,6 +480,33 @@ class BaseDataApi(object):
 
         return all_df
 
+    def read_csv_file(self, source, product, columns=None, downcast=False):
+        """
+        读取csv，已有数据格式时按照格式一次解析，解析失败或者没有数据格式时按原来的方式解析，并推断数据格式
+        :param source: 文件路径，或者内存中的文件对象
+        :param product: 产品ID
+        :param columns: 只读取指定的列，为空时读取所有列
+        :param downcast: 是否使用float32，见read_file
+        :return:
+        """
+        storage = get_storage('csv')
+        schema = self.schema_registry.get(product)
+        if schema is not None:
+            try:
+                return storage.read_schema(source, schema, parse_dates=self.up_data_info[product]['parse_dates'],
+                                           columns=columns, downcast=downcast)
+            except (pa.ArrowInvalid, ValueError, KeyError) as e:
+                # 数据格式发生变化，重新推断
+                record_log(f'{product}数据格式不匹配，重新推断，错误信息为{e}', log_type='waring')
+                self.schema_registry.remove(product)
+                if hasattr(source, 'seek'):
+                    source.seek(0)
+        skiprows = storage.get_skiprows(source)
+        df = storage.read(source, parse_dates=self.up_data_info[product]['parse_dates'], columns=columns)
+        if columns is None and not df.empty:
+            self.schema_registry.infer(product, df, skiprows, data_info=self.up_data_info[product])
+        return df
+
     def concat_data(self, df_list, product):
         """
         把增量数据和全量数据合并
@@ -228,8 +514,8 @@ class BaseDataApi(object):
         :param product:
         :return:
         """
-        # 把多个数据合并
-        df = pd.concat(df_list, ignore_index=True)
+        # 把多个数据合并，float32与float64的列按十进制对齐，避免出现精度误差
+        df = pd.concat(align_float_dtypes(df_list), ignore_index=True)
 
         # 根据配置去重
         df.drop_duplicates(self.up_data_info[product]['duplicate_removal_column'], inplace=True,
@@ -241,6 +527,36 @@ class BaseDataApi(object):
 
         return df
 
+    def append_data(self, path, df, product, journal=None, symbol=None):
+        """
+        增量数据全部排在全量数据之后时，直接把增量数据追加到文件末尾，不读取和重写整个文件
+        :param path: 全量数据路径
+        :param df: 增量数据
+        :param product: 产品ID
+        :param journal: 合并记录，追加前记录文件大小，中断后可以恢复
+        :param symbol: 标的名称
+        :return: 是否追加成功，增量数据与全量数据有重叠或者顺序不对时返回False，需要走全量合并
+        """
+        if not self.storage.exists(path):
+            return False
+        key_cols = self.up_data_info[product]['duplicate_removal_column']
+        # 只读取全量数据的最后一行，全量数据已经按照去重的列排好序，最后一行就是最大的key
+        tail_df = self.storage.read_tail(path, parse_dates=self.up_data_info[product]['parse_dates'])
+        if tail_df.empty or set(tail_df.columns) != set(df.columns):
+            return False
+        # 增量数据自身也需要去重排序
+        new_df = self.concat_data([df], product)
+        try:
+            newer = tuple(new_df.iloc[0][key_cols]) > tuple(tail_df.iloc[-1][key_cols])
+        except TypeError:  # 类型不一致无法比较，走全量合并
+            return False
+        if not newer:
+            return False
+        if journal is not None:
+            journal.start(symbol, path)
+        self.storage.append(path, new_df[tail_df.columns])
+        return True
+
     def get_down_load_link(self, product, date_time):
         """
         根据指定的产品ID与时间构建下载链接
@@ -263,134 +579,566 @@ class BaseDataApi(object):
             return []
         return res.split(',')
 
-    def save_file(self, file_url, file_name, path, save_path):
+    @staticmethod
+    def get_file_hash(file_path, block_size=1024 * 1024):
         """
-        通过数据链接下载数据
+        计算文件的sha256
+        :param file_path:
+        :param block_size:
+        :return:
+        """
+        sha256 = hashlib.sha256()
+        with open(file_path, mode='rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def get_cache_path(self, product, date_time):
+        """
+        下载文件的缓存路径，每个产品每个日期一个文件夹
+        :param product: 产品ID
+        :param date_time: 数据时间
+        :return:
+        """
+        cache_path = os.path.join(self.all_data_path, 'temp', product, str(date_time))
+        os.makedirs(cache_path, exist_ok=True)
+        return cache_path
+
+    def get_cached_file(self, path):
+        """
+        校验缓存的下载文件，文件大小与sha256都与下载时记录的一致才认为缓存有效
+        :param path: 缓存路径
+        :return: 缓存有效时返回文件名，否则返回None
+        """
+        manifest_path = os.path.join(path, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, mode='r', encoding='utf8') as f:
+            manifest = json.load(f)
+        file_path = os.path.join(path, manifest['file_name'])
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != manifest['size']:
+            return None
+        if self.get_file_hash(file_path) != manifest['sha256']:
+            return None
+        if file_path.endswith('.zip') and not zipfile.is_zipfile(file_path):
+            return None
+        return manifest['file_name']
+
+    def download_file(self, file_url, file_name, path, chunk_size=1024 * 1024):
+        """
+        通过数据链接下载数据，中断的下载会保留为.part文件，下次通过Range请求续传。
+        续传时带上开始下载时的ETag（If-Range），文件在服务器上发生变化时服务器返回完整的文件，从头下载
         :param file_url:
         :param file_name:
         :param path:
-        :param save_path:
+        :param chunk_size: 每次写入的字节数
         :return:
         """
-        # 请求数据
-        res = self.request_data(method='GET', url=file_url, stream=True)
-        if res.status_code != 200:
-            return False
         # 构建数据保存路径
         file_path = os.path.join(path, file_name)
-        # 分块保存，避免某个文件太大导致内存溢出
-        with open(file_path, mode='wb') as f:
-            for chunk in res.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
+        part_path = file_path + '.part'
+        etag_path = part_path + '.etag'
+        # 不接受压缩传输，Content-Length与Range都是文件本身的字节数
+        headers = {'Accept-Encoding': 'identity'}
+        # 下载过程中一直占用该域名的并发名额
+        with self.host_limit(file_url):
+            # 已经下载了一部分的文件，有ETag时从断点继续下载，没有ETag无法确认文件是否变化，重新下载
+            part_size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            etag = None
+            if part_size and os.path.exists(etag_path):
+                with open(etag_path, mode='r', encoding='utf8') as f:
+                    etag = f.read().strip() or None
+            if not etag:
+                part_size = 0
+            # 请求数据
+            res = self.request_data(method='GET', url=file_url, stream=True,
+                                    headers={**headers, 'Range': f'bytes={part_size}-', 'If-Range': etag}
+                                    if part_size else headers)
+            if res.status_code == 206 and self.get_range_start(res) != part_size:
+                # 返回的范围与断点不一致，不能拼接，重新下载
+                record_log(f'{file_name}续传的范围与已下载的{part_size}字节不一致，重新下载', log_type='waring')
+                res.close()
+                res = self.request_data(method='GET', url=file_url, stream=True, headers=headers)
+            elif res.status_code == 416:  # 断点无效，重新下载
+                res.close()
+                res = self.request_data(method='GET', url=file_url, stream=True, headers=headers)
+            if res.status_code not in [200, 206]:
+                return False
+            encoded = res.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+            if res.status_code == 206:
+                mode = 'ab'
+                total_size = self.get_range_total(res)
+            else:
+                # 服务器返回完整的文件，从头写入，记录ETag用于下次续传
+                mode = 'wb'
+                part_size = 0
+                total_size = int(res.headers['Content-Length']) if 'Content-Length' in res.headers else None
+                if res.headers.get('ETag') and not encoded:
+                    with open(etag_path, mode='w', encoding='utf8') as f:
+                        f.write(res.headers['ETag'])
+                elif os.path.exists(etag_path):
+                    os.remove(etag_path)
+            if encoded:
+                # 服务器仍然压缩传输时，Content-Length为压缩后的字节数，不能用来判断下载是否完整
+                total_size = None
+            # 分块保存，避免某个文件太大导致内存溢出
+            with open(part_path, mode=mode, buffering=8 * chunk_size) as f:
+                for chunk in res.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+        size = os.path.getsize(part_path)
+        if total_size is not None and size != total_size:  # 下载不完整，保留.part文件下次续传
+            record_log(f'{file_name}下载不完整，已下载{size}字节，共{total_size}字节', log_type='waring')
+            return False
+        os.replace(part_path, file_path)
+        if os.path.exists(etag_path):
+            os.remove(etag_path)
+        # 记录文件的大小与sha256，再次下载前用于校验缓存
+        manifest = {
+            'file_name': file_name,
+            'size': size,
+            'sha256': self.get_file_hash(file_path),
+            'etag': res.headers.get('ETag'),
+        }
+        with open(os.path.join(path, 'manifest.json'), mode='w', encoding='utf8') as f:
+            json.dump(manifest, f)
+        return True
+
+    @staticmethod
+    def get_range_start(res):
+        """
+        断点续传返回的Content-Range的起始位置，格式为：bytes 开始-结束/总大小
+        :param res: 206的响应
+        :return: 没有Content-Range或者格式不对时返回None
+        """
+        match = re.match(r'bytes\s+(\d+)-(\d+)/(\d+|\*)', res.headers.get('Content-Range', ''))
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def get_range_total(res):
+        """
+        断点续传返回的Content-Range中文件的总大小
+        :param res: 206的响应
+        :return: 总大小未知时返回None
+        """
+        match = re.match(r'bytes\s+(\d+)-(\d+)/(\d+)', res.headers.get('Content-Range', ''))
+        return int(match.group(3)) if match else None
+
+    def unpack_file(self, file_path, file_name, save_path):
+        """
+        根据文件类型，把下载的数据放到增量数据的文件夹
+        :param file_path:
+        :param file_name:
+        :param save_path:
+        :return:
+        """
         # 判断文件类型进行不同的操作
-        if file_name.split('.')[-1] == 'csv':
+        archive_type = self.get_archive_type(file_path)
+        if archive_type:
+            getattr(self, archive_uncompress_dict[archive_type])(file_path, save_path)
+        elif file_name.split('.')[-1] == 'csv':
             shutil.copy(file_path, os.path.join(save_path, file_name))
-        elif file_name.split('.')[-1] == 'zip':
-            self.zip_uncompress(file_path, save_path)
+
+    def save_file(self, file_url, file_name, path, save_path):
+        """
+        通过数据链接下载数据
+        :param file_url:
+        :param file_name:
+        :param path:
+        :param save_path:
+        :return:
+        """
+        if not self.download_file(file_url, file_name, path):
+            return False
+        self.unpack_file(os.path.join(path, file_name), file_name, save_path)
         return True
 
-    def update_by_group(self, file_path, all_data_path, product, multi_process=False, **kwargs):
+    def update_group_data(self, df_, file_name, all_data_path, product, journal=None):
+        """
+        把单个标的的增量数据合并到全量数据中
+        :param df_: 单个标的的增量数据
+        :param file_name: 标的名称，即全量数据的文件名
+        :param all_data_path: 全量数据保存的路径
+        :param product: 产品ID
+        :param journal: 合并记录，为空时不记录
+        :return:
+        """
+        # 根据股票代码拼接全量数据路径
+        all_data_path_ = os.path.join(all_data_path, file_name + self.storage.suffix)
+        # 获取路径
+        mk_dir = os.path.split(all_data_path_)[0]
+        if not os.path.exists(mk_dir):  # 判断路径是否存在
+            # 如果路径不存在即创建，并设置全量的数据为空的
+            os.makedirs(mk_dir)
+            all_df = pd.DataFrame()
+        else:
+            with metrics.span(product, 'append', rows=df_.shape[0]) as record:
+                appended = self.append_data(all_data_path_, df_, product, journal, file_name)
+                if not appended:
+                    record['rows'] = 0
+            if appended:
+                # 增量数据都是新的数据，已经直接追加到文件末尾
+                record_log(f'正在更新{file_name}的{product}数据，数据行数：{df_.shape[0]}行（增），直接追加', log_type='info')
+                if journal is not None:
+                    journal.done(file_name)
+                return
+            # 读取数据
+            with metrics.span(product, 'read') as record:
+                all_df = self.read_file(all_data_path_, product)
+                record['rows'] = all_df.shape[0]
+        # 把全量数据与增量数据合并
+        with metrics.span(product, 'concat') as record:
+            to_file_df = self.concat_data([all_df, df_], product)
+            record['rows'] = to_file_df.shape[0]
+        record_log(
+            f'正在更新{file_name}的{product}数据，数据行数：{df_.shape[0]}行（增）、{all_df.shape[0]}行(全)、{to_file_df.shape[0]}行(新)，数据列数：{df_.shape[1]}列（增）、{all_df.shape[1]}列(全)、{to_file_df.shape[1]}列(新)',
+            log_type='info')
+        # 写出
+        with metrics.span(product, 'write', rows=to_file_df.shape[0]):
+            self.storage.write(all_data_path_, to_file_df)
+        if journal is not None:
+            journal.done(file_name)
+
+    def update_group_batch(self, dispatch_path, task_list, all_data_path, product, journal=None):
+        """
+        并行时每个进程处理一批标的，增量数据通过内存映射的方式读取，不需要在进程间复制
+        :param dispatch_path: 按标的排好序的增量数据（arrow格式）
+        :param task_list: 每个标的在增量数据中的起始行、行数和标的名称
+        :param all_data_path: 全量数据保存的路径
+        :param product: 产品ID
+        :param journal: 合并记录
+        :return:
+        """
+        table = feather.read_table(dispatch_path, memory_map=True)
+        for start, length, file_name in task_list:
+            self.update_group_data(table.slice(start, length).to_pandas(), file_name, all_data_path, product, journal)
+
+    def update_by_group(self, file_path, all_data_path, product, multi_process=False, chunk_size=None,
+                        buffer_rows=1000000, journal=None, **kwargs):
         """
         遍历数据的每个group进行处理
-        :param file_path:
+        :param file_path: 增量数据路径，多天的数据一起合并时为按日期排序的路径列表
         :param all_data_path:
         :param product:
         :param multi_process:
+        :param chunk_size: 分块读取增量数据的行数，为空时一次读取整个文件
+        :param buffer_rows: 分块读取时，所有标的缓存的行数上限
+        :param journal: 合并记录，上次中断前已经完成的标的不再合并
+        :return:
+        """
+        if isinstance(file_path, list):
+            # 多天的增量数据按日期顺序拼接成一份，每个标的只合并一次
+            df_list = []
+            for _file_path in file_path:
+                with metrics.span(product, 'parse', bytes=os.path.getsize(_file_path)) as record:
+                    df_list.append(self.read_file(_file_path, product))
+                    record['rows'] = df_list[-1].shape[0]
+            df = pd.concat(align_float_dtypes(df_list), ignore_index=True)
+        elif chunk_size and file_path.endswith('.csv'):
+            self.update_by_group_chunks(file_path, all_data_path, product, multi_process, chunk_size, buffer_rows,
+                                        journal)
+            return
+        else:
+            # 因为数据为一个csv，所以需要先读取逐行处理
+            with metrics.span(product, 'parse', bytes=os.path.getsize(file_path)) as record:
+                df = self.read_file(file_path, product)
+                record['rows'] = df.shape[0]
+        self.update_panel(product, df)
+        if journal is not None and journal.done_set:
+            df = df[~df[self.up_data_info[product]['group']].isin(journal.done_set)]
+        self.dispatch_group_data(df, all_data_path, product, multi_process, journal)
+
+    def update_by_group_chunks(self, file_path, all_data_path, product, multi_process, chunk_size, buffer_rows,
+                               journal=None):
+        """
+        分块读取增量数据，每个标的的数据先放到各自的缓存中，标的的数据完整或者缓存已满时再合并到全量数据。
+        某个标的在上一块中出现、在最新的一块中没有出现，说明该标的的数据已经读取完整；
+        单个标的缓存超过chunk_size行，或者所有标的缓存超过buffer_rows行时，提前合并，内存占用不随文件大小增长
+        :param file_path: 增量数据路径
+        :param all_data_path: 全量数据保存的路径
+        :param product: 产品ID
+        :param multi_process: 是否并行
+        :param chunk_size: 每块的行数
+        :param buffer_rows: 所有标的缓存的行数上限
+        :param journal: 合并记录。同一个标的可能分多次合并，中断后不跳过已经完成的标的，只用于截断追加了一半的文件，
+        重新合并时已经合并过的数据在去重时去掉
         :return:
         """
+        group_col = self.up_data_info[product]['group']
+        buffer_dict = {}  # 每个标的缓存的数据
+        count_dict = {}  # 每个标的缓存的行数
+
+        def flush(code_list):
+            if not code_list:
+                return
+            df = pd.concat([_df for code in code_list for _df in buffer_dict.pop(code)], ignore_index=True)
+            for code in code_list:
+                del count_dict[code]
+            self.update_panel(product, df)
+            self.dispatch_group_data(df, all_data_path, product, multi_process, journal)
+
+        chunk_iter = get_storage('csv').read_chunks(file_path, chunk_size,
+                                                    parse_dates=self.up_data_info[product]['parse_dates'])
+        file_bytes = os.path.getsize(file_path)
+        while True:
+            with metrics.span(product, 'parse', bytes=file_bytes) as record:
+                chunk = next(chunk_iter, None)
+                record['rows'] = 0 if chunk is None else chunk.shape[0]
+            file_bytes = 0  # 文件大小只统计一次
+            if chunk is None:
+                break
+            chunk = chunk[chunk[group_col].notna()]
+            code_set = set(chunk[group_col].unique())
+            # 上一块中出现、这一块中没有出现的标的，数据已经完整
+            flush_list = [code for code in buffer_dict if code not in code_set]
+            for code, _df in chunk.groupby(group_col, sort=False):
+                buffer_dict.setdefault(code, []).append(_df)
+                count_dict[code] = count_dict.get(code, 0) + _df.shape[0]
+            flush_list += [code for code in code_set if count_dict[code] >= chunk_size]
+            if sum(count_dict.values()) - sum(count_dict[code] for code in flush_list) > buffer_rows:
+                flush_list = list(buffer_dict.keys())
+            flush(flush_list)
+        flush(list(buffer_dict.keys()))
+
+    def dispatch_group_data(self, df, all_data_path, product, multi_process=False, journal=None):
+        """
+        把增量数据按标的拆分，分别合并到每个标的的全量数据中
+        :param df: 增量数据
+        :param all_data_path: 全量数据保存的路径
+        :param product: 产品ID
+        :param multi_process: 是否并行
+        :param journal: 合并记录
+        :return:
+        """
+        group_col = self.up_data_info[product]['group']
+        # 按标的排序一次，每个标的的数据就是连续的一段，稳定排序保证标的内部的数据顺序不变
+        df = df[df[group_col].notna()].sort_values(group_col, kind='stable', ignore_index=True)
+        code_array = df[group_col].to_numpy()
+        start_array = np.flatnonzero(np.r_[True, code_array[1:] != code_array[:-1]]) if len(df) else np.array([], int)
+        length_array = np.diff(np.r_[start_array, len(df)])
+        task_list = list(zip(start_array.tolist(), length_array.tolist(), code_array[start_array].tolist()))
 
-        # 更新数据的主函数，封装为函数便于并行
-        def up(df_, file_name):
-            # 根据股票代码拼接全量数据路径
-            all_data_path_ = os.path.join(all_data_path, file_name + '.csv')
-            # 获取路径
-            mk_dir = all_data_path_ if not all_data_path_.endswith('csv') else os.path.split(all_data_path_)[0]
-            if not os.path.exists(mk_dir):  # 判断路径是否存在
-                # 如果路径不存在即创建，并设置全量的数据为空的
-                os.makedirs(mk_dir)
-                all_df = pd.DataFrame()
-            else:
-                # 读取数据
+        # 开始并行或者串行读取所有增量数据
+        if multi_process:  # 并行
+            # 增量数据写成不压缩的arrow文件，子进程通过内存映射读取自己负责的部分
+            temp_path = os.path.join(self.all_data_path, 'temp', 'dispatch')
+            os.makedirs(temp_path, exist_ok=True)
+            dispatch_path = os.path.join(temp_path, f'{product}.arrow')
+            write_feather(df, dispatch_path)
+            del df
+
+            # 每个进程一次处理一批标的，减少任务的调度与序列化
+            n_jobs = max(cpu_count() - 1, 1)
+            batch_list = [batch.tolist() for batch in np.array_split(np.arange(len(task_list)), n_jobs * 4) if len(batch)]
+            traverse_object = self.judgment_system(batch_list)
+            # 子进程的统计记录随结果一起返回，在主进程中汇总
+            for _, record_list in Parallel(n_jobs=n_jobs)(
+                    delayed(capture_call)(self.update_group_batch, dispatch_path, [task_list[i] for i in batch],
+                                          all_data_path, product, journal)
+                    for batch in traverse_object):
+                metrics.merge(record_list)
+            os.remove(dispatch_path)
+        else:  # 串行
+            for start, length, file_name in self.judgment_system(task_list):
+                self.update_group_data(df.iloc[start:start + length], file_name, all_data_path, product, journal)
+
+    def update_file_data(self, relative_path, all_data_path, product, new_path=None, content=None, journal=None):
+        """
+        把单个增量文件合并到全量数据中
+        :param relative_path: 增量文件在增量数据文件夹（或者压缩包）内的相对路径
+        :param all_data_path: 全量数据保存的路径
+        :param product: 产品ID
+        :param new_path: 增量文件的路径，解压到硬盘时使用。多天的数据一起合并时为按日期排序的路径列表
+        :param content: 增量文件的内容，直接从压缩包读取时使用
+        :param journal: 合并记录，为空时不记录
+        :return:
+        """
+        all_data_path_ = os.path.join(all_data_path, *relative_path.replace('\\', '/').split('/'))
+        # 根据存储格式替换文件后缀
+        if all_data_path_.endswith('.csv'):
+            all_data_path_ = all_data_path_[:-len('.csv')] + self.storage.suffix
+        new_path_list = new_path if isinstance(new_path, list) else [new_path or relative_path]
+        new_path = new_path_list[-1]
+        new_bytes = len(content) if content is not None else sum(os.path.getsize(path) for path in new_path_list)
+
+        def read_new_data():
+            if len(new_path_list) == 1:
+                return pd.DataFrame(self.read_file(new_path, product, content=content))
+            # 多天的增量数据先按照去重规则合并成一份
+            return self.concat_data([self.read_file(path, product) for path in new_path_list], product)
+
+        if not self.storage.exists(all_data_path_):  # 判断文件是否存在
+            mk_dir = os.path.split(all_data_path_)[0]
+            if not os.path.exists(mk_dir):
+                os.makedirs(mk_dir, exist_ok=True)
+            record_log(f'{product}数据复制至{all_data_path_}', log_type='info')
+            with metrics.span(product, 'write', bytes=new_bytes):
+                if len(new_path_list) > 1 or not new_path.endswith(self.storage.suffix):
+                    self.storage.write(all_data_path_, read_new_data())
+                elif content is not None:  # 格式一致，直接写出压缩包内的原始内容，先写临时文件再替换
+                    tmp_path = f'{all_data_path_}.{os.getpid()}.tmp'
+                    with open(tmp_path, mode='wb') as f:
+                        f.write(content)
+                    os.replace(tmp_path, all_data_path_)
+                else:
+                    shutil.move(new_path, all_data_path_)
+        else:
+            with metrics.span(product, 'read') as record:
                 all_df = self.read_file(all_data_path_, product)
-            # 把全量数据与增量数据合并
-            to_file_df = self.concat_data([all_df, df_], product)
+                record['rows'] = all_df.shape[0]
+            with metrics.span(product, 'parse', bytes=new_bytes) as record:
+                new_df = read_new_data()
+                record['rows'] = new_df.shape[0]
+
+            with metrics.span(product, 'concat') as record:
+                df = self.concat_data([all_df, new_df], product)
+                record['rows'] = df.shape[0]
             record_log(
-                f'正在更新{file_name}的{product}数据，数据行数：{df_.shape[0]}行（增）、{all_df.shape[0]}行(全)、{to_file_df.shape[0]}行(新)，数据列数：{df_.shape[1]}列（增）、{all_df.shape[1]}列(全)、{to_file_df.shape[1]}列(新)',
+                f'正在更新{new_path}的{product}数据，数据行数：{new_df.shape[0]}行（增）、{all_df.shape[0]}行(全)、{df.shape[0]}行(新)，数据列数：{new_df.shape[1]}列（增）、{all_df.shape[1]}列(全)、{df.shape[1]}列(新)',
                 log_type='info')
             # 写出
-            to_file_df.columns = pd.MultiIndex.from_tuples(
-                zip(['数据由邢不行整理，对数据字段有疑问的，可以直接微信私信邢不行，微信号：xbx297'] + [''] * (
-                        to_file_df.shape[1] - 1), to_file_df.columns))
-            to_file_df.to_csv(all_data_path_, index=False, encoding='gbk')
-
-        # 因为数据为一个csv，所以需要先读取逐行处理
-        df = self.read_file(file_path, product)
-        group = df.groupby(self.up_data_info[product]['group'])
+            with metrics.span(product, 'write', rows=df.shape[0]):
+                self.storage.write(all_data_path_, df)
+        if journal is not None:
+            journal.done(relative_path)
 
-        # 获取遍历的对象
-        traverse_object = self.judgment_system(group.groups.values())
-
-        # 开始并行或者串行读取所有增量数据
-        if multi_process:  # 并行
-            Parallel(n_jobs=max(cpu_count() - 1, 1))(
-                delayed(up)(pd.DataFrame(df.loc[i]), df.loc[i[0], self.up_data_info[product]['group']]) for
-                i in traverse_object)
-        else:  # 串行
-            for i in traverse_object:
-                up(pd.DataFrame(df.loc[i]), df.loc[i[0], self.up_data_info[product]['group']])
-
-    def update_by_file(self, all_data_path, product, multi_process=False, **kwargs):
+    def update_by_file(self, all_data_path, product, multi_process=False, archive_path=None, journal=None, **kwargs):
         """
         遍历文件内的数据，每一个文件的处理
         :param all_data_path:
         :param product:
         :param multi_process:
-        :param kwargs:
-        :return:
-        """
-
-        # 更新数据的主函数，封装为函数便于并行
-        def up(new_path, _save_path, all_data_path_):
-            # 处理文件路径
-            _save_path = _save_path.replace('\\', '/')
-            new_path = new_path.replace('\\', '/')
-            all_data_path_ = os.path.join(all_data_path_, re.findall('%s(.*)' % _save_path, new_path)[0][1:])
-            if not os.path.exists(all_data_path_):  # 判断文件夹是否存在
-                mk_dir = all_data_path_ if not all_data_path_.endswith('csv') else os.path.split(all_data_path_)[0]
-                if not os.path.exists(mk_dir):
-                    os.makedirs(mk_dir)
-                record_log(f'{product}数据复制至{all_data_path_}', log_type='info')
-                shutil.move(new_path, all_data_path_)
-            else:
-                all_df = self.read_file(all_data_path_, product)
-                new_df = pd.DataFrame(self.read_file(new_path, product))
-
-                df = self.concat_data([all_df, new_df], product)
-                record_log(
-                    f'正在更新{new_path}的{product}数据，数据行数：{new_df.shape[0]}行（增）、{all_df.shape[0]}行(全)、{df.shape[0]}行(新)，数据列数：{new_df.shape[1]}列（增）、{all_df.shape[1]}列(全)、{df.shape[1]}列(新)',
-                    log_type='info')
-                # 写出
-                df.columns = pd.MultiIndex.from_tuples(
-                    zip(['数据由邢不行整理，对数据字段有疑问的，可以直接微信私信邢不行，微信号：xbx297'] + [''] * (
-                            df.shape[1] - 1), df.columns))
-                df.to_csv(all_data_path_, index=False, encoding='gbk')
-
+        :param archive_path: 压缩包路径，不为空时直接从压缩包内读取增量文件，不需要解压到硬盘
+        :param journal: 合并记录，上次中断前已经完成的文件不再合并
+        :param kwargs: save_path为增量数据的文件夹，多天的数据一起合并时为按日期排序的文件夹列表
+        :return:
+        """
         # 获取所有增量数据
-        save_path = kwargs['save_path']
-        file_path_list = self.get_code_list_in_one_dir(save_path)
+        if archive_path:
+            # 压缩包内的文件逐个读取到内存中，(相对路径, 文件内容)
+            traverse_object = ((name, None, content) for name, content in self.iter_archive(archive_path))
+        elif isinstance(kwargs['save_path'], list):
+            # 多天的增量数据，同一个文件的多天数据一起合并，(相对路径, 按日期排序的文件路径列表)
+            path_dict = {}
+            for save_path in kwargs['save_path']:
+                for file_path in self.get_code_list_in_one_dir(save_path):
+                    path_dict.setdefault(os.path.relpath(file_path, save_path), []).append(file_path)
+            traverse_object = ((relative_path, path_list, None) for relative_path, path_list in path_dict.items())
+        else:
+            save_path = kwargs['save_path']
+            traverse_object = ((os.path.relpath(file_path, save_path), file_path, None) for file_path in
+                               self.get_code_list_in_one_dir(save_path))
+        if journal is not None and journal.done_set:
+            traverse_object = (item for item in traverse_object if not journal.is_done(item[0]))
 
         # 获取遍历的对象
-        traverse_object = self.judgment_system(file_path_list)
+        traverse_object = self.judgment_system(traverse_object)
 
         # 开始并行或者串行读取所有增量数据
         if multi_process:  # 并行
-            Parallel(n_jobs=max(cpu_count() - 2, 1))(
-                delayed(up)(file_path, save_path, all_data_path) for file_path in
-                traverse_object)
+            # 子进程的统计记录随结果一起返回，在主进程中汇总
+            for _, record_list in Parallel(n_jobs=max(cpu_count() - 2, 1))(
+                    delayed(capture_call)(self.update_file_data, relative_path, all_data_path, product, new_path,
+                                          content, journal)
+                    for relative_path, new_path, content in traverse_object):
+                metrics.merge(record_list)
         else:  # 串行
-            for file_path in traverse_object:
-                up(file_path, save_path, all_data_path)
+            for relative_path, new_path, content in traverse_object:
+                self.update_file_data(relative_path, all_data_path, product, new_path, content, journal)
+
+    def get_panel(self, product):
+        """
+        获取产品的截面数据
+        :param product: 产品ID
+        :return: 没有配置截面数据的产品返回None
+        """
+        if product not in self.panel_fields_dict:
+            return None
+        if product not in self.panel_dict:
+            data_info = self.up_data_info[product]
+            self.panel_dict[product] = PanelStore(os.path.join(self.all_data_path, 'panel', product),
+                                                  self.panel_fields_dict[product],
+                                                  date_col=data_info['parse_dates'][0], symbol_col=data_info['group'])
+        return self.panel_dict[product]
+
+    def build_panel(self, product='stock-trading-data-pro', max_workers=4):
+        """
+        根据全量数据重新生成截面数据，之后合并增量数据时同步更新
+        :param product: 产品ID
+        :param max_workers: 并发读取全量数据的线程数
+        :return:
+        """
+        panel = self.get_panel(product)
+        if panel is None:
+            record_log(f'{product}没有配置截面数据的字段', log_type='waring')
+            return None
+        symbol_list = self.data_query.symbols(product)
+        path_list = [os.path.join(self.all_data_path, product, symbol + self.storage.suffix) for symbol in symbol_list]
+
+        # 第一遍只读取日期列，确定所有的日期
+        def read_date(path):
+            df = self.read_file(path, product, columns=[panel.date_col])
+            return pd.to_datetime(df[panel.date_col]).dt.strftime('%Y-%m-%d').unique()
+
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+            date_set = set()
+            for date_array in pool.map(read_date, path_list):
+                date_set.update(date_array)
+        panel.clear()
+        panel.create(sorted(date_set), symbol_list)
+
+        # 第二遍读取每个标的的数据，写入自己的列
+        def write_symbol(symbol, path):
+            # float32转换为float64会带上精度误差，与增量更新写入的值不一致，截面数据为float64时按原精度读取
+            df = self.read_file(path, product, downcast=panel.dtype == np.float32)
+            df[panel.symbol_col] = symbol
+            panel.write_values(df)
+
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+            list(pool.map(write_symbol, symbol_list, path_list))
+        record_log(f'{product}截面数据生成完成，共{len(date_set)}个日期、{len(symbol_list)}个标的')
+        return panel
+
+    def update_panel(self, product, df):
+        """
+        合并增量数据时同步更新截面数据，截面数据还没有生成时不更新
+        :param product: 产品ID
+        :param df: 增量数据
+        :return:
+        """
+        panel = self.get_panel(product)
+        if panel is None or panel.load_meta() is None:
+            return
+        try:
+            with metrics.span(product, 'panel', rows=df.shape[0]):
+                panel.update(df)
+        except Exception as e:
+            # 截面数据更新失败不影响全量数据的合并，重新生成即可
+            record_log(f'{product}截面数据更新失败，需要重新生成，错误信息为{e}', log_type='waring')
+
+    def export_csv(self, product, to_path=None):
+        """
+        把全量数据导出为官方格式的gbk csv，目录结构与官方数据保持一致
+        :param product: 产品ID
+        :param to_path: 导出路径，为空时导出到全量数据路径下的csv_export文件夹
+        :return:
+        """
+        if not to_path:
+            to_path = os.path.join(self.all_data_path, 'csv_export', product)
+        product_path = os.path.join(self.all_data_path, product)
+        suffix = self.storage.suffix
+        for root, dirs, files in os.walk(product_path):
+            # csv的每个标的是一个文件，parquet的每个标的是一个文件夹
+            name_list = [f for f in (files if suffix == '.csv' else dirs) if f.endswith(suffix)]
+            dirs[:] = [d for d in dirs if not d.endswith(suffix)]
+            for name in name_list:
+                path = os.path.join(root, name)
+                to_file_path = os.path.join(to_path, os.path.relpath(path, product_path)[:-len(suffix)] + '.csv')
+                if not os.path.exists(os.path.dirname(to_file_path)):
+                    os.makedirs(os.path.dirname(to_file_path))
+                self.storage.export_csv(path, to_file_path)
+        record_log(f'{product}数据导出至{to_path}', log_type='info')
+        return to_path
 
     @staticmethod
     def delete_history_data(path):
@@ -402,19 +1150,39 @@ class BaseDataApi(object):
         now_time = datetime.datetime.now()
         file_list = os.listdir(path)
         for file in file_list:
-            file_time = pd.to_datetime(file.split('.')[0])
+            try:
+                file_time = pd.to_datetime(file.split('.')[0])
+            except (ValueError, TypeError):  # 不是以日期命名的文件不处理
+                continue
             if file_time < now_time - datetime.timedelta(days=7):
-                os.remove(os.path.join(path, file))
+                # 下载缓存是每个日期一个文件夹
+                if os.path.isdir(os.path.join(path, file)):
+                    shutil.rmtree(os.path.join(path, file))
+                else:
+                    os.remove(os.path.join(path, file))
 
-    def update_single_data(self, product, date_time=None, multi_process=False,
-                           **kwargs) -> pd.DataFrame:
+    def get_product_path(self, product):
         """
-        数据更新类主函数
+        获取产品的全量数据路径、下载文件路径、增量数据路径，不存在则创建
         :param product: 产品ID
-        :param date_time: 获取时间，如果是空自动获取最新的日期
-        :param multi_process: 是否并行
         :return:
         """
+        # 根据产品ID拼接全量数据路径
+        all_data_path = os.path.join(self.all_data_path, product)
+        path = os.path.join(self.all_data_path, 'temp', product)
+        save_path = os.path.join(self.all_data_path, 'xbx_temporary_data', product)
+        for _path in [all_data_path, path, save_path]:
+            # 多个线程可能同时创建，已存在时不报错
+            os.makedirs(_path, exist_ok=True)
+        return all_data_path, path, save_path
+
+    def download_single_data(self, product, date_time=None):
+        """
+        获取下载链接并下载单个产品单个日期的数据
+        :param product: 产品ID
+        :param date_time: 获取时间，如果是空自动获取最新的日期
+        :return: 更新结果，以及下载的文件名（跳过或者下载失败时为None）
+        """
         if not date_time:
             date_time = pd.DataFrame(self.get_latest_data_time(product))[0].max()
 
@@ -429,30 +1197,30 @@ class BaseDataApi(object):
             record_log(f'下载数据：{product}，下载时间：{date_time}，所下载数据日期超过30天，直接跳过', log_type='info',
                        send=True,
                        robot_type='info')
-            return pd.DataFrame(ret_dict)
+            return ret_dict, None
 
-        # 根据产品ID拼接全量数据路径
-        all_data_path = os.path.join(self.all_data_path, product)
-        if not os.path.exists(all_data_path):  # 判断文件夹是否存在
-            os.mkdir(all_data_path)  # 不存在则创建
-        path = os.path.join(self.all_data_path, 'temp', product)
-        if not os.path.exists(path):  # 判断文件夹是否存在
-            os.makedirs(path)  # 不存在则创建
-        save_path = os.path.join(self.all_data_path, 'xbx_temporary_data', product)
-        if not os.path.exists(save_path):  # 判断文件夹是否存在
-            os.makedirs(save_path)  # 不存在则创建
+        all_data_path, path, save_path = self.get_product_path(product)
+        cache_path = self.get_cache_path(product, date_time)
+
+        # 已经下载过且校验通过的数据直接使用，不再消耗下载次数
+        file_name = self.get_cached_file(cache_path)
+        if file_name:
+            record_log(f'{product}({date_time})使用已下载的数据{file_name}')
+            return ret_dict, file_name
 
         # ===================  记录日志  ===================
         record_log(f'开始获取{product}数据，日期为{date_time}')
         # ===================  记录日志  ===================
 
-        get_file_url_res = self.get_down_load_link(product=product, date_time=date_time)
+        with metrics.span(product, 'link'):
+            get_file_url_res = self.get_down_load_link(product=product, date_time=date_time)
         if get_file_url_res.status_code != 200:
             record_log(f'{product}获取下载链接失败，返回状态码：{get_file_url_res.status_code}', send=True,
                        robot_type='waring')
             print(f'{product}获取下载链接失败，返回状态码：{get_file_url_res.status_code}')
             ret_dict['error'] = True
-            return pd.DataFrame(ret_dict)
+            ret_dict['message'] = f'获取下载链接失败，返回状态码：{get_file_url_res.status_code}'
+            return ret_dict, None
         file_url = get_file_url_res.text
 
         file_name = re.findall('%s.*?\/(.*?)\?' % product, file_url)[0]
@@ -462,198 +1230,540 @@ class BaseDataApi(object):
         # ===================  记录日志  ===================
 
         # 保存文件
-        judge = self.save_file(file_url=file_url, file_name=file_name, path=path, save_path=save_path)
+        with metrics.span(product, 'download') as record:
+            judge = self.download_file(file_url=file_url, file_name=file_name, path=cache_path)
+            if judge:
+                record['bytes'] = os.path.getsize(os.path.join(cache_path, file_name))
         if not judge:
             record_log(f'{product}保存失败', send=True, robot_type='waring')
             print(f'{product}保存失败，请检查下载链接')
             ret_dict['error'] = True
-            return pd.DataFrame(ret_dict)
+            ret_dict['message'] = '保存失败'
+            return ret_dict, None
         print(f'{product}({date_time})保存成功')
+        return ret_dict, file_name
+
+    def merge_single_data(self, product, date_time, file_name, multi_process=False, stream_archive=True, **kwargs):
+        """
+        把下载好的增量数据合并到全量数据中
+        :param product: 产品ID
+        :param date_time: 数据时间
+        :param file_name: 下载的文件名
+        :param multi_process: 是否并行
+        :param stream_archive: 按文件更新的数据是压缩包时，是否直接从压缩包读取，不解压到硬盘
+        :return:
+        """
+        all_data_path, path, save_path = self.get_product_path(product)
+        file_path = os.path.join(self.get_cache_path(product, date_time), file_name)
+        fun = self.up_data_info[product]['fun']
+        # 上次合并中断时，截断追加了一半的文件，合并的是同一天时已经完成的标的不再合并
+        journal = MergeJournal(os.path.join(path, 'journal.jsonl'), key=str(date_time))
+        done_set = journal.recover()
+        if done_set:
+            record_log(f'{product}({date_time})上次合并中断，跳过已经完成的{len(done_set)}个标的', log_type='info')
+        if stream_archive and fun == 'update_by_file' and self.get_archive_type(file_path):
+            kwargs['archive_path'] = file_path
+        else:
+            with metrics.span(product, 'unpack', bytes=os.path.getsize(file_path)):
+                self.unpack_file(file_path, file_name, save_path)
         # 调用指定的代码对增量数据进行处理
-        eval('self.' + self.up_data_info[product]['fun'])(all_data_path=all_data_path, product=product,
-                                                          file_path=os.path.join(save_path, file_name),
-                                                          save_path=save_path, multi_process=multi_process)
+        with metrics.span(product, 'merge', bytes=os.path.getsize(file_path)):
+            eval('self.' + fun)(all_data_path=all_data_path, product=product,
+                                file_path=os.path.join(save_path, file_name),
+                                save_path=save_path, multi_process=multi_process,
+                                journal=journal, **kwargs)
+        journal.remove()
         shutil.rmtree(save_path)
         # ===================  记录日志  ===================
         record_log(f'{product}({date_time})数据写入完成')
         # ===================  记录日志  ===================
 
-        # 判断历史下载文件是否还需要保留
-        self.delete_history_data(path)
+    def merge_multi_data(self, product, date_file_list, multi_process=False, **kwargs):
+        """
+        把下载好的多天增量数据一次合并到全量数据中，每个标的的全量数据只读取和写出一次，
+        多天数据中重复的记录按照up_data_info中的去重规则处理，与逐天合并的结果一致
+        :param product: 产品ID
+        :param date_file_list: 每天的（数据时间，下载的文件名）
+        :param multi_process: 是否并行
+        :return:
+        """
+        date_file_list = sorted(date_file_list, key=lambda x: pd.to_datetime(x[0]))
+        fun = self.up_data_info[product]['fun']
+        if len(date_file_list) == 1 or fun not in ['update_by_group', 'update_by_file']:
+            for date_time, file_name in date_file_list:
+                self.merge_single_data(product, date_time, file_name, multi_process=multi_process, **kwargs)
+            return
+        kwargs.pop('stream_archive', None)
+        all_data_path, path, save_path = self.get_product_path(product)
+        first_date, last_date = date_file_list[0][0], date_file_list[-1][0]
+        # 上次合并中断时，截断追加了一半的文件，合并的是同样的几天时已经完成的标的不再合并
+        journal = MergeJournal(os.path.join(path, 'journal.jsonl'),
+                               key=','.join(str(date_time) for date_time, _ in date_file_list))
+        done_set = journal.recover()
+        if done_set:
+            record_log(f'{product}({first_date}~{last_date})上次合并中断，跳过已经完成的{len(done_set)}个标的',
+                       log_type='info')
+        # 每天的数据解压到各自的文件夹
+        file_path_list, save_path_list, file_bytes = [], [], 0
+        for date_time, file_name in date_file_list:
+            file_path = os.path.join(self.get_cache_path(product, date_time), file_name)
+            day_save_path = os.path.join(save_path, str(date_time))
+            os.makedirs(day_save_path, exist_ok=True)
+            with metrics.span(product, 'unpack', bytes=os.path.getsize(file_path)):
+                self.unpack_file(file_path, file_name, day_save_path)
+            file_path_list.append(os.path.join(day_save_path, file_name))
+            save_path_list.append(day_save_path)
+            file_bytes += os.path.getsize(file_path)
+        # 调用指定的代码对增量数据进行处理
+        with metrics.span(product, 'merge', bytes=file_bytes):
+            eval('self.' + fun)(all_data_path=all_data_path, product=product, file_path=file_path_list,
+                                save_path=save_path_list, multi_process=multi_process, journal=journal, **kwargs)
+        journal.remove()
+        shutil.rmtree(save_path)
+        # ===================  记录日志  ===================
+        record_log(f'{product}({first_date}~{last_date})共{len(date_file_list)}天的数据写入完成')
+        # ===================  记录日志  ===================
+
+    def update_single_data(self, product, date_time=None, multi_process=False,
+                           **kwargs) -> pd.DataFrame:
+        """
+        数据更新类主函数
+        :param product: 产品ID
+        :param date_time: 获取时间，如果是空自动获取最新的日期
+        :param multi_process: 是否并行
+        :return:
+        """
+        ret_dict, file_name = self.download_single_data(product, date_time=date_time)
+        if file_name:
+            self.merge_single_data(product, ret_dict['date_time'][0], file_name, multi_process=multi_process, **kwargs)
+            # 判断历史下载文件是否还需要保留
+            self.delete_history_data(os.path.join(self.all_data_path, 'temp', product))
         return pd.DataFrame(ret_dict)
 
-    def update_all_data(self, data_white_list, data_white_list_dict , mode='all', **kwargs):
+    @contextmanager
+    def host_limit(self, url):
         """
-        批量更新数据
-        :param data_white_list: 指定下载的数据
-        :param mode:    指定下载模式
-        :param kwargs:
+        限制同一个域名同时进行的请求数量
+        :param url: 请求的url
         :return:
         """
-        df_list = []
+        host = urlparse(url).netloc
+        with self.host_lock:
+            if host not in self.host_semaphore_dict:
+                self.host_semaphore_dict[host] = threading.BoundedSemaphore(self.host_concurrency)
+            semaphore = self.host_semaphore_dict[host]
+        with semaphore:
+            yield
 
-        # 如果下载模式是all或者new下载增量的数据
-        if mode in ['all', 'new']:
-            for product in data_white_list:
-                record_log("开始更新:"+data_white_list_dict[product], send=True)
-                if kwargs['date_time'] and (type(kwargs['date_time']) != 'list'):
-                    date_time_list = kwargs['date_time'].split(',')
-                else:
-                    date_time_list = self.get_latest_data_time(product)
-
-                for date_time in date_time_list:
-                    condition = self.last_error_df['product'] == product
-                    condition &= self.last_error_df['date_time'] == date_time
-                    try:
-                        date_time_ = kwargs['date_time']
-                        del kwargs['date_time']
-                        df = self.update_single_data(product, date_time=date_time, **kwargs)
-
-                        df_list.append(df)
-                    except Exception as e:
-                        print(traceback.format_exc())
-                        # ===================  记录日志  ===================
-                        record_log(f'发生报错，错误信息为{e}，报错输出为{traceback.format_exc()}', send=True,
-                                   robot_type='waring')
-                        # ===================  记录日志  ===================
-                        ret_dict = {
-                            'product': [product],
-                            'date_time': [date_time],
-                            'error': [True]
-                        }
-                        df_list.append(pd.DataFrame(ret_dict))
-                    kwargs['date_time'] = date_time_
-        now_error_df = pd.DataFrame(columns=['product', 'date_time', 'error'])
-        if df_list:
-            now_error_df = pd.concat(df_list, ignore_index=True)
-        now_error_df['code'] = 'now'
-        self.last_error_df['code'] = 'last'
-        error_df = pd.concat([now_error_df, self.last_error_df], ignore_index=True).drop_duplicates(
-            subset=['product', 'date_time'], keep='first')
-        # 如果下载模式是all或者error下载上次下载报错的数据
-        if mode in ['all', 'error']:
-            last_error_df = error_df[error_df['error'] & (error_df['code'] == 'last')]
-            for i in last_error_df.index:
-                product = last_error_df.loc[i]['product']
-                date_time = last_error_df.loc[i]['date_time']
-                kwargs['date_time'] = date_time
-                condition = error_df['product'] == product
-                condition &= error_df['date_time'] == date_time
+    @staticmethod
+    def get_error_df(product, date_time, e):
+        """
+        发生报错时记录日志，并返回报错的更新结果
+        :param product: 产品ID
+        :param date_time: 数据时间
+        :param e: 报错信息
+        :return:
+        """
+        print(traceback.format_exc())
+        # ===================  记录日志  ===================
+        record_log(f'发生报错，错误信息为{e}，报错输出为{traceback.format_exc()}', send=True,
+                   robot_type='waring')
+        # ===================  记录日志  ===================
+        ret_dict = {
+            'product': [product],
+            'date_time': [date_time],
+            'error': [True],
+            'message': [str(e)]
+        }
+        return pd.DataFrame(ret_dict)
+
+    def update_data_list(self, data_list, max_workers=1, backfill=False, **kwargs):
+        """
+        批量更新多个（产品，日期）的数据
+        max_workers大于1时，所有数据的下载链接与文件并发获取，不同产品的合并并发进行，同一个产品的合并按照日期顺序依次进行
+        :param data_list: 需要更新的（产品，日期）列表
+        :param max_workers: 并发的线程数，1表示串行
+        :param backfill: 同一个产品有多天的数据时，先下载所有日期，再一次合并，每个标的的全量数据只读写一次
+        :return: 每个（产品，日期）的更新结果
+        """
+        df_list = []
+        if max_workers <= 1 and not backfill:  # 串行
+            for product, date_time in data_list:
                 try:
-                    code = self.update_single_data(product, **kwargs)
-                    error_df.loc[condition, 'error'] = code.iloc[0]['error']
+                    df_list.append(self.update_single_data(product, date_time=date_time, **kwargs))
                 except Exception as e:
-                    print(traceback.format_exc())
-                    # ===================  记录日志  ===================
-                    record_log(f'发生报错，错误信息为{e}，报错输出为{traceback.format_exc()}', send=True,
-                               robot_type='waring',
-                               log_type='waring')
-                    # ===================  记录日志  ===================
-
-                    error_df.loc[condition, 'error'] = True
-
-        if not error_df.empty:
-            del error_df['code']
-            error_df = error_df[error_df['error']]
-            error_df.to_csv(self.error_path, encoding='gbk', index=False)
+                    df_list.append(self.get_error_df(product, date_time, e))
+            return df_list
+
+        # 同一个产品的数据按照日期顺序合并
+        product_dict = {}
+        for product, date_time in data_list:
+            product_dict.setdefault(product, []).append(date_time)
+
+        def merge_product(product, future_list):
+            if backfill:
+                return backfill_product(product, future_list)
+            _df_list = []
+            for date_time, future in future_list:
+                try:
+                    ret_dict, file_name = future.result()
+                    if file_name:
+                        self.merge_single_data(product, date_time, file_name, **kwargs)
+                    _df_list.append(pd.DataFrame(ret_dict))
+                except Exception as e:
+                    _df_list.append(self.get_error_df(product, date_time, e))
+            # 该产品所有日期都合并完成之后，再清理历史下载文件
+            self.delete_history_data(os.path.join(self.all_data_path, 'temp', product))
+            return _df_list
+
+        def backfill_product(product, future_list):
+            # 等待所有日期下载完成，下载成功的日期一起合并
+            ret_dict_list, date_file_list, _df_list = [], [], []
+            for date_time, future in future_list:
+                try:
+                    ret_dict, file_name = future.result()
+                except Exception as e:
+                    _df_list.append(self.get_error_df(product, date_time, e))
+                    continue
+                ret_dict_list.append(ret_dict)
+                if file_name:
+                    date_file_list.append((date_time, file_name))
+            try:
+                if date_file_list:
+                    self.merge_multi_data(product, date_file_list, **kwargs)
+                _df_list += [pd.DataFrame(ret_dict) for ret_dict in ret_dict_list]
+            except Exception as e:
+                # 合并失败时，一起合并的日期都记为失败
+                merge_date_list = [date_time for date_time, _ in date_file_list]
+                _df_list += [pd.DataFrame(ret_dict) for ret_dict in ret_dict_list
+                             if ret_dict['date_time'][0] not in merge_date_list]
+                _df_list += [self.get_error_df(product, date_time, e) for date_time in merge_date_list]
+            self.delete_history_data(os.path.join(self.all_data_path, 'temp', product))
+            return _df_list
+
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as download_pool, \
+                ThreadPoolExecutor(max_workers=max(max_workers, 1)) as merge_pool:
+            merge_future_list = []
+            for product, date_time_list in product_dict.items():
+                future_list = [(date_time, download_pool.submit(self.download_single_data, product, date_time))
+                               for date_time in date_time_list]
+                merge_future_list.append(merge_pool.submit(merge_product, product, future_list))
+            for future in merge_future_list:
+                df_list.extend(future.result())
+        return df_list
+
+    def update_all_data(self, data_white_list, data_white_list_dict, mode='all', max_workers=1, priority_dict=None,
+                        **kwargs):
+        """
+        批量更新数据，每个（产品，日期）作为一个任务记录在任务数据库中，失败的任务退避一段时间后再重试
+        :param data_white_list: 指定下载的数据
+        :param mode:    指定下载模式，all：新的数据以及到达重试时间的失败任务；new：只更新新的数据；error：只重试失败的任务
+        :param max_workers: 并发下载与合并的线程数，1表示串行
+        :param priority_dict: 每个产品的优先级，数字越小越先执行，没有配置的产品为10
+        :param kwargs: date_time：手动指定的日期，逗号分隔的字符串或者列表，这些日期的任务重新执行
+        :return:
+        """
+        date_time = kwargs.pop('date_time', None)
+        priority_dict = priority_dict or {}
+        metrics.reset()
+        # 上次运行中断时还在执行的任务重新执行
+        self.job_store.recover()
+
+        # 如果下载模式是all或者new，把增量的数据添加为任务
+        if mode in ['all', 'new']:
+            def get_date_time_list(product):
+                record_log("开始更新:" + data_white_list_dict[product], send=True)
+                if date_time and not isinstance(date_time, list):
+                    return date_time.split(',')
+                elif date_time:
+                    return date_time
+                return self.get_latest_data_time(product)
+
+            with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+                date_time_lists = list(pool.map(get_date_time_list, data_white_list))
+            for product, date_time_list in zip(data_white_list, date_time_lists):
+                for _date_time in date_time_list:
+                    # 手动指定的日期即使已经完成也重新更新，最新日期中已经存在的任务保持原来的状态
+                    self.job_store.add(product, _date_time, priority_dict.get(product, 10), force=bool(date_time))
+
+        # 不同的下载模式对应不同状态的任务
+        state_list = {'all': ['pending', 'error'], 'new': ['pending'], 'error': ['error']}[mode]
+        self.run_jobs(self.job_store.due_jobs(state_list, product_list=data_white_list), max_workers=max_workers,
+                      **kwargs)
+
+        # 失败的任务仍然导出一份error.csv
+        self.job_store.export_error_csv(self.error_path)
+        self.export_metrics()
         record_log(f'所有数据更新完成', send=True)
 
-    def update_stock_index(self, index_list):
+    def run_jobs(self, job_df, max_workers=1, **kwargs):
+        """
+        执行数据更新任务，并记录每个任务的结果
+        :param job_df: 需要执行的任务，已经按照优先级排序
+        :param max_workers: 并发的线程数，1表示串行
+        :return: 每个任务的更新结果
+        """
+        if job_df.empty:
+            return pd.DataFrame(columns=['product', 'date_time', 'error'])
+        data_list = list(zip(job_df['product'], job_df['date_time']))
+        for product, date_time in data_list:
+            self.job_store.mark_running(product, date_time)
+        df = pd.concat(self.update_data_list(data_list, max_workers=max_workers, **kwargs), ignore_index=True)
+        for row in df.to_dict('records'):
+            if row['error']:
+                message = row.get('message')
+                self.job_store.mark_error(row['product'], row['date_time'], None if pd.isna(message) else message)
+            else:
+                self.job_store.mark_done(row['product'], row['date_time'])
+        return df
+
+    def export_metrics(self):
+        """
+        导出本次运行各个阶段的耗时统计，json运行报告与prometheus的textfile
+        :return: （json路径，prometheus路径），不导出时返回None
+        """
+        if not self.metrics_path:
+            return None
+        try:
+            json_path, prom_path = metrics.export(self.metrics_path)
+        except OSError as e:
+            record_log(f'导出耗时统计失败，错误信息为{e}', log_type='waring')
+            return None
+        record_log(f'耗时统计已导出至{json_path}')
+        return json_path, prom_path
+
+    @staticmethod
+    def get_index_trade_date():
         """
-        更新指数数据
+        从新浪获取上证指数最新的行情日期
         :return:
         """
+        url = 'https://hq.sinajs.cn/list=sh000001'
+        response = requests.get(url, headers={
+            'Referer': 'http://finance.sina.com.cn',
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.71 Safari/537.36 Edg/97.0.1072.62'
+        }, timeout=10).text
+        data_date = str(response.split(',')[-4])
+        # 获取上证的指数日期
+        return data_date
 
-        def getDate():
-            url = 'https://hq.sinajs.cn/list=sh000001'
-            response = requests.get(url, headers={
-                'Referer': 'http://finance.sina.com.cn',
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.71 Safari/537.36 Edg/97.0.1072.62'
-            }).text
-            data_date = str(response.split(',')[-4])
-            # 获取上证的指数日期
-            return data_date
+    def get_index_drop_date(self):
+        """
+        交易时间内当天的k线还没有走完，不保存。每次更新只判断一次
+        :return: 不需要保存的日期，不需要时返回None
+        """
+        now_time = datetime.datetime.now()
+        start = datetime.datetime.combine(now_time.date(), datetime.time(9, 30))
+        end = datetime.datetime.combine(now_time.date(), datetime.time(15, 0))
+        if not (start <= now_time <= end):
+            return None
+        try:
+            trade_date = pd.to_datetime(self.get_index_trade_date()).date()
+        except Exception as e:
+            # 获取不到行情日期时，当作当天是交易日，避免保存没有走完的k线
+            print('获取指数行情日期失败', e)
+            return now_time.strftime('%Y-%m-%d')
+        return now_time.strftime('%Y-%m-%d') if trade_date == now_time.date() else None
+
+    def get_index_last_date(self, path):
+        """
+        读取已经保存的指数数据的最后日期
+        :param path: 指数数据路径
+        :return: 最后日期，文件不存在或为空时返回None
+        """
+        if not os.path.exists(path):
+            return None
+        df = self.index_storage.read_tail(path, n=1)
+        if df.empty:
+            return None
+        return pd.to_datetime(df['candle_end_time'].iloc[-1]).strftime('%Y-%m-%d')
 
+    @staticmethod
+    def fetch_index_data(index, start_time, rate_limiter):
+        """
+        从start_time开始获取指数的日线数据，每次最多返回2000根k线，从后往前分页获取
+        :param index: 指数代码
+        :param start_time: 开始日期
+        :param rate_limiter: 多个指数共用的限速器
+        :return:
+        """
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.71 Safari/537.36 Edg/97.0.1072.62'
 
         }
-        for index in index_list:
-            print(index)
-            url = 'https://proxy.finance.qq.com/ifzqgtimg/appstock/app/newfqkline/get'
-            start_time = '1900-01-01'
-            end_time = ''
-            df_list = []
-            while True:
-                params = {
-                    '_var': 'kline_dayqfq',
-                    'param': f'{index},day,{start_time},{end_time},2000,qfq',
-                    'r': f'0.{randint(10 ** 15, (10 ** 16) - 1)}',
-                }
-                res = requests.get(url, params=params, headers=headers)
-                res_json = json.loads(re.findall('kline_dayqfq=(.*)', res.text)[0])
-                if res_json['code'] == 0:
-                    _df = pd.DataFrame(res_json['data'][index]['day'])
-                    df_list.append(_df)
-                    if _df.shape[0] <= 1:
-                        break
-                    end_time = _df.iloc[0][0]
-                time.sleep(2)
-            df = pd.concat(df_list, ignore_index=True)
-            # ===对数据进行整理
-            rename_dict = {0: 'candle_end_time', 1: 'open', 2: 'close', 3: 'high', 4: 'low', 5: 'amount', 6: 'info'}
-            # 其中amount单位是手，说明数据不够精确
-            df.rename(columns=rename_dict, inplace=True)
-            df['candle_end_time'] = pd.to_datetime(df['candle_end_time'])
-            df.drop_duplicates('candle_end_time', inplace=True)     # 去重
-            df.sort_values('candle_end_time', inplace=True)
-            df['candle_end_time'] = df['candle_end_time'].dt.strftime('%Y-%m-%d')
-            if 'info' not in df:
-                df['info'] = None
-            df = df[['candle_end_time', 'open', 'high', 'low', 'close', 'amount', 'info']]
-            start = datetime.datetime.now().strftime('%Y-%m-%d') + ' ' + '9:30'
-            start = datetime.datetime.strptime(start, "%Y-%m-%d %H:%M")
-
-            end = datetime.datetime.now().strftime('%Y-%m-%d') + ' ' + '15:00'
-            end = datetime.datetime.strptime(end, "%Y-%m-%d %H:%M")
-            now_time = datetime.datetime.now()
-            if (now_time >= start) & (now_time <= end) & (pd.to_datetime(getDate()) == now_time):
-                df = df[:-1]
-            to_csv_path = self.all_data_path + '/index'
-            if not os.path.exists(to_csv_path):  # 判断文件夹是否存在
-                os.makedirs(to_csv_path)  # 不存在则创建
-            df.to_csv(to_csv_path + '/%s.csv' % index, index=False, encoding='gbk')
-
-    def get_strategy_result(self, strategy, period, select_count):
-        """
-        获取策略结果
+        url = 'https://proxy.finance.qq.com/ifzqgtimg/appstock/app/newfqkline/get'
+        end_time = ''
+        df_list = []
+        while True:
+            params = {
+                '_var': 'kline_dayqfq',
+                'param': f'{index},day,{start_time},{end_time},2000,qfq',
+                'r': f'0.{randint(10 ** 15, (10 ** 16) - 1)}',
+            }
+            rate_limiter.acquire()
+            res = requests.get(url, params=params, headers=headers, timeout=30)
+            res_json = json.loads(re.findall('kline_dayqfq=(.*)', res.text)[0])
+            if res_json['code'] == 0:
+                _df = pd.DataFrame(res_json['data'][index]['day'])
+                df_list.append(_df)
+                if _df.shape[0] <= 1:
+                    break
+                end_time = _df.iloc[0, 0]
+        df = pd.concat(df_list, ignore_index=True)
+        # ===对数据进行整理
+        rename_dict = {0: 'candle_end_time', 1: 'open', 2: 'close', 3: 'high', 4: 'low', 5: 'amount', 6: 'info'}
+        # 其中amount单位是手，说明数据不够精确
+        df.rename(columns=rename_dict, inplace=True)
+        df['candle_end_time'] = pd.to_datetime(df['candle_end_time'])
+        df.drop_duplicates('candle_end_time', inplace=True)     # 去重
+        df.sort_values('candle_end_time', inplace=True)
+        df['candle_end_time'] = df['candle_end_time'].dt.strftime('%Y-%m-%d')
+        if 'info' not in df:
+            df['info'] = None
+        return df[['candle_end_time', 'open', 'high', 'low', 'close', 'amount', 'info']]
+
+    def update_single_index(self, index, rate_limiter, drop_date=None, incremental=True):
+        """
+        更新单个指数，增量更新时只获取已保存的最后日期之后的k线并追加到文件末尾
+        :param index: 指数代码
+        :param rate_limiter: 多个指数共用的限速器
+        :param drop_date: 不需要保存的日期
+        :param incremental: 是否增量更新
+        :return: 新增的k线数量
+        """
+        to_csv_path = self.all_data_path + '/index'
+        if not os.path.exists(to_csv_path):  # 判断文件夹是否存在
+            os.makedirs(to_csv_path, exist_ok=True)  # 不存在则创建
+        path = to_csv_path + '/%s.csv' % index
+        last_date = self.get_index_last_date(path) if incremental else None
+        df = self.fetch_index_data(index, last_date or '1900-01-01', rate_limiter)
+        if drop_date:
+            df = df[df['candle_end_time'] < drop_date]
+        if last_date is None:
+            df.to_csv(path, index=False, encoding='gbk')
+            return df.shape[0]
+        df = df[df['candle_end_time'] > last_date]
+        if not df.empty:
+            self.index_storage.append(path, df)
+        return df.shape[0]
+
+    def update_stock_index(self, index_list, incremental=True, max_workers=4, request_rate=0.5):
+        """
+        更新指数数据，多个指数同时更新，共用一个限速器
+        :param index_list: 需要更新的指数列表
+        :param incremental: 是否增量更新，False时重新获取全部历史数据
+        :param max_workers: 同时更新的指数数量
+        :param request_rate: 所有指数合计每秒的请求数量
+        :return:
+        """
+        rate_limiter = TokenBucket(request_rate, capacity=max_workers)
+        drop_date = self.get_index_drop_date()
+
+        def update(index):
+            try:
+                count = self.update_single_index(index, rate_limiter, drop_date=drop_date, incremental=incremental)
+                print(index, f'新增{count}条数据')
+            except Exception as e:
+                record_log(f'{index}指数更新失败，{e}', send=True, robot_type='waring')
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            list(executor.map(update, index_list))
+
+    def get_strategy_result(self, strategy, period, select_count, use_cache=True):
+        """
+        获取策略结果，结果在下一次策略发布前都从缓存中读取
         :param strategy: 策略名称
         :param period: 策略持仓时间，选股策略填'周'、'月'、'自然月'，事件策略填'x天'，与我们网页的参数贴合
         :param select_count:选股数量，若选择所有股票，填入0，与我们网页的参数贴合
+        :param use_cache: 是否使用缓存
+        :return:
+        """
+        if not use_cache:
+            return self.fetch_strategy_result(strategy, period, select_count)
+        # 只缓存获取成功的结果
+        return self.strategy_cache.get((strategy, str(period), str(select_count)),
+                                       lambda: self.fetch_strategy_result(strategy, period, select_count),
+                                       cacheable=lambda res: isinstance(res, dict) and res.get('code') == 200)
+
+    def fetch_strategy_result(self, strategy, period, select_count):
+        """
+        请求最新的策略结果，并保存到本地
+        :param strategy: 策略名称
+        :param period: 策略持仓时间
+        :param select_count: 选股数量
+        :return:
+        """
+        try:
+            res_json = self.request_strategy_result(strategy, period, select_count)
+        except CircuitOpenError:
+            return self.get_local_fallback(strategy, period, select_count) or \
+                f'{strategy}策略获取失败，超出当日下载次数或无权限，请稍后再试'
+        if res_json is None:
+            return None
+        code = res_json['code']
+        if code == 200:
+            self.save_strategy_result([(strategy, period, select_count, res_json)])
+            return res_json
+        elif code == 1003:
+            return self.get_local_fallback(strategy, period, select_count) or f'{strategy}{strategy_code_dict[code]}'
+        elif code in strategy_code_dict:
+            return f'{strategy}{strategy_code_dict[code]}'
+        return None
+
+    def get_local_fallback(self, strategy, period, select_count):
+        """
+        接口无法获取策略结果时，使用本地计算的结果代替
+        :param strategy: 策略名称
+        :param period: 策略持仓时间
+        :param select_count: 选股数量
+        :return: 策略不能在本地计算或者计算失败时返回None
+        """
+        if not self.local_strategy_fallback or strategy not in self.local_strategy.strategy_dict:
+            return None
+        try:
+            res_json = self.local_strategy.get_strategy_result(strategy, period, select_count)
+        except Exception as e:
+            record_log(f'{strategy}本地计算失败，错误信息为{e}', log_type='waring')
+            return None
+        return res_json if res_json['code'] == 200 else None
+
+    def get_local_strategy_result(self, strategy, period, select_count):
+        """
+        在本地计算最新一期的策略结果，不请求接口，格式与get_strategy_result一致
+        :param strategy: 策略名称，需要在local_strategy_dict中
+        :param period: 策略持仓时间
+        :param select_count: 选股数量
         :return:
         """
+        return self.local_strategy.get_strategy_result(strategy, period, select_count)
 
-        def up(_strategy, _strategy_df, _period, _select_count):
-            period_dict = {
-                '周': 'week',
-                '月': 'month',
-                '自然月': 'natural_month'
-            }
-            if '天' in _period:
-                period_type = _period.replace('天', '')
-            else:
-                period_type = period_dict[_period]
-            to_path = f'{self.strategy_result_path}'
-            if not os.path.exists(to_path):  # 判断文件夹是否存在
-                os.makedirs(to_path)  # 不存在则创建
-            to_file_path = os.path.join(to_path, f'{_strategy.replace("-", "_")}_{period_type}_{select_count}.csv')
-
-            if os.path.exists(to_file_path):
-                old_df = pd.read_csv(to_file_path, encoding='gbk')
-                _strategy_df = pd.concat([old_df, _strategy_df])
-                _strategy_df.drop_duplicates(subset=['交易日期', '股票代码'], inplace=True)
-            _strategy_df.to_csv(to_file_path, encoding='gbk', index=False)
+    def recompute_local_strategy(self, strategy, period, select_count, start=None, end=None, save=True):
+        """
+        在本地一次重新计算策略的全部历史选股结果
+        :param strategy: 策略名称，需要在local_strategy_dict中
+        :param period: 策略持仓时间
+        :param select_count: 选股数量
+        :param start: 开始日期（包含），为空时从最早的数据开始
+        :param end: 结束日期（包含），为空时到最新的数据
+        :param save: 是否保存到策略结果库，策略名称加上'-local'，与接口获取的结果区分
+        :return:
+        """
+        with metrics.span(strategy, 'local_strategy') as record:
+            df = self.local_strategy.history(strategy, period, select_count, start, end)
+            record['rows'] = df.shape[0]
+        if save and not df.empty:
+            save_df = df.assign(strategy=f'{strategy}-local', period=get_period_type(period))
+            self.strategy_store.upsert(save_df)
+        return df
 
+    def request_strategy_result(self, strategy, period, select_count):
+        """
+        请求最新的策略结果，不保存
+        :param strategy: 策略名称
+        :param period: 策略持仓时间
+        :param select_count: 选股数量
+        :return: 接口返回的json，请求失败时返回None
+        """
         url = self.url + '/stock-result/service/%s' % strategy
 
         params = {
@@ -664,21 +1774,120 @@ class BaseDataApi(object):
         res = self.request_data('GET', url, params=params)
         if res.status_code != 200:
             return None
-        res_json = res.json()
-        code = res_json['code']
-        if code == 200:
-            df = pd.DataFrame(res_json['result']).rename(columns={'name': '股票名称', 'symbol': '股票代码'})
-            df['交易日期'] = res_json['select_time']
-            df['选股排名'] = 1
-            df = df[['交易日期', '股票代码', '股票名称', '选股排名']]
-            up(strategy, df, period, select_count)
-            return res_json
-        elif code == 1003:
-            return f'{strategy}策略无获取权限'
-        elif code == 1004:
-            return f'{strategy}策略不存在'
-        elif code == 1005:
-            return f'{strategy}策略无数据'
-        elif code == 1006:
-            return f'{strategy}策略获取数据参数错误'
-        return None
+        return res.json()
+
+    def save_strategy_result(self, result_list):
+        """
+        把策略结果保存到本地的策略结果库，所有结果在一个事务中写入
+        :param result_list: [(策略名称, 持仓周期, 选股数量, 接口返回的json), ...]
+        :return:
+        """
+        df_list = []
+        for strategy, period, select_count, res_json in result_list:
+            df = pd.DataFrame(res_json['result'], columns=['name', 'symbol'])
+            df['strategy'] = strategy
+            df['period'] = get_period_type(period)
+            df['select_count'] = int(select_count)
+            df['trade_date'] = pd.to_datetime(res_json['select_time']).strftime('%Y-%m-%d')
+            df['rank'] = 1
+            df_list.append(df)
+        if df_list:
+            self.strategy_store.upsert(pd.concat(df_list, ignore_index=True))
+
+    def export_strategy_result(self, strategy, period, select_count, to_path=None):
+        """
+        把策略结果导出为csv，格式与原来每个策略一个csv保持一致
+        :param strategy: 策略名称
+        :param period: 持仓周期
+        :param select_count: 选股数量
+        :param to_path: 导出的文件夹，为空时导出到策略结果保存路径
+        :return:
+        """
+        return self.strategy_store.export_csv(strategy, period, select_count, to_path or self.strategy_result_path)
+
+    def get_strategy_result_list(self, strategy_list, max_workers=8, use_cache=True):
+        """
+        批量获取策略结果，并发请求，所有结果获取完成后统一保存
+        :param strategy_list: [[策略名称, 持仓周期, 选股数量], ...]
+        :param max_workers: 同时请求的数量
+        :param use_cache: 是否使用缓存
+        :return: 每个策略的获取结果，以及获取状态表
+        """
+        fetch_dict = {}  # 本次实际请求到的结果，需要保存到本地
+        # 持仓周期与选股数量统一为字符串，重复的策略只请求一次
+        key_list = [(strategy, str(period), str(select_count)) for strategy, period, select_count in strategy_list]
+        unique_key_list = list(dict.fromkeys(key_list))
+
+        def fetch(key):
+            def loader():
+                res_json = self.request_strategy_result(*key)
+                fetch_dict[key] = res_json
+                return res_json
+
+            try:
+                if not use_cache:
+                    return loader(), None
+                return self.strategy_cache.get(key, loader, cacheable=lambda res: res.get('code') == 200), None
+            except Exception as e:
+                return None, e
+
+        with ThreadPoolExecutor(max_workers=max(min(max_workers, len(unique_key_list)), 1)) as pool:
+            fetch_result_dict = dict(zip(unique_key_list, pool.map(fetch, unique_key_list)))
+
+        # 所有结果统一保存一次
+        self.save_strategy_result([key + (res_json,) for key, res_json in fetch_dict.items()
+                                   if res_json and res_json['code'] == 200])
+
+        result_list = []
+        status_list = []
+        seen_set = set()
+        for (strategy, period, select_count), key in zip(strategy_list, key_list):
+            res_json, error = fetch_result_dict[key]
+            code = res_json['code'] if res_json else None
+            local_json = None
+            if code == 1003 or isinstance(error, CircuitOpenError):
+                local_json = self.get_local_fallback(strategy, period, select_count)
+            if local_json is not None:
+                result_list.append(local_json)
+                message = f'{strategy_code_dict[1003] if code == 1003 else "接口熔断"}，使用本地计算的结果'
+                res_json, code = local_json, 200
+            elif code == 200:
+                result_list.append(res_json)
+                message = '获取成功'
+            elif code in strategy_code_dict:
+                result_list.append(f'{strategy}{strategy_code_dict[code]}')
+                message = strategy_code_dict[code]
+            else:
+                result_list.append(None)
+                message = f'获取失败，{error}' if error else '获取失败'
+            status_list.append({
+                'strategy': strategy,
+                'period': period,
+                'select_count': select_count,
+                'code': code,
+                'message': message,
+                'select_time': res_json.get('select_time') if code == 200 else None,
+                # 重复的策略与之前相同的策略共用一次获取的结果
+                'coalesced': key in seen_set,
+                'cached': key not in seen_set and key not in fetch_dict and error is None,
+            })
+            seen_set.add(key)
+        return result_list, pd.DataFrame(status_list)
+
+
+# 进程内共享的BaseDataApi
+shared_api_dict = {}
+shared_api_lock = threading.Lock()
+
+
+def get_base_data_api(**kwargs) -> BaseDataApi:
+    """
+    获取进程内共享的BaseDataApi，相同参数只会实例化一次
+    :param kwargs: BaseDataApi的参数
+    :return:
+    """
+    key = tuple(sorted((k, str(v)) for k, v in kwargs.items()))
+    with shared_api_lock:
+        if key not in shared_api_dict:
+            shared_api_dict[key] = BaseDataApi(**kwargs)
+        return shared_api_dict[key]
@@ -0,0 +1,346 @@
+import json
+from itertools import product as iter_product
+from multiprocessing import cpu_count
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from plugins.StockStrategy.common import *
+from plugins.StockStrategy.local_strategy import period_freq_dict
+from plugins.StockStrategy.strategy_store import get_period_type
+
+# rocket_plan.json中hold_plan的换仓频率对应的持仓周期
+hold_freq_dict = {
+    'W': '周',
+    'M': '月',
+}
+# 策略名称的后缀，去掉后为策略简称
+strategy_suffix_list = ['选股策略', '事件策略', '策略']
+
+
+def get_period(config):
+    """
+    把rocket_plan.json中的hold_plan转换成持仓周期
+    :param config: 单个策略的配置
+    :return: 选股策略为'周'、'月'，事件策略为'x天'
+    """
+    hold_plan = config['hold_plan']
+    if isinstance(hold_plan, list):
+        if hold_plan[0] not in hold_freq_dict:
+            raise ValueError(f'{config["strategy"]}的持仓周期不支持回测：{hold_plan}')
+        return hold_freq_dict[hold_plan[0]]
+    return f'{int(hold_plan)}天'
+
+
+def get_stats(equity):
+    """
+    资金曲线的评价指标
+    :param equity: 资金曲线，index为日期
+    :return:
+    """
+    equity = equity.dropna()
+    if len(equity) < 2:
+        return pd.Series({'累积净值': 1.0, '年化收益': 0.0, '最大回撤': 0.0, '收益回撤比': np.nan, '年化波动': 0.0,
+                          '夏普比率': np.nan})
+    ret = equity.pct_change().fillna(0)
+    years = max((equity.index[-1] - equity.index[0]).days / 365, 1 / 365)
+    annual_return = (equity.iloc[-1] / equity.iloc[0]) ** (1 / years) - 1
+    max_drawdown = (equity / equity.cummax() - 1).min()
+    volatility = ret.std() * np.sqrt(252)
+    return pd.Series({
+        '累积净值': equity.iloc[-1] / equity.iloc[0],
+        '年化收益': annual_return,
+        '最大回撤': max_drawdown,
+        '收益回撤比': annual_return / -max_drawdown if max_drawdown < 0 else np.nan,
+        '年化波动': volatility,
+        '夏普比率': ret.mean() / ret.std() * np.sqrt(252) if ret.std() > 0 else np.nan,
+    })
+
+
+def simulate_strategy(panel, signal_df, config, buy_cost, sell_cost, start=None, end=None):
+    """
+    模拟单个策略的资金曲线，按照每次选股（一批）计算，不逐日循环。
+    资金分为cap_count份，每批使用一份空闲的资金，没有空闲的资金时不买入；买入日开盘买入，卖出日收盘卖出，批内等权。
+    持仓的价值为 份额 × 复权收盘价，份额在买入日加入、卖出日移除，用差分后累加得到每天的份额；
+    现金在买入日减少、卖出日增加，同样差分后累加
+    :param panel: 截面数据，需要包含开盘价、收盘价、前收盘价、成交量
+    :param signal_df: 选股结果，包含trade_date、symbol、rank列
+    :param config: 策略配置，包含cap_count、hold_plan、select_count
+    :param buy_cost: 买入的费率
+    :param sell_cost: 卖出的费率
+    :param start: 回测开始日期，为空时从最早的数据开始
+    :param end: 回测结束日期，为空时到最新的数据
+    :return: 资金曲线，初始为1
+    """
+    date_index = panel.dates()
+    date_index = date_index[(date_index >= pd.to_datetime(start or date_index.min())) &
+                            (date_index <= pd.to_datetime(end or date_index.max()))]
+    equity = pd.Series(1.0, index=date_index)
+    if signal_df.empty or date_index.empty:
+        return equity
+
+    # 每批只保留排名靠前的select_count只股票
+    signal_df = signal_df.sort_values(['trade_date', 'rank', 'symbol'])
+    if int(config['select_count']) > 0:
+        signal_df = signal_df.groupby('trade_date', sort=False).head(int(config['select_count']))
+    symbol_list = sorted(signal_df['symbol'].unique())
+    price_dict = {field: panel.frame(field, start, end, symbol_list) for field in ['开盘价', '收盘价', '前收盘价', '成交量']}
+    symbol_list = list(price_dict['收盘价'].columns)
+    open_array, close_array = price_dict['开盘价'].to_numpy(), price_dict['收盘价'].to_numpy()
+    volume_array = price_dict['成交量'].to_numpy()
+    # 复权收盘价，停牌的日期沿用前一天
+    growth_array = np.nan_to_num(close_array / price_dict['前收盘价'].to_numpy(), nan=1.0)
+    growth_array = np.cumprod(np.where(growth_array > 0, growth_array, 1.0), axis=0)
+    date_count = len(date_index)
+
+    # 选股日收盘后选出，下一个交易日买入
+    df = signal_df[signal_df['symbol'].isin(symbol_list)].copy()
+    df['col'] = pd.Index(symbol_list).get_indexer(df['symbol'])
+    df['buy_row'] = date_index.searchsorted(pd.to_datetime(df['trade_date']), side='right')
+    df = df[df['buy_row'] < date_count]
+    # 买入日停牌的股票不买入
+    buyable = (volume_array[df['buy_row'], df['col']] > 0) & (open_array[df['buy_row'], df['col']] > 0)
+    df = df[buyable]
+    if df.empty:
+        return equity
+
+    period = get_period(config)
+    if '天' in period:
+        sell_row = df['buy_row'] + int(period.replace('天', '')) - 1
+    else:
+        # 持有到买入日所在周期的最后一个交易日
+        period_id = pd.factorize(date_index.to_period(period_freq_dict[period]))[0]
+        last_row = pd.Series(np.arange(date_count)).groupby(period_id).transform('max').to_numpy()
+        sell_row = pd.Series(last_row[df['buy_row']], index=df.index)
+    df['sell_row'] = np.minimum(sell_row, date_count - 1)
+
+    # 每批的收益：批内等权，买入日开盘到卖出日收盘
+    df['weight'] = 1 / df.groupby('trade_date')['symbol'].transform('count')
+    buy_row, sell_row, col = df['buy_row'].to_numpy(), df['sell_row'].to_numpy(), df['col'].to_numpy()
+    df['unit'] = df['weight'] * close_array[buy_row, col] / open_array[buy_row, col] / growth_array[buy_row, col] / \
+        (1 + buy_cost)
+    df['value'] = df['unit'] * growth_array[sell_row, col] * (1 - sell_cost)
+    lot_df = df.groupby('trade_date').agg(buy_row=('buy_row', 'first'), sell_row=('sell_row', 'max'),
+                                          value=('value', 'sum'))
+
+    # 资金分为cap_count份，每份的资金随着每批的收益滚动，每批使用空闲最久的一份（所有份都空闲时即轮流使用）。
+    # 一份资金同时只能持有一批，所有份的上一批在本批买入日还没有卖出时，本批不买入，不借钱加杠杆
+    cap_count = max(int(config.get('cap_count', 1)), 1)
+    part_sell_array = np.full(cap_count, -1)  # 每份资金上一批的卖出日
+    part_value_array = np.full(cap_count, 1 / cap_count)  # 每份资金当前的金额
+    start_list = []
+    for lot_buy_row, lot_sell_row, lot_value in zip(lot_df['buy_row'], lot_df['sell_row'], lot_df['value']):
+        free_array = np.flatnonzero(part_sell_array < lot_buy_row)
+        if not len(free_array):
+            start_list.append(np.nan)
+            continue
+        part = free_array[np.argmin(part_sell_array[free_array])]
+        start_list.append(part_value_array[part])
+        part_sell_array[part] = lot_sell_row
+        part_value_array[part] *= lot_value
+    lot_df['start'] = start_list
+    lot_df = lot_df[lot_df['start'].notna()]
+    df = df[df['trade_date'].isin(lot_df.index)]
+    buy_row, sell_row, col = df['buy_row'].to_numpy(), df['sell_row'].to_numpy(), df['col'].to_numpy()
+    df['unit'] = df['unit'] * df['trade_date'].map(lot_df['start'])
+
+    # 份额：买入日加入，卖出日移除，卖出日的价值已经计入现金
+    unit_array = np.zeros((date_count + 1, len(symbol_list)))
+    np.add.at(unit_array, (buy_row, col), df['unit'].to_numpy())
+    np.add.at(unit_array, (sell_row, col), -df['unit'].to_numpy())
+    hold_array = (np.cumsum(unit_array, axis=0)[:date_count] * growth_array).sum(axis=1)
+    # 现金：买入日减少，卖出日增加
+    cash_array = np.zeros(date_count + 1)
+    np.add.at(cash_array, lot_df['buy_row'].to_numpy(), -lot_df['start'].to_numpy())
+    np.add.at(cash_array, lot_df['sell_row'].to_numpy(), (lot_df['start'] * lot_df['value']).to_numpy())
+    cash_array = 1 + np.cumsum(cash_array)[:date_count]
+    return pd.Series(cash_array + hold_array, index=date_index)
+
+
+def simulate_plan(panel, task_list, buy_cost, sell_cost, start=None, end=None):
+    """
+    模拟多个策略组合的资金曲线，每个策略按照strategy_weight分配资金，剩余的资金为现金
+    :param panel: 截面数据
+    :param task_list: [(策略名称, 策略配置, 选股结果), ...]
+    :param buy_cost: 买入的费率
+    :param sell_cost: 卖出的费率
+    :param start: 回测开始日期
+    :param end: 回测结束日期
+    :return: 每个策略与组合的资金曲线
+    """
+    equity_dict = {name: simulate_strategy(panel, signal_df, config, buy_cost, sell_cost, start, end)
+                   for name, config, signal_df in task_list}
+    equity_df = pd.DataFrame(equity_dict)
+    weight = pd.Series({name: float(config['strategy_weight']) for name, config, _ in task_list})
+    equity_df['组合'] = (equity_df * weight).sum(axis=1) + (1 - weight.sum())
+    return equity_df
+
+
+class Backtest(object):
+    """
+    按照rocket_plan.json中的strategy_list回测策略组合。
+    选股结果来自策略结果库中保存的历史记录，本地可以计算的策略在没有记录时使用本地计算的结果；价格来自截面数据
+    """
+
+    def __init__(self, api, plan_path=None, strategy_name_dict=None, commission=1.2 / 10000, stamp_tax=0.5 / 1000,
+                 product='stock-trading-data-pro'):
+        """
+        :param api: BaseDataApi，提供策略结果库、本地策略与截面数据
+        :param plan_path: rocket_plan.json的路径，为空时使用config中的json_path
+        :param strategy_name_dict: 策略简称与策略ID的对应关系，{策略简称: 策略ID}
+        :param commission: 买卖的佣金费率
+        :param stamp_tax: 卖出的印花税率
+        :param product: 价格数据使用的产品
+        """
+        from plugins.StockStrategy.config import json_path
+        self.api = api
+        self.plan_path = plan_path or json_path
+        self.strategy_name_dict = strategy_name_dict or {}
+        self.buy_cost = commission
+        self.sell_cost = commission + stamp_tax
+        self.product = product
+
+    def load_plan(self):
+        """
+        读取rocket_plan.json中的策略配置
+        :return: {策略名称: 策略配置}
+        """
+        with open(self.plan_path, mode='r', encoding='utf8') as f:
+            return json.load(f)['strategy_list']
+
+    def get_strategy_id(self, name, config):
+        """
+        获取策略ID，配置中有strategy_id时直接使用，否则去掉策略名称的后缀后查找
+        :param name: 策略名称，如'伽利略选股策略'
+        :param config: 策略配置
+        :return: 找不到时返回None
+        """
+        if config.get('strategy_id'):
+            return config['strategy_id']
+        for short_name in [name] + [name[:-len(suffix)] for suffix in strategy_suffix_list if name.endswith(suffix)]:
+            if short_name in self.strategy_name_dict:
+                return self.strategy_name_dict[short_name]
+        return name if name in self.strategy_name_dict.values() else None
+
+    def get_panel(self):
+        panel = self.api.get_panel(self.product)
+        if panel is None:
+            raise ValueError(f'{self.product}没有配置截面数据的字段，无法回测')
+        missing_list = [field for field in ['开盘价', '收盘价', '前收盘价', '成交量'] if field not in panel.fields]
+        if missing_list:
+            raise ValueError(f'截面数据中没有{missing_list}字段，需要添加到panel_fields_dict后重新生成')
+        if panel.load_meta() is None:
+            self.api.build_panel(self.product)
+        return panel
+
+    def load_signal(self, strategy_id, period, select_count):
+        """
+        读取策略的历史选股结果，优先使用相同周期与选股数量的记录，其次使用相同周期、选股数量更多的记录，
+        都没有时使用本地计算的结果
+        :param strategy_id: 策略ID
+        :param period: 持仓周期
+        :param select_count: 选股数量
+        :return: 包含trade_date、symbol、rank列的数据
+        """
+        df = self.api.strategy_store.history(strategy_id, period)
+        if not df.empty:
+            count_list = sorted(df['select_count'].unique())
+            # 选股数量为0的记录包含所有股票，可以取任意数量
+            usable_list = [c for c in count_list if c == 0 or c >= int(select_count)] if int(select_count) else \
+                [c for c in count_list if c == 0]
+            if usable_list:
+                count = int(select_count) if int(select_count) in usable_list else \
+                    min(usable_list, key=lambda c: (c == 0, c))
+                df = df[df['select_count'] == count]
+                df['trade_date'] = pd.to_datetime(df['trade_date'])
+                return df[['trade_date', 'symbol', 'rank']]
+        if strategy_id in self.api.local_strategy.strategy_dict:
+            record_log(f'{strategy_id}没有历史选股结果，使用本地计算的结果')
+            df = self.api.local_strategy.select(strategy_id, period, select_count)
+            return df[['trade_date', 'symbol', 'rank']]
+        record_log(f'{strategy_id}没有{period}、选股数量{select_count}的历史选股结果，不参与回测', log_type='waring')
+        return pd.DataFrame(columns=['trade_date', 'symbol', 'rank'])
+
+    def get_task_list(self, strategy_list, signal_dict=None):
+        """
+        把策略配置整理成回测任务，读取每个策略的选股结果
+        :param strategy_list: {策略名称: 策略配置}
+        :param signal_dict: 已经读取的选股结果，key为（策略ID，持仓周期，选股数量）
+        :return: [(策略名称, 策略配置, 选股结果), ...]
+        """
+        signal_dict = {} if signal_dict is None else signal_dict
+        task_list = []
+        for name, config in strategy_list.items():
+            if float(config.get('strategy_weight', 0)) <= 0:
+                continue
+            strategy_id = self.get_strategy_id(name, config)
+            if strategy_id is None:
+                record_log(f'{name}找不到对应的策略ID，需要添加到strategy_name_dict', log_type='waring')
+                continue
+            stock_weight = config.get('stock_weight') or ['equal_weight']
+            if stock_weight[0] != 'equal_weight':
+                record_log(f'{name}的个股权重{stock_weight[0]}不支持回测，按照等权计算', log_type='waring')
+            buy, sell = config.get('buy') or [], config.get('sell') or []
+            if len(buy) > 1 and buy[1]:
+                record_log(f'{name}的买入溢价{buy[1]}不支持回测，按照开盘价买入', log_type='waring')
+            if len(sell) > 1 and sell[1]:
+                record_log(f'{name}的卖出时间{sell[1]}不支持回测，按照收盘价卖出', log_type='waring')
+            key = (strategy_id, get_period_type(get_period(config)), int(config['select_count']))
+            if key not in signal_dict:
+                signal_dict[key] = self.load_signal(strategy_id, get_period(config), config['select_count'])
+            task_list.append((name, config, signal_dict[key]))
+        return task_list
+
+    def run(self, strategy_list=None, start=None, end=None):
+        """
+        回测策略组合
+        :param strategy_list: {策略名称: 策略配置}，为空时读取rocket_plan.json
+        :param start: 回测开始日期，为空时从最早的数据开始
+        :param end: 回测结束日期，为空时到最新的数据
+        :return: 资金曲线与评价指标
+        """
+        strategy_list = strategy_list or self.load_plan()
+        equity_df = simulate_plan(self.get_panel(), self.get_task_list(strategy_list), self.buy_cost, self.sell_cost,
+                                  start, end)
+        return {'equity': equity_df, 'stats': equity_df.apply(get_stats).T}
+
+    @staticmethod
+    def make_variants(strategy_list, param_grid):
+        """
+        按照参数网格生成多组策略配置
+        :param strategy_list: {策略名称: 策略配置}
+        :param param_grid: {策略名称: {参数名称: [参数值]}}，如{'伽利略选股策略': {'select_count': [3, 10]}}
+        :return: [(参数说明, 策略配置), ...]
+        """
+        key_list = [(name, param) for name, grid in param_grid.items() for param in grid]
+        variant_list = []
+        for value_list in iter_product(*[param_grid[name][param] for name, param in key_list]):
+            variant = {name: dict(config) for name, config in strategy_list.items()}
+            for (name, param), value in zip(key_list, value_list):
+                variant[name][param] = value
+            label = ','.join(f'{name}.{param}={value}' for (name, param), value in zip(key_list, value_list))
+            variant_list.append((label, variant))
+        return variant_list
+
+    def run_variants(self, param_grid, strategy_list=None, start=None, end=None, n_jobs=None):
+        """
+        多组参数并行回测，选股结果在主进程中读取一次，子进程只读取截面数据
+        :param param_grid: {策略名称: {参数名称: [参数值]}}
+        :param strategy_list: {策略名称: 策略配置}，为空时读取rocket_plan.json
+        :param start: 回测开始日期
+        :param end: 回测结束日期
+        :param n_jobs: 并行的进程数，为空时使用cpu数量减一
+        :return: 每组参数组合资金曲线的评价指标
+        """
+        variant_list = self.make_variants(strategy_list or self.load_plan(), param_grid)
+        panel = self.get_panel()
+        signal_dict = {}
+        task_lists = [self.get_task_list(variant, signal_dict) for _, variant in variant_list]
+        n_jobs = n_jobs or max(cpu_count() - 1, 1)
+        equity_list = Parallel(n_jobs=min(n_jobs, len(task_lists)))(
+            delayed(simulate_plan)(panel, task_list, self.buy_cost, self.sell_cost, start, end)
+            for task_list in task_lists)
+        stats_df = pd.DataFrame([get_stats(equity_df['组合']) for equity_df in equity_list],
+                                index=pd.Index([label for label, _ in variant_list], name='参数'))
+        return stats_df.sort_values('年化收益', ascending=False)
@@ -0,0 +1,410 @@
+"""
+离线性能测试：本地模拟数据接口，生成模拟的全量与增量数据，测试数据更新与策略结果获取的耗时、吞吐量与内存峰值。
+不请求真实的接口，不消耗下载次数。在chatgpt-on-wechat根目录下运行：
+python -m plugins.StockStrategy.benchmark --stocks 500 --years 3 --days 5
+"""
+import argparse
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from plugins.StockStrategy.storage import csv_header_info, get_storage
+
+try:
+    import resource
+except ImportError:  # windows没有resource模块，不统计内存峰值
+    resource = None
+
+# 模拟接口返回的更新数据的配置
+bench_data_info = {
+    'stock-trading-data-pro': {
+        'fun': 'update_by_group',
+        'group': '股票代码',
+        'duplicate_removal_column': ['交易日期'],
+        'keep': 'last',
+        'parse_dates': ['交易日期'],
+    },
+    'stock-fin-data-xbx': {
+        'fun': 'update_by_file',
+        'group': '',
+        'duplicate_removal_column': ['交易日期'],
+        'keep': 'last',
+        'parse_dates': ['交易日期'],
+    },
+}
+
+# 行业名称，用于生成模拟数据
+industry_list = ['银行', '非银金融', '医药生物', '电子', '计算机', '食品饮料', '电力设备', '机械设备', '汽车', '化工']
+
+
+def get_code_list(stock_count):
+    """
+    生成模拟的股票代码，沪市与深市各一半
+    :param stock_count: 股票数量
+    :return:
+    """
+    return [f'sh{600000 + i // 2}' if i % 2 == 0 else f'sz{1 + i // 2:06d}' for i in range(stock_count)]
+
+
+def generate_history(code, date_list, seed=0):
+    """
+    生成单个股票的日线数据，字段与股票历史全息日线数据一致，价格为随机游走
+    :param code: 股票代码
+    :param date_list: 交易日期列表
+    :param seed: 随机种子，相同的种子生成相同的数据
+    :return:
+    """
+    rng = np.random.default_rng([seed, int(code[2:]), int(code.startswith('sh'))])
+    n = len(date_list)
+    close = np.round(10 * np.exp(np.cumsum(rng.normal(0, 0.02, n))), 2)
+    pre_close = np.concatenate([[close[0]], close[:-1]])
+    open_ = np.round(pre_close * (1 + rng.normal(0, 0.01, n)), 2)
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.02, n))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.02, n))
+    volume = rng.integers(10 ** 5, 10 ** 8, n)
+    share = rng.integers(10 ** 8, 10 ** 10)
+    return pd.DataFrame({
+        '股票代码': code,
+        '股票名称': '模拟' + code[2:],
+        '交易日期': date_list,
+        '开盘价': open_,
+        '最高价': np.round(high, 2),
+        '最低价': np.round(low, 2),
+        '收盘价': close,
+        '前收盘价': pre_close,
+        '成交量': volume,
+        '成交额': np.round(volume * close, 2),
+        '流通市值': np.round(close * share * 0.8, 2),
+        '总市值': np.round(close * share, 2),
+        '沪深300成分股': rng.choice(['Y', 'N'], n),
+        '新版申万一级行业名称': industry_list[int(code[2:]) % len(industry_list)],
+        '复权因子': 1.0,
+    })
+
+
+def get_date_list(days, years):
+    """
+    增量数据的日期为最近的days个交易日，全量数据为此之前years年的交易日
+    :param days: 增量数据的天数
+    :param years: 全量数据的年数
+    :return: （全量数据的日期列表，增量数据的日期列表）
+    """
+    end = pd.Timestamp.now().normalize() - pd.Timedelta(days=1)
+    daily_list = list(pd.bdate_range(end=end, periods=days))
+    history_list = list(pd.bdate_range(end=daily_list[0] - pd.Timedelta(days=1), periods=years * 244))
+    return history_list, daily_list
+
+
+def to_csv_bytes(df):
+    """
+    转换为官方格式的gbk csv，第一行为说明，第二行为列名
+    """
+    buf = io.StringIO()
+    buf.write(csv_header_info + '\n')
+    df.to_csv(buf, index=False, date_format='%Y-%m-%d')
+    return buf.getvalue().encode('gbk')
+
+
+def generate_all_data(all_data_path, stock_count, years, days, storage_type='csv', seed=0):
+    """
+    生成全量数据，两个产品都是每个股票一个文件
+    :param all_data_path: 全量数据路径
+    :param stock_count: 股票数量
+    :param years: 全量数据的年数
+    :param days: 增量数据的天数
+    :param storage_type: 存储格式
+    :param seed: 随机种子
+    :return: 全量数据的行数
+    """
+    storage = get_storage(storage_type)
+    history_list, daily_list = get_date_list(days, years)
+    row_count = 0
+    for product in bench_data_info:
+        product_path = os.path.join(all_data_path, product)
+        os.makedirs(product_path, exist_ok=True)
+        for code in get_code_list(stock_count):
+            df = generate_history(code, history_list + daily_list, seed=seed).iloc[:len(history_list)]
+            storage.write(os.path.join(product_path, code + storage.suffix), df)
+            row_count += df.shape[0]
+    return row_count
+
+
+def generate_payload(product, date, stock_count, years, days, seed=0):
+    """
+    生成某一天的增量数据，按标的更新的产品为一个csv，按文件更新的产品为每个股票一个csv的zip
+    :return: （文件名，文件内容，行数）
+    """
+    history_list, daily_list = get_date_list(days, years)
+    all_date_list = history_list + daily_list
+    i = all_date_list.index(pd.Timestamp(date))
+    df = pd.concat([generate_history(code, all_date_list, seed=seed).iloc[[i]] for code in get_code_list(stock_count)],
+                   ignore_index=True)
+    date_str = pd.Timestamp(date).strftime('%Y-%m-%d')
+    if bench_data_info[product]['fun'] == 'update_by_group':
+        return f'{product}-{date_str}.csv', to_csv_bytes(df), df.shape[0]
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for code, _df in df.groupby('股票代码'):
+            zf.writestr(f'{code}.csv', to_csv_bytes(_df))
+    return f'{product}-{date_str}.zip', buf.getvalue(), df.shape[0]
+
+
+class MockApiServer(object):
+    """
+    本地模拟的数据接口，提供更新数据的配置、最新日期、下载链接、数据文件与策略结果
+    """
+
+    def __init__(self, payload_dict, data_info=None, latency=0):
+        """
+        :param payload_dict: 数据文件，key: (产品ID, 日期)，value: (文件名, 文件内容)
+        :param data_info: 更新数据的配置，为bytes时原样返回，用于模拟接口返回的错误信息
+        :param latency: 每个请求额外的延迟，单位秒，用于模拟网络耗时
+        """
+        self.payload_dict = payload_dict
+        self.data_info = data_info or bench_data_info
+        self.data_info_status = 200  # 更新数据的配置的状态码
+        self.data_info_etag = '"v1"'  # 更新数据的配置的ETag，请求的If-None-Match与之相同时返回304
+        self.latency = latency
+        self.hit_dict = {}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.get_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    @property
+    def url(self):
+        return self.base_url + '/api/data/'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def route(self, path):
+        """
+        根据请求路径返回（状态码，内容）
+        """
+        match = re.search(r'/fetch/(.+)-daily/latest$', path)
+        if match:
+            date_list = sorted(date for product, date in self.payload_dict if product == match.group(1))
+            return 200, ','.join(date_list).encode()
+        match = re.search(r'/get-download-link/(.+)-daily/([\d-]+)$', path)
+        if match:
+            product, date = match.groups()
+            if (product, date) not in self.payload_dict:
+                return 404, b''
+            file_name = self.payload_dict[(product, date)][0]
+            # 与真实的下载链接一致，产品ID后面紧跟文件名
+            return 200, f'{self.base_url}/download/{date}/{product}/{file_name}?token=bench'.encode()
+        match = re.search(r'/download/([\d-]+)/(.+?)/', path)
+        if match and (match.group(2), match.group(1)) in self.payload_dict:
+            return 200, self.payload_dict[(match.group(2), match.group(1))][1]
+        match = re.search(r'/stock-result/service/(.+)$', path)
+        if match:
+            code_list = get_code_list(3)
+            return 200, json.dumps({
+                'code': 200,
+                'select_time': pd.Timestamp.now().strftime('%Y-%m-%d'),
+                'buy_time': pd.Timestamp.now().strftime('%Y-%m-%d'),
+                'result': [{'name': '模拟' + code[2:], 'symbol': code} for code in code_list],
+            }).encode()
+        return 404, b''
+
+    def route_data_info(self, request_headers):
+        """
+        返回更新数据的配置（状态码，内容，响应头）
+        """
+        if self.data_info_status == 200 and request_headers.get('If-None-Match') == self.data_info_etag:
+            return 304, b'', {'ETag': self.data_info_etag}
+        body = self.data_info if isinstance(self.data_info, bytes) else json.dumps(self.data_info).encode()
+        return self.data_info_status, body, {'ETag': self.data_info_etag}
+
+    def get_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = re.sub('/+', '/', self.path.split('?')[0])
+                server.hit_dict[path] = server.hit_dict.get(path, 0) + 1
+                if server.latency:
+                    time.sleep(server.latency)
+                header_dict = {}
+                if path.endswith('/get-data-info'):
+                    status, body, header_dict = server.route_data_info(self.headers)
+                else:
+                    status, body = server.route(path)
+                self.send_response(status)
+                for key, value in header_dict.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def get_peak_memory():
+    """
+    当前进程与已结束的子进程的内存峰值，单位MB
+    """
+    if resource is None:
+        return None, None
+    # linux下ru_maxrss的单位为KB，mac下为字节
+    unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit)
+
+
+def run_case(base_path, work_path, stock_count, years, days, storage_type, multi_process, strategy_count, seed=0):
+    """
+    运行一次测试，返回每个阶段的耗时与吞吐量。每次测试在单独的进程中运行，内存峰值互不影响
+    """
+    from plugins.StockStrategy.BaseDataApi import BaseDataApi
+
+    shutil.copytree(base_path, work_path)
+    history_list, daily_list = get_date_list(days, years)
+    payload_dict = {}
+    row_dict = {}
+    for product in bench_data_info:
+        for date in daily_list:
+            date_str = date.strftime('%Y-%m-%d')
+            file_name, content, row_count = generate_payload(product, date, stock_count, years, days, seed=seed)
+            payload_dict[(product, date_str)] = (file_name, content)
+            row_dict[(product, date_str)] = row_count
+
+    api = BaseDataApi(hid='bench', api_key='bench', all_data_path=work_path,
+                      strategy_result_path=os.path.join(work_path, 'strategy'), storage_type=storage_type,
+                      strategy_disk_cache=False)
+    api.up_data_info = bench_data_info
+    result_list = []
+    with MockApiServer(payload_dict) as server:
+        api.url = server.url
+        for product in bench_data_info:
+            stage_dict = {'download': 0, 'merge': 0}
+            for date in daily_list:
+                date_str = date.strftime('%Y-%m-%d')
+                start = time.perf_counter()
+                ret_dict, file_name = api.download_single_data(product, date_str)
+                stage_dict['download'] += time.perf_counter() - start
+                start = time.perf_counter()
+                api.merge_single_data(product, date_str, file_name, multi_process=multi_process)
+                stage_dict['merge'] += time.perf_counter() - start
+            row_count = sum(row_dict[(product, date.strftime('%Y-%m-%d'))] for date in daily_list)
+            wall_time = stage_dict['download'] + stage_dict['merge']
+            result_list.append({
+                'case': bench_data_info[product]['fun'],
+                'download_s': round(stage_dict['download'], 3),
+                'merge_s': round(stage_dict['merge'], 3),
+                'wall_s': round(wall_time, 3),
+                'rows_per_s': round(row_count / wall_time, 1),
+                'stocks_per_s': round(stock_count * days / wall_time, 1),
+            })
+
+        strategy_list = [[f'bench-strategy-{i}', '周', 3] for i in range(strategy_count)]
+        start = time.perf_counter()
+        for strategy, period, select_count in strategy_list:
+            api.get_strategy_result(strategy, period, select_count)
+        miss_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for strategy, period, select_count in strategy_list:
+            api.get_strategy_result(strategy, period, select_count)
+        hit_time = time.perf_counter() - start
+        for case, wall_time in [('get_strategy_result', miss_time), ('get_strategy_result(cached)', hit_time)]:
+            result_list.append({'case': case, 'wall_s': round(wall_time, 3),
+                                'strategies_per_s': round(strategy_count / max(wall_time, 1e-9), 1)})
+
+    if multi_process:  # 结束joblib的进程，子进程的内存峰值才会被统计
+        from joblib.externals.loky import get_reusable_executor
+        get_reusable_executor().shutdown(wait=True)
+    main_peak, worker_peak = get_peak_memory()
+    if not multi_process:  # 串行时没有工作进程
+        worker_peak = None
+    for result in result_list:
+        result.update({'storage_type': storage_type, 'multi_process': multi_process,
+                       'peak_mb': main_peak, 'worker_peak_mb': worker_peak})
+    return result_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据更新与策略结果获取的离线性能测试')
+    parser.add_argument('--stocks', type=int, default=500, help='股票数量')
+    parser.add_argument('--years', type=int, default=3, help='全量数据的年数')
+    parser.add_argument('--days', type=int, default=5, help='增量数据的天数')
+    parser.add_argument('--strategies', type=int, default=20, help='获取策略结果的数量')
+    parser.add_argument('--storage-type', nargs='+', default=['csv'], help='测试的存储格式')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子，相同的参数生成相同的数据')
+    parser.add_argument('--path', default=None, help='测试数据的路径，为空时使用临时文件夹，测试结束后删除')
+    parser.add_argument('--output', default=None, help='测试结果保存的json路径')
+    parser.add_argument('--case', default=None, help=argparse.SUPPRESS)  # 子进程运行单次测试时使用
+    args = parser.parse_args()
+
+    if args.case:
+        case = json.loads(args.case)
+        print('BENCHMARK_RESULT ' + json.dumps(run_case(**case), ensure_ascii=False))
+        return
+
+    path = args.path or tempfile.mkdtemp(prefix='stock_benchmark_')
+    result_list = []
+    try:
+        for storage_type in args.storage_type:
+            base_path = os.path.join(path, f'base_{storage_type}')
+            if not os.path.exists(base_path):
+                start = time.perf_counter()
+                row_count = generate_all_data(base_path, args.stocks, args.years, args.days, storage_type, args.seed)
+                print(f'生成{storage_type}全量数据{row_count}行，耗时{time.perf_counter() - start:.1f}秒')
+            for multi_process in [False, True]:
+                work_path = os.path.join(path, f'run_{storage_type}_{int(multi_process)}')
+                if os.path.exists(work_path):
+                    shutil.rmtree(work_path)
+                case = {'base_path': base_path, 'work_path': work_path, 'stock_count': args.stocks,
+                        'years': args.years, 'days': args.days, 'storage_type': storage_type,
+                        'multi_process': multi_process, 'strategy_count': args.strategies, 'seed': args.seed}
+                res = subprocess.run([sys.executable, '-m', __spec__.name, '--case', json.dumps(case)],
+                                     capture_output=True, text=True)
+                line_list = [line for line in res.stdout.splitlines() if line.startswith('BENCHMARK_RESULT ')]
+                if res.returncode != 0 or not line_list:
+                    print(res.stdout[-2000:], res.stderr[-2000:])
+                    raise RuntimeError(f'{storage_type}（multi_process={multi_process}）测试失败')
+                result_list += json.loads(line_list[-1][len('BENCHMARK_RESULT '):])
+                shutil.rmtree(work_path)
+    finally:
+        if not args.path:
+            shutil.rmtree(path, ignore_errors=True)
+
+    df = pd.DataFrame(result_list)
+    print(df.to_string(index=False))
+    if args.output:
+        with open(args.output, mode='w', encoding='utf8') as f:
+            json.dump(result_list, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
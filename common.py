@@ -1,10 +1,17 @@
+import atexit
 import datetime
 import json
 import logging as log
 import os
+import queue
+import threading
+import time
+from collections import deque
+
 import requests
 
 from plugins.StockStrategy.config import proxies, robot_api, root_path
+from plugins.StockStrategy.config import notify_window, notify_rate_limit, notify_queue_size, notify_sink
 
 # region 发送日志相关
 log_path = root_path + '/data/log/'
@@ -25,10 +32,8 @@ def record_log(msg, log_type='info', send=False, robot_type='info'):
     if log_type == 'info':
         log.info(msg=log_msg)
         if send:
-            try:
-                send_message(msg, robot_type=robot_type)
-            except Exception as err:
-                log.info(msg='发送错误信息失败')
+            # 放入后台队列发送，不等待发送结果
+            notifier.put(msg, robot_type=robot_type)
 
 
 # endregion
@@ -51,4 +56,167 @@ def send_message(content, robot_type='info'):
     body = json.dumps(msg)
     requests.post(url, data=body, headers=headers, timeout=10, proxies=proxies)
 
+
+def write_message(content, robot_type='info', path=None):
+    """
+    把消息写入文件，代替发送到机器人，用于离线测试
+    :param content: 消息内容
+    :param robot_type: 机器人类别
+    :param path: 文件路径
+    :return:
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    line = json.dumps({'time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'robot_type': robot_type,
+                       'content': content}, ensure_ascii=False)
+    with open(path, mode='a', encoding='utf8') as f:
+        f.write(line + '\n')
+
+
+class Notifier(object):
+    """
+    后台发送机器人消息：同一个机器人在时间窗口内的消息合并为一条，相同的消息只保留一条并记录次数，
+    按机器人限制发送频率。调用方只把消息放入队列，不会被发送阻塞，进程退出时发送剩余的消息。
+    """
+    max_length = 2000  # 企业微信文本消息最长2048字节，超出时拆分发送
+
+    def __init__(self, window=5, rate_limit=(20, 60), queue_size=1000, sink=None):
+        """
+        :param window: 合并消息的时间窗口，单位秒
+        :param rate_limit: 每个机器人的发送频率上限：（消息数量，秒）
+        :param queue_size: 等待发送的消息数量上限
+        :param sink: 为空时发送到机器人，填写文件路径时写入文件
+        """
+        self.window = window
+        self.rate_limit = rate_limit
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_dict = {}  # 每个机器人等待合并的消息，key: robot_type，value: (窗口开始时间, {消息: 次数})
+        self.sent_dict = {}  # 每个机器人最近的发送时间
+        self.stats = {'put': 0, 'dropped': 0, 'sent': 0, 'failed': 0}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='notifier', daemon=True)
+                self.thread.start()
+
+    def put(self, content, robot_type='info'):
+        """
+        把消息放入发送队列，队列已满时丢弃
+        :param content: 消息内容
+        :param robot_type: 机器人类别
+        :return: 是否放入队列
+        """
+        self.start()
+        try:
+            self.queue.put_nowait((robot_type, content))
+        except queue.Full:
+            self.stats['dropped'] += 1
+            log.info(msg='消息队列已满，丢弃消息：' + content)
+            return False
+        self.stats['put'] += 1
+        return True
+
+    def run(self):
+        while True:
+            timeout = self.get_wait_time()
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is None:  # 超时，发送窗口已经结束的消息
+                self.send_batch()
+                continue
+            if item[0] is self:  # flush请求，发送所有等待中的消息
+                self.send_batch(force=True)
+                item[1].set()
+                continue
+            robot_type, content = item
+            start_time, content_dict = self.batch_dict.setdefault(robot_type, (time.time(), {}))
+            content_dict[content] = content_dict.get(content, 0) + 1
+
+    def get_wait_time(self):
+        """
+        距离最早的一个时间窗口结束的秒数，没有等待中的消息时一直等待
+        """
+        if not self.batch_dict:
+            return None
+        return max(0, min(start_time for start_time, _ in self.batch_dict.values()) + self.window - time.time())
+
+    def send_batch(self, force=False):
+        """
+        发送时间窗口已经结束的消息
+        :param force: 是否忽略时间窗口，发送所有等待中的消息
+        :return:
+        """
+        now = time.time()
+        for robot_type in list(self.batch_dict.keys()):
+            start_time, content_dict = self.batch_dict[robot_type]
+            if not force and now < start_time + self.window:
+                continue
+            del self.batch_dict[robot_type]
+            content_list = [content if count == 1 else f'{content}（{count}次）'
+                            for content, count in content_dict.items()]
+            for content in self.split_content(content_list):
+                self.send(content, robot_type)
+
+    def split_content(self, content_list):
+        """
+        把多条消息合并成不超过长度上限的若干条
+        """
+        text = ''
+        for content in content_list:
+            if text and len((text + '\n' + content).encode('utf8')) > self.max_length:
+                yield text
+                text = ''
+            text = text + '\n' + content if text else content
+        if text:
+            yield text
+
+    def wait_rate_limit(self, robot_type):
+        """
+        超出发送频率时等待，只阻塞后台线程
+        """
+        count, seconds = self.rate_limit
+        sent_list = self.sent_dict.setdefault(robot_type, deque(maxlen=count))
+        if len(sent_list) == count:
+            wait_time = sent_list[0] + seconds - time.time()
+            if wait_time > 0:
+                time.sleep(wait_time)
+        sent_list.append(time.time())
+
+    def send(self, content, robot_type):
+        self.wait_rate_limit(robot_type)
+        try:
+            if self.sink:
+                write_message(content, robot_type=robot_type, path=self.sink)
+            else:
+                send_message(content, robot_type=robot_type)
+            self.stats['sent'] += 1
+        except Exception as err:
+            self.stats['failed'] += 1
+            log.info(msg='发送错误信息失败')
+
+    def flush(self, timeout=30):
+        """
+        发送所有等待中的消息
+        :param timeout: 最多等待的秒数
+        :return: 是否在超时前发送完成
+        """
+        if self.thread is None or not self.thread.is_alive():
+            return True
+        event = threading.Event()
+        try:
+            self.queue.put((self, event), timeout=timeout)
+        except queue.Full:
+            return False
+        return event.wait(timeout)
+
+
+notifier = Notifier(window=notify_window, rate_limit=notify_rate_limit, queue_size=notify_queue_size,
+                    sink=notify_sink)
+atexit.register(notifier.flush)
+
 # endregion
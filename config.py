@@ -20,9 +20,42 @@ all_data_path = os.path.join(root_path, "stock_data/数据")   # 全量数据路
 print(all_data_path)
 
 strategy_result_path = '/root/chatgpt-on-wechat/plugins/stock/stock_data/策略'  # 策略最新结果保存路径
+strategy_publish_time = '17:00'  # 每个交易日策略结果的发布时间，策略结果的缓存在该时间过期
+
+async_reply = True  # 插件是否在线程池中查询策略结果，查询完成后再回复，不阻塞其他消息
+handler_workers = 4  # 插件查询策略结果的线程数
+chat_concurrency = 2  # 每个会话同时进行的查询数量上限
 
 multi_process = True  # 是否并行
 
+max_workers = 4  # 批量更新数据时，并发下载与合并的线程数，1表示串行
+backfill = True  # 同一个产品需要更新多天的数据时，先下载所有日期，再一次合并，每个标的的全量数据只读写一次
+host_concurrency = 4  # 同一个域名同时进行的请求数量上限
+http_timeout = (5, 30)  # 请求的（连接超时，读取超时），单位秒
+stream_archive = True  # 按文件更新的数据是压缩包时，直接从压缩包内读取，不解压到硬盘
+group_chunk_size = 200000  # 按标的更新的数据分块读取的行数，内存占用不随增量文件大小增长，None表示一次读取整个文件
+group_buffer_rows = 1000000  # 分块读取时，所有标的缓存的行数上限，超出后提前合并
+metrics_path = os.path.join(root_path, 'data', 'metrics')  # 各阶段耗时统计（json报告与prometheus textfile）的导出路径，None表示不导出
+query_cache_bytes = 512 * 1024 * 1024  # 读取全量数据（base_data_api.data_query.load）时内存缓存的上限，单位字节
+# 截面数据：把指定字段整理成（日期 × 标的）的矩阵，保存在全量数据路径下的panel文件夹，合并增量数据时同步更新
+# 第一次使用前需要运行base_data_api.build_panel生成
+panel_fields_dict = {
+    'stock-trading-data-pro': ['开盘价', '最高价', '最低价', '收盘价', '前收盘价', '成交量', '成交额', '流通市值', '总市值'],
+}
+# 可以在本地计算的因子选股策略：每个选股日按因子排序，选出排名靠前的股票，因子需要在截面数据的字段中
+local_strategy_dict = {
+    # 小市值选股策略：总市值从小到大
+    'small-market-value': {'factor': '总市值', 'ascending': True},
+    # 低价股选股策略：收盘价从低到高
+    'low-price-stock': {'factor': '收盘价', 'ascending': True},
+}
+local_strategy_fallback = True  # 接口没有获取权限或者熔断时，是否使用本地计算的策略结果
+
+# 全量数据的存储格式
+# csv：与官方数据格式一致的gbk csv
+# parquet：按标的分片的列式存储，支持追加写入与按列读取，需要时可以通过export_csv导出为官方格式的csv
+storage_type = 'csv'
+
 data_white_list = [ 'stock-trading-data-pro', 'stock-equity','stock-analyst-ranking','xcf-analyst-ranking',
                    'stock-ind-element-equity', 'stock-fin-data-xbx']  # 数据白名单，将需要下载的数据放在列表内，如果为空不会下载任何数据。
 
@@ -74,14 +107,86 @@ strategy_white_list = [
     ['Bismarck', '5天', 3],
 ]
 
+strategy_max_workers = 8  # 批量获取策略结果时同时请求的数量
+
+# 策略简称与策略ID的对应关系，用于解析聊天中的查询，以及回测时查找rocket_plan.json中策略对应的ID
+# rocket_plan.json中的策略名称去掉'选股策略'、'事件策略'的后缀后查找，如'伽利略选股策略'对应'伽利略'
+strategy_name_dict = {
+    '低价小市值': 'low-price-small-market-value',
+    '量价相关性': 'price-volume-corr-stock',
+    '小市值': 'small-market-value',
+    '伽利略': 'galileo',
+    '财务基本面小市值': 'small-market-value-and-fin',
+    '反过度自信': 'anti-over-confidence-stock',
+    '费迪南w': 'Ferdinand-WangYang',
+    '费迪南x': 'Ferdinand-XiaoXiaoZhi',
+    '低价股': 'low-price-stock',
+    # '星边系选股001': 'xbx-s-001',
+    '费迪南': 'Ferdinand',
+    '费迪南Q': 'Ferdinand-QuanQiuRen',
+    '中证1000小市值': 'small-market-value-limit',
+    '费迪南成长': 'Ferdinand-growth',
+    '哥白尼': 'copernicus',
+    '流动性溢价': 'unliquidity',
+    '北上七侠': 'seven-knights',
+    '低估值高分红': 'low-valuation-high-dividend',
+    '笛卡尔': 'descartes',
+    '皮尔逊': 'pearson',
+    '低估值': 'low-valuation',
+    '缩量': 'low-volume-stock',
+    '创造191': 'rocket-quants-191',
+    '筹码分布': 'chip-distribution',
+    '小市值基本面过滤': 'small-market-value-filter',
+    '量价小市值': 'small-market-value-price-volume-corr',
+    '科技三杰': 'three-musketeers-new',
+    '资金流': 'money-flow',
+    '散户反买': 'retail-investors',
+    '萨拉丁': 'Saladin',
+    '筹码集中度': 'chip-concentration',
+    '拿破仑': 'Napoleon-pro',
+    '俾斯麦': 'Bismarck',
+    '北上高频': 'event-nf-flow',
+    '北上七侠事件': 'seven-knights-event',
+    '资金流z': 'money-flow-zhen',
+    '资金流t': 'money-flow-TianXingZhe',
+    '资金流q': 'money-flow-QiGuai',
+    '萨拉丁d': 'DingGuoQing',
+    '萨拉丁h': 'HuangJinMieMieYang',
+    '萨拉丁l': 'lzhh',
+    '香农': 'shannon'
+}
+
+# 回测rocket_plan.json中的策略组合
+backtest_commission = 1.2 / 10000  # 买卖的佣金费率
+backtest_stamp_tax = 0.5 / 1000  # 卖出的印花税率
 
 proxies = {}  # 代理信息
 
+# 机器人消息在后台线程中发送，不阻塞数据更新
+notify_window = 5  # 合并消息的时间窗口，单位秒，同一个机器人在窗口内的消息合并为一条发送
+notify_rate_limit = (20, 60)  # 每个机器人的发送频率上限：（消息数量，秒），企业微信机器人为每分钟20条
+notify_queue_size = 1000  # 等待发送的消息数量上限，超出后丢弃新的消息，只记录日志
+notify_sink = None  # 为空时发送到企业微信机器人，填写文件路径时把消息写入该文件，用于离线测试
+
 index_list = ['sh000016', 'sh000300','sh000001','sh000905','sh000852']  # 需要更新的指数列表
+index_max_workers = 4  # 同时更新的指数数量
+index_request_rate = 0.5  # 更新指数时所有指数合计每秒的请求数量
 # 正常股票sz000001, 上证指数：sh000001, 沪深300：sh000300, ETF sh510500, 中证500：sh000905, 中证1000：sh000852,上证50：sh000016,创业板指：sz399006
 
-# 数据获取模式，共三种
-# all：获取所有指定数据和上次运行抓取失败数据
+# 数据获取模式，共三种，每个（产品，日期）作为一个任务记录在data/update_job.db中
+# all：获取所有指定数据和到达重试时间的失败数据
 # new：只获取所有指定的数据
-# error：只获取上次运行抓取失败的数据
+# error：只获取到达重试时间的失败数据
+# 查看任务状态：python -m plugins.StockStrategy.job_store status
 mode = 'all'
+update_priority_dict = {
+    # 产品ID：优先级，数字越小越先执行，没有配置的产品为10
+    'stock-trading-data-pro': 0,
+    'stock-fin-data-xbx': 1,
+    'stock-equity': 2,
+    'stock-ind-element-equity': 2,
+    'stock-analyst-ranking': 5,
+    'xcf-analyst-ranking': 5,
+}
+job_max_attempts = 5  # 任务失败次数达到该值后不再自动重试，可以通过job_store retry手动重试
+job_retry_delay = 300  # 任务第一次失败后的重试间隔，单位秒，之后每次失败翻倍
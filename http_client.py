@@ -0,0 +1,152 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 不同状态码的重试退避参数：（基础等待秒数，最大等待秒数），不在其中的状态码不重试
+default_backoff_dict = {
+    'exception': (0.5, 10),  # 连接失败、超时等网络异常
+    429: (2, 60),
+    500: (1, 30),
+    502: (1, 30),
+    503: (2, 60),
+    504: (2, 60),
+}
+
+
+class CircuitOpenError(Exception):
+    """
+    触发熔断后，在冷却时间内拒绝继续请求
+    """
+    pass
+
+
+class HttpClient(object):
+    """
+    共享连接池的http客户端，带有按状态码区分的指数退避重试，以及按域名熔断
+    """
+
+    def __init__(self, headers=None, proxies=None, pool_size=16, timeout=(5, 30), max_retries=5,
+                 backoff_dict=None, breaker_status=(401, 403), breaker_cooldown=600):
+        """
+        :param headers: 默认请求头
+        :param proxies: 代理信息
+        :param pool_size: 每个域名保持的连接数量
+        :param timeout: （连接超时，读取超时），单位秒
+        :param max_retries: 最多请求的次数
+        :param backoff_dict: 不同状态码的重试退避参数
+        :param breaker_status: 触发熔断的状态码，默认为超出下载次数与无权限
+        :param breaker_cooldown: 熔断后的冷却时间，单位秒
+        """
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+        if proxies:
+            self.session.proxies.update(proxies)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_dict = backoff_dict if backoff_dict is not None else default_backoff_dict
+        self.breaker_status = breaker_status
+        self.breaker_cooldown = breaker_cooldown
+        self.breaker_dict = {}  # 每个域名熔断结束的时间
+        self.lock = threading.Lock()
+
+    def get_backoff(self, key, attempt):
+        """
+        计算重试前的等待时间，指数增长并加入随机抖动，避免并发的请求同时重试
+        :param key: 状态码，或者'exception'
+        :param attempt: 已经请求的次数
+        :return:
+        """
+        base, cap = self.backoff_dict[key]
+        return random.uniform(0, min(cap, base * 2 ** attempt))
+
+    def check_breaker(self, host):
+        """
+        判断域名是否处于熔断状态，熔断中直接抛出异常
+        :param host: 域名
+        :return:
+        """
+        with self.lock:
+            open_until = self.breaker_dict.get(host, 0)
+        if time.time() < open_until:
+            raise CircuitOpenError(f'{host}已熔断，{int(open_until - time.time())}秒后恢复请求')
+
+    def open_breaker(self, host):
+        with self.lock:
+            self.breaker_dict[host] = time.time() + self.breaker_cooldown
+
+    def reset_breaker(self, host=None):
+        """
+        手动解除熔断
+        :param host: 域名，为空时解除所有域名的熔断
+        :return:
+        """
+        with self.lock:
+            if host:
+                self.breaker_dict.pop(host, None)
+            else:
+                self.breaker_dict.clear()
+
+    def request(self, method, url, **kwargs) -> requests.models.Response:
+        """
+        发送请求，网络异常与可重试的状态码按照退避参数重试，触发熔断的状态码会让该域名的后续请求直接失败
+        :param method: 请求方法
+        :param url: 请求的url
+        :param kwargs: requests支持的其他参数
+        :return:
+        """
+        host = urlparse(url).netloc
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.max_retries):
+            self.check_breaker(host)
+            last_attempt = attempt == self.max_retries - 1
+            try:
+                res = self.session.request(method=method, url=url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if last_attempt or 'exception' not in self.backoff_dict:
+                    raise
+                time.sleep(self.get_backoff('exception', attempt))
+                continue
+            if res.status_code in self.breaker_status:
+                self.open_breaker(host)
+                return res
+            if res.status_code in self.backoff_dict and not last_attempt:
+                res.close()
+                time.sleep(self.get_backoff(res.status_code, attempt))
+                continue
+            return res
+
+
+class TokenBucket(object):
+    """
+    令牌桶限速，多个线程共用，每次请求前取一个令牌，没有令牌时等待
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+        :param rate: 每秒生成的令牌数量
+        :param capacity: 最多积累的令牌数量，即允许的突发请求数量
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.rate)
+            self.last_time = now
+            # 令牌不足时预支一个令牌，在锁外等待，排在后面的线程依次等待更久
+            wait_time = (1 - self.tokens) / self.rate if self.tokens < 1 else 0
+            self.tokens -= 1
+        if wait_time > 0:
+            time.sleep(wait_time)
@@ -0,0 +1,258 @@
+import argparse
+import datetime
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+# 任务状态
+# pending：等待执行；running：执行中；done：执行成功；error：执行失败，到达下次可执行时间后重试
+job_state_list = ['pending', 'running', 'done', 'error']
+
+
+def get_time_str(time=None):
+    return (time or datetime.datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class JobStore(object):
+    """
+    （产品，日期）数据更新任务的记录，保存在sqlite中。
+    每个任务记录状态、执行次数、下次可执行的时间与最近一次的报错，失败的任务按照次数指数退避后再重试
+    """
+
+    def __init__(self, db_path, error_path=None, max_attempts=5, retry_delay=300, max_retry_delay=6 * 3600):
+        """
+        :param db_path: sqlite数据库的路径
+        :param error_path: 原有的error.csv路径，第一次创建数据库时会一次性导入
+        :param max_attempts: 失败次数达到该值后不再自动重试
+        :param retry_delay: 第一次失败后的重试间隔，单位秒，之后每次失败翻倍
+        :param max_retry_delay: 重试间隔的上限，单位秒
+        """
+        self.db_path = db_path
+        self.error_path = error_path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.conn = None
+        self.lock = threading.RLock()
+
+    def get_connection(self):
+        """
+        第一次使用时再连接数据库，数据库不存在时创建表并导入原有的error.csv
+        :return:
+        """
+        if self.conn is not None:
+            return self.conn
+        is_new = not os.path.exists(self.db_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS update_job (
+                product TEXT NOT NULL,
+                date_time TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                priority INTEGER NOT NULL DEFAULT 10,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_eligible TEXT NOT NULL,
+                last_error TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (product, date_time)
+            )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_state_eligible ON update_job (state, next_eligible)')
+        conn.commit()
+        self.conn = conn
+        if is_new and self.error_path and os.path.exists(self.error_path):
+            self.import_error_csv(self.error_path)
+        return conn
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            conn = self.get_connection()
+            with conn:
+                return conn.execute(sql, params).rowcount
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return pd.read_sql_query(sql, self.get_connection(), params=params)
+
+    def add(self, product, date_time, priority=10, force=False):
+        """
+        添加任务，任务已经存在时只更新优先级，不改变状态、执行次数与下次可执行的时间，
+        失败或者已经完成的任务不会因为再次出现在最新日期中而重新执行，需要重试时使用retry
+        :param product: 产品ID
+        :param date_time: 数据日期
+        :param priority: 优先级，数字越小越先执行
+        :param force: 是否把已经存在的任务重新设置为立即执行，用于手动指定的日期
+        :return:
+        """
+        now = get_time_str()
+        if force:
+            update_sql = ("priority = excluded.priority, state = 'pending', attempts = 0, last_error = NULL, "
+                          "next_eligible = excluded.next_eligible, updated_at = excluded.updated_at")
+        else:
+            update_sql = 'priority = excluded.priority'
+        self.execute(f'''
+            INSERT INTO update_job (product, date_time, state, priority, next_eligible, updated_at)
+            VALUES (?, ?, 'pending', ?, ?, ?)
+            ON CONFLICT (product, date_time)
+            DO UPDATE SET {update_sql}''',
+                     (product, str(date_time), int(priority), now, now))
+
+    def recover(self):
+        """
+        上次运行中断时还在执行中的任务，重新设置为等待执行
+        :return: 恢复的任务数量
+        """
+        return self.execute("UPDATE update_job SET state = 'pending', updated_at = ? WHERE state = 'running'",
+                            (get_time_str(),))
+
+    def due_jobs(self, state_list, product_list=None):
+        """
+        获取已经到达可执行时间、且执行次数没有达到上限的任务，按照优先级、产品、日期排序
+        :param state_list: 任务状态
+        :param product_list: 产品ID，为空时不限制
+        :return:
+        """
+        condition = f'state IN ({",".join("?" * len(state_list))}) AND next_eligible <= ? AND attempts < ?'
+        params = list(state_list) + [get_time_str(), self.max_attempts]
+        if product_list is not None:
+            condition += f' AND product IN ({",".join("?" * len(product_list))})'
+            params += list(product_list)
+        return self.query(f'SELECT * FROM update_job WHERE {condition} ORDER BY priority, product, date_time', params)
+
+    def mark_running(self, product, date_time):
+        self.execute('''
+            UPDATE update_job SET state = 'running', attempts = attempts + 1, updated_at = ?
+            WHERE product = ? AND date_time = ?''', (get_time_str(), product, str(date_time)))
+
+    def mark_done(self, product, date_time):
+        self.execute('''
+            UPDATE update_job SET state = 'done', last_error = NULL, updated_at = ?
+            WHERE product = ? AND date_time = ?''', (get_time_str(), product, str(date_time)))
+
+    def mark_error(self, product, date_time, error=None):
+        """
+        记录任务失败，下次可执行的时间按照失败次数指数退避
+        :param product: 产品ID
+        :param date_time: 数据日期
+        :param error: 报错信息
+        :return:
+        """
+        with self.lock:
+            df = self.query('SELECT attempts FROM update_job WHERE product = ? AND date_time = ?',
+                            (product, str(date_time)))
+            attempts = max(int(df['attempts'].iloc[0]) if not df.empty else 0, 1)
+            delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+            now = datetime.datetime.now()
+            self.execute('''
+                INSERT INTO update_job (product, date_time, state, attempts, next_eligible, last_error, updated_at)
+                VALUES (?, ?, 'error', ?, ?, ?, ?)
+                ON CONFLICT (product, date_time)
+                DO UPDATE SET state = 'error', attempts = excluded.attempts, next_eligible = excluded.next_eligible,
+                    last_error = excluded.last_error, updated_at = excluded.updated_at''',
+                         (product, str(date_time), attempts, get_time_str(now + datetime.timedelta(seconds=delay)),
+                          error, get_time_str(now)))
+
+    def retry(self, product=None):
+        """
+        把失败的任务重新设置为立即可执行，并清空执行次数
+        :param product: 产品ID，为空时重置所有失败的任务
+        :return: 重置的任务数量
+        """
+        sql = "UPDATE update_job SET attempts = 0, next_eligible = ?, updated_at = ? WHERE state = 'error'"
+        params = [get_time_str(), get_time_str()]
+        if product:
+            sql += ' AND product = ?'
+            params.append(product)
+        return self.execute(sql, params)
+
+    def status(self):
+        """
+        每个产品各个状态的任务数量
+        :return:
+        """
+        df = self.query('SELECT product, state, COUNT(*) AS count FROM update_job GROUP BY product, state')
+        if df.empty:
+            return pd.DataFrame(columns=job_state_list)
+        df = df.pivot(index='product', columns='state', values='count').reindex(columns=job_state_list)
+        return df.fillna(0).astype(int)
+
+    def jobs(self, state=None, product=None):
+        """
+        获取任务列表
+        :param state: 任务状态，为空时不限制
+        :param product: 产品ID，为空时不限制
+        :return:
+        """
+        condition_list = []
+        params = []
+        for col, value in [('state', state), ('product', product)]:
+            if value is not None:
+                condition_list.append(f'{col} = ?')
+                params.append(value)
+        where = ('WHERE ' + ' AND '.join(condition_list)) if condition_list else ''
+        return self.query(f'SELECT * FROM update_job {where} ORDER BY priority, product, date_time', params)
+
+    def import_error_csv(self, path):
+        """
+        导入原有的error.csv，报错的数据作为失败的任务，立即可以重试
+        :param path: error.csv路径
+        :return: 导入的任务数量
+        """
+        df = pd.read_csv(path, encoding='gbk').drop_duplicates(subset=['product', 'date_time'])
+        df = df[df['error'].astype(str) == 'True']
+        now = get_time_str()
+        with self.lock:
+            conn = self.get_connection()
+            with conn:
+                conn.executemany('''
+                    INSERT OR IGNORE INTO update_job (product, date_time, state, attempts, next_eligible, updated_at)
+                    VALUES (?, ?, 'error', 1, ?, ?)''',
+                                 [(product, str(date_time), now, now)
+                                  for product, date_time in zip(df['product'], df['date_time'])])
+        return df.shape[0]
+
+    def export_error_csv(self, path):
+        """
+        导出为原有格式的error.csv，没有失败的任务时删除原有的文件
+        :param path: error.csv路径
+        :return: 失败的任务数量
+        """
+        df = self.jobs(state='error')
+        if df.empty:
+            if os.path.exists(path):
+                os.remove(path)
+            return 0
+        df['error'] = True
+        df[['product', 'date_time', 'error']].to_csv(path, encoding='gbk', index=False)
+        return df.shape[0]
+
+
+def main():
+    from plugins.StockStrategy.config import root_path
+
+    parser = argparse.ArgumentParser(description='数据更新任务的状态')
+    parser.add_argument('command', nargs='?', default='status', choices=['status', 'jobs', 'retry'],
+                        help='status：每个产品各个状态的任务数量；jobs：任务列表；retry：失败的任务立即重试')
+    parser.add_argument('--db', default=os.path.join(root_path, 'data', 'update_job.db'), help='任务数据库的路径')
+    parser.add_argument('--state', choices=job_state_list, help='只显示该状态的任务')
+    parser.add_argument('--product', help='只显示或重试该产品的任务')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f'任务数据库不存在：{args.db}')
+        return
+    store = JobStore(args.db)
+    if args.command == 'status':
+        print(store.status().to_string())
+    elif args.command == 'jobs':
+        with pd.option_context('display.max_rows', None, 'display.max_colwidth', 80, 'display.width', 200):
+            print(store.jobs(args.state, args.product).to_string(index=False))
+    else:
+        print(f'已重置{store.retry(args.product)}个失败的任务')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+
+
+class MergeJournal(object):
+    """
+    一个产品合并过程的记录，每个标的开始追加前记录文件大小，合并完成后记录完成，每条记录带上本次合并的日期。
+    进程中断后重新运行时，截断所有追加了一半的文件；合并的日期与上次相同时跳过已经完成的标的，
+    日期不同时所有标的重新合并（重复的记录在合并时去重）。全部合并完成后删除记录
+    """
+
+    def __init__(self, path, key=None):
+        """
+        :param path: 记录文件的路径，同一个产品的所有合并使用同一个路径
+        :param key: 本次合并的日期，只有日期相同时才跳过上次已经完成的标的
+        """
+        self.path = path
+        self.key = key
+        self.done_set = set()
+
+    def write(self, record):
+        # 每条记录一次写入，多个进程同时追加也不会交错
+        record['key'] = self.key
+        with open(self.path, mode='a', encoding='utf8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def start(self, symbol, path):
+        """
+        记录标的开始向文件末尾追加数据，以及文件当前的大小（分片存储时为已有的分片）。
+        全量重写是先写临时文件再替换，不需要记录
+        :param symbol: 标的名称
+        :param path: 全量数据路径
+        :return:
+        """
+        size = os.path.getsize(path) if os.path.isfile(path) else None
+        part_list = sorted(os.listdir(path)) if os.path.isdir(path) else None
+        self.write({'symbol': symbol, 'state': 'start', 'path': path, 'size': size, 'parts': part_list})
+
+    def done(self, symbol):
+        self.write({'symbol': symbol, 'state': 'done'})
+
+    def recover(self):
+        """
+        读取上次中断时的记录，截断追加了一半的文件，删除追加时新增的分片。
+        上次合并的日期与本次不同时，恢复之后删除记录，所有标的重新合并
+        :return: 本次合并可以跳过的标的
+        """
+        self.done_set = set()
+        if not os.path.exists(self.path):
+            return self.done_set
+        start_dict = {}
+        key_set = set()
+        with open(self.path, mode='r', encoding='utf8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # 中断时写了一半的记录
+                    continue
+                key = (record.get('key'), record['symbol'])
+                key_set.add(record.get('key'))
+                if record['state'] == 'start':
+                    start_dict[key] = record
+                elif record['state'] == 'done':
+                    start_dict.pop(key, None)
+                    self.done_set.add(record['symbol'])
+        for record in start_dict.values():
+            path, size, part_list = record['path'], record.get('size'), record.get('parts')
+            if size is not None and os.path.isfile(path) and os.path.getsize(path) > size:
+                with open(path, mode='rb+') as f:
+                    f.truncate(size)
+            elif part_list is not None and os.path.isdir(path):
+                for name in set(os.listdir(path)) - set(part_list):
+                    new_path = os.path.join(path, name)
+                    if os.path.isdir(new_path):
+                        shutil.rmtree(new_path)
+                    else:
+                        os.remove(new_path)
+        if key_set != {self.key}:
+            self.remove()
+        return self.done_set
+
+    def is_done(self, symbol):
+        return symbol in self.done_set
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.done_set = set()
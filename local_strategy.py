@@ -0,0 +1,165 @@
+import pandas as pd
+
+# 持仓周期对应的换仓频率，每个周期的最后一个交易日选股，下一个交易日买入
+period_freq_dict = {
+    '周': 'W-FRI',
+    '月': 'M',
+    '自然月': 'M',
+}
+
+
+class LocalStrategy(object):
+    """
+    本地计算的因子选股策略：在每个选股日对所有股票按照因子排序，选出排名靠前的股票。
+    因子从（日期 × 标的）的截面数据中读取，所有日期、所有股票一次计算，不逐日循环
+    """
+
+    def __init__(self, api, strategy_dict, product='stock-trading-data-pro'):
+        """
+        :param api: BaseDataApi，提供截面数据与全量数据的读取
+        :param strategy_dict: 策略规则，{策略ID: {'factor': 因子字段, 'ascending': 是否从小到大排序}}
+        :param product: 计算因子使用的产品
+        """
+        self.api = api
+        self.strategy_dict = strategy_dict
+        self.product = product
+
+    def get_panel(self):
+        """
+        获取截面数据，还没有生成时先根据全量数据生成
+        :return:
+        """
+        panel = self.api.get_panel(self.product)
+        if panel is None:
+            raise ValueError(f'{self.product}没有配置截面数据的字段，无法在本地计算策略')
+        if panel.load_meta() is None:
+            self.api.build_panel(self.product)
+        return panel
+
+    @staticmethod
+    def get_select_dates(date_index, period):
+        """
+        根据持仓周期获取选股日与对应的买入日
+        :param date_index: 所有的交易日
+        :param period: 持仓周期，选股策略为'周'、'月'、'自然月'，事件策略为'x天'，每个交易日都选股
+        :return: 选股日与买入日，最后一个周期还没有结束时不包含该周期；最后一个选股日之后还没有交易日时，买入日为下一个工作日
+        """
+        date_index = pd.DatetimeIndex(date_index).sort_values()
+        period = str(period)
+        if '天' in period:
+            select_index = date_index
+        elif period in period_freq_dict:
+            # 每个周期的最后一个交易日
+            freq = period_freq_dict[period]
+            period_series = pd.Series(date_index.to_period(freq), index=date_index)
+            select_index = pd.DatetimeIndex(period_series.index[~period_series.duplicated(keep='last')])
+            # 最后一个周期还没有结束时，最后一天不是该周期的选股日，去掉。
+            # 没有交易日历，按工作日判断：下一个工作日仍在同一周期内，说明周期还没有结束
+            last_date = date_index[-1] if len(date_index) else None
+            if last_date is not None and \
+                    (last_date + pd.offsets.BDay(1)).to_period(freq) == last_date.to_period(freq):
+                select_index = select_index[:-1]
+        else:
+            raise ValueError(f'本地策略不支持持仓周期：{period}')
+        position = date_index.searchsorted(select_index, side='right')
+        buy_index = pd.DatetimeIndex([date_index[i] if i < len(date_index) else select_date + pd.offsets.BDay(1)
+                                      for i, select_date in zip(position, select_index)])
+        return select_index, buy_index
+
+    def select(self, strategy, period, select_count, start=None, end=None):
+        """
+        一次计算策略在所有选股日的选股结果
+        :param strategy: 策略ID
+        :param period: 持仓周期
+        :param select_count: 选股数量，0表示选出所有符合条件的股票
+        :param start: 开始日期（包含），为空时从最早的数据开始
+        :param end: 结束日期（包含），为空时到最新的数据
+        :return: 包含trade_date、buy_date、symbol、rank列的数据，按选股日与排名排序
+        """
+        if strategy not in self.strategy_dict:
+            raise ValueError(f'{strategy}不是本地可以计算的策略')
+        rule = self.strategy_dict[strategy]
+        panel = self.get_panel()
+        if rule['factor'] not in panel.fields:
+            raise ValueError(f'截面数据中没有{rule["factor"]}字段，需要添加到panel_fields_dict后重新生成')
+        factor_df = panel.frame(rule['factor'], start, end)
+        if factor_df.empty:
+            return pd.DataFrame(columns=['trade_date', 'buy_date', 'symbol', 'rank'])
+
+        select_index, buy_index = self.get_select_dates(factor_df.index, period)
+        factor_df = factor_df.loc[select_index]
+        # 当天停牌（没有成交量）的股票不参与排序
+        if '成交量' in panel.fields:
+            volume_df = panel.frame('成交量', start, end).loc[select_index, factor_df.columns]
+            factor_df = factor_df.where(volume_df > 0)
+        rank_df = factor_df.rank(axis=1, ascending=rule.get('ascending', True), method='first')
+        if int(select_count) > 0:
+            rank_df = rank_df.where(rank_df <= int(select_count))
+
+        df = rank_df.stack().dropna().rename('rank').reset_index()
+        df.columns = ['trade_date', 'symbol', 'rank']
+        df['rank'] = df['rank'].astype(int)
+        df['buy_date'] = df['trade_date'].map(pd.Series(buy_index, index=select_index))
+        return df.sort_values(['trade_date', 'rank'], ignore_index=True)[['trade_date', 'buy_date', 'symbol', 'rank']]
+
+    def add_name(self, df):
+        """
+        添加选股日的股票名称，只读取被选中股票的名称列
+        :param df: 选股结果
+        :return:
+        """
+        if df.empty:
+            df['name'] = pd.Series(dtype=object)
+            return df
+        date_col = self.api.data_query.get_date_col(self.product)
+        df_dict = self.api.data_query.load_batch(self.product, df['symbol'].unique(), columns=[date_col, '股票名称'])
+        name_list = [_df.assign(symbol=symbol) for symbol, _df in df_dict.items() if not _df.empty]
+        if not name_list:
+            df['name'] = None
+            return df
+        name_df = pd.concat(name_list, ignore_index=True).rename(columns={date_col: 'trade_date', '股票名称': 'name'})
+        name_df = name_df.drop_duplicates(subset=['trade_date', 'symbol'], keep='last')
+        return df.merge(name_df, on=['trade_date', 'symbol'], how='left')
+
+    def get_strategy_result(self, strategy, period, select_count):
+        """
+        计算最新一期的选股结果，格式与接口返回的策略结果一致
+        :param strategy: 策略ID
+        :param period: 持仓周期
+        :param select_count: 选股数量
+        :return:
+        """
+        panel = self.get_panel()
+        date_index = panel.dates()
+        if date_index.empty:
+            return {'code': 1005, 'select_time': None, 'buy_time': None, 'result': []}
+        # 只需要最近一个周期的数据，往前多取一个月保证包含完整的周期
+        start = date_index[-1] - pd.DateOffset(months=2)
+        df = self.select(strategy, period, select_count, start=start)
+        if df.empty:
+            return {'code': 1005, 'select_time': None, 'buy_time': None, 'result': []}
+        df = self.add_name(df[df['trade_date'] == df['trade_date'].max()].copy())
+        return {
+            'code': 200,
+            'select_time': df['trade_date'].iloc[0].strftime('%Y-%m-%d'),
+            'buy_time': df['buy_date'].iloc[0].strftime('%Y-%m-%d'),
+            'result': [{'name': name if pd.notna(name) else '', 'symbol': symbol}
+                       for name, symbol in zip(df['name'], df['symbol'])],
+        }
+
+    def history(self, strategy, period, select_count, start=None, end=None):
+        """
+        一次计算策略的全部历史选股结果，格式与策略结果库一致
+        :param strategy: 策略ID
+        :param period: 持仓周期
+        :param select_count: 选股数量
+        :param start: 开始日期（包含），为空时从最早的数据开始
+        :param end: 结束日期（包含），为空时到最新的数据
+        :return:
+        """
+        df = self.add_name(self.select(strategy, period, select_count, start, end))
+        df['trade_date'] = pd.to_datetime(df['trade_date']).dt.strftime('%Y-%m-%d')
+        df['strategy'] = strategy
+        df['period'] = period
+        df['select_count'] = int(select_count)
+        return df[['strategy', 'period', 'select_count', 'trade_date', 'symbol', 'name', 'rank']]
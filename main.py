@@ -3,7 +3,12 @@ from common import *
 from config import *
 
 base_data_api = BaseDataApi(api_key=api_key, hid=hid, all_data_path=all_data_path,
-                            strategy_result_path=strategy_result_path)
+                            strategy_result_path=strategy_result_path, storage_type=storage_type,
+                            host_concurrency=host_concurrency, http_timeout=http_timeout,
+                            strategy_publish_time=strategy_publish_time, metrics_path=metrics_path,
+                            job_max_attempts=job_max_attempts, job_retry_delay=job_retry_delay,
+                            query_cache_bytes=query_cache_bytes, panel_fields_dict=panel_fields_dict,
+                            local_strategy_dict=local_strategy_dict, local_strategy_fallback=local_strategy_fallback)
 
 start_time = datetime.datetime.now()
 # ===================  记录日志  ===================
@@ -12,21 +17,36 @@ record_log(f' -->开始更新数据', send=True)
 
 # # 更新单个数据
 # base_data_api.update_single_data(product=product, date_time=date_time, multi_process=multi_process)
+# base_data_api.export_metrics()
 # exit()
 # 更新所有API数据
 # record_log(f' -->开始更新白名单数据', send=True)
 # base_data_api.update_all_data(multi_process=multi_process, data_white_list=data_white_list, mode=mode, data_white_list_dict=data_white_list_dict,
-#                               date_time=date_time)
+#                               date_time=date_time, max_workers=max_workers, priority_dict=update_priority_dict,
+#                               backfill=backfill, stream_archive=stream_archive,
+#                               chunk_size=group_chunk_size, buffer_rows=group_buffer_rows)
+
+# # 生成截面数据，只需要运行一次，之后合并增量数据时同步更新
+# base_data_api.build_panel('stock-trading-data-pro', max_workers=max_workers)
+
+# # 在本地重新计算策略的全部历史选股结果
+# base_data_api.recompute_local_strategy('small-market-value', '周', 3)
+
+# # 回测rocket_plan.json中的策略组合，多组参数并行回测
+# from backtest import Backtest
+# backtest = Backtest(base_data_api, strategy_name_dict=strategy_name_dict, commission=backtest_commission,
+#                     stamp_tax=backtest_stamp_tax)
+# print(backtest.run()['stats'].to_string())
+# print(backtest.run_variants({'伽利略选股策略': {'select_count': [3, 10]}}).to_string())
 
 # # 更新指数数据
 # record_log(f' -->开始更新指数数据', send=True)
-# base_data_api.update_stock_index(index_list)
+# base_data_api.update_stock_index(index_list, max_workers=index_max_workers, request_rate=index_request_rate)
 
-# 获取策略案例
-for strategy_white in strategy_white_list:
-    strategy_res = base_data_api.get_strategy_result(strategy=strategy_white[0], period=strategy_white[1],
-                                                     select_count=strategy_white[2])
-    print(strategy_res)
+# 获取策略案例，所有策略并发获取
+strategy_res_list, strategy_status_df = base_data_api.get_strategy_result_list(strategy_white_list,
+                                                                               max_workers=strategy_max_workers)
+print(strategy_status_df.to_string())
 
 print('更新完成，消耗时间：', datetime.datetime.now() - start_time)
 # ===================  记录日志  ===================
@@ -0,0 +1,181 @@
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # windows没有resource模块，不统计内存峰值
+    resource = None
+
+# 每个阶段统计的指标，以及导出为prometheus时的名称与说明
+metric_dict = {
+    'count': ('stock_update_stage_count_total', 'counter', '阶段执行次数'),
+    'wall': ('stock_update_stage_wall_seconds_total', 'counter', '阶段耗时（秒）'),
+    'cpu': ('stock_update_stage_cpu_seconds_total', 'counter', '阶段占用的CPU时间（秒）'),
+    'bytes': ('stock_update_stage_bytes_total', 'counter', '阶段处理的字节数'),
+    'rows': ('stock_update_stage_rows_total', 'counter', '阶段处理的行数'),
+    'peak_rss': ('stock_update_stage_peak_rss_bytes', 'gauge', '阶段结束时进程的内存峰值（字节）'),
+}
+
+
+def get_peak_rss():
+    """
+    当前进程的内存峰值，单位字节
+    """
+    if resource is None:
+        return 0
+    # linux下ru_maxrss的单位为KB，mac下为字节
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+class Metrics(object):
+    """
+    数据更新各个阶段的耗时与资源统计，按（产品，阶段）汇总。
+    joblib的工作进程中通过capture收集本次任务的记录并返回，由主进程合并，避免各进程分别统计导致丢失
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stat_dict = {}  # key: (产品, 阶段)，value: 各项指标
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def span(self, product, stage, bytes=0, rows=0):
+        """
+        统计一个阶段，阶段内可以更新记录中的bytes与rows
+        :param product: 产品ID
+        :param stage: 阶段名称
+        :param bytes: 处理的字节数
+        :param rows: 处理的行数
+        :return: 本次阶段的记录
+        """
+        record = {'product': product, 'stage': stage, 'count': 1, 'bytes': bytes, 'rows': rows}
+        if not self.enabled:
+            yield record
+            return
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - wall_start
+            record['cpu'] = time.thread_time() - cpu_start
+            record['peak_rss'] = get_peak_rss()
+            self.add(record)
+
+    def add(self, record):
+        """
+        汇总一条记录，处于capture中时先放入capture的列表
+        :param record: 阶段记录
+        :return:
+        """
+        capture_list = getattr(self.local, 'capture_list', None)
+        if capture_list is not None:
+            capture_list.append(record)
+            return
+        key = (record['product'], record['stage'])
+        with self.lock:
+            stat = self.stat_dict.setdefault(key, dict.fromkeys(metric_dict, 0))
+            for name in metric_dict:
+                if name == 'peak_rss':
+                    stat[name] = max(stat[name], record.get(name, 0))
+                else:
+                    stat[name] += record.get(name, 0)
+
+    def merge(self, record_list):
+        """
+        合并工作进程返回的记录
+        :param record_list:
+        :return:
+        """
+        for record in record_list or []:
+            self.add(record)
+
+    @contextmanager
+    def capture(self):
+        """
+        收集当前线程的记录，不直接汇总，用于在工作进程中把记录返回给主进程
+        :return: 收集到的记录列表
+        """
+        previous = getattr(self.local, 'capture_list', None)
+        self.local.capture_list = []
+        try:
+            yield self.local.capture_list
+        finally:
+            self.local.capture_list = previous
+
+    def reset(self):
+        with self.lock:
+            self.stat_dict.clear()
+            self.start_time = time.time()
+
+    def report(self):
+        """
+        生成本次运行的报告
+        :return:
+        """
+        with self.lock:
+            stage_list = [{'product': product, 'stage': stage, **stat}
+                          for (product, stage), stat in sorted(self.stat_dict.items())]
+        return {
+            'start_time': datetime.datetime.fromtimestamp(self.start_time).strftime('%Y-%m-%d %H:%M:%S'),
+            'end_time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'wall': time.time() - self.start_time,
+            'peak_rss': get_peak_rss(),
+            'stages': stage_list,
+        }
+
+    def to_prometheus(self, report=None):
+        """
+        转换为prometheus的textfile格式
+        :param report: 运行报告，为空时使用当前的统计
+        :return:
+        """
+        report = report or self.report()
+        line_list = []
+        for name, (metric, metric_type, help_text) in metric_dict.items():
+            line_list.append(f'# HELP {metric} {help_text}')
+            line_list.append(f'# TYPE {metric} {metric_type}')
+            for stage in report['stages']:
+                line_list.append(f'{metric}{{product="{stage["product"]}",stage="{stage["stage"]}"}} {stage[name]}')
+        line_list.append('# HELP stock_update_last_run_timestamp_seconds 最近一次运行结束的时间')
+        line_list.append('# TYPE stock_update_last_run_timestamp_seconds gauge')
+        line_list.append(f'stock_update_last_run_timestamp_seconds {time.time()}')
+        return '\n'.join(line_list) + '\n'
+
+    def export(self, path, name='stock_update'):
+        """
+        导出json运行报告与prometheus的textfile，先写临时文件再替换，避免采集到写了一半的文件
+        :param path: 导出的文件夹
+        :param name: 文件名前缀
+        :return: （json路径，prometheus路径）
+        """
+        os.makedirs(path, exist_ok=True)
+        report = self.report()
+        json_path = os.path.join(path, f'{name}_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.json')
+        prom_path = os.path.join(path, f'{name}.prom')
+        for file_path, content in [(json_path, json.dumps(report, ensure_ascii=False, indent=2)),
+                                   (prom_path, self.to_prometheus(report))]:
+            with open(file_path + '.tmp', mode='w', encoding='utf8') as f:
+                f.write(content)
+            os.replace(file_path + '.tmp', file_path)
+        return json_path, prom_path
+
+
+def capture_call(func, *args, **kwargs):
+    """
+    在joblib的工作进程中调用函数，同时返回函数执行过程中的统计记录
+    :return: （函数的返回值，统计记录）
+    """
+    with metrics.capture() as record_list:
+        result = func(*args, **kwargs)
+    return result, record_list
+
+
+metrics = Metrics()
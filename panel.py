@@ -0,0 +1,271 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class PanelStore(object):
+    """
+    截面数据：把按标的保存的日线数据的指定字段整理成（日期 × 标的）的矩阵，每个字段一个内存映射文件。
+    矩阵按日期逐行保存，某一天所有标的的数据在文件中是连续的，读取截面只需要读取一行。
+    标的预留一部分空位，新上市的标的直接使用空位；新的日期追加到文件末尾，只有日期插入到中间或者空位用完时才重写文件。
+    重写时写出新版本的文件，替换索引之后再删除旧版本，读取的进程始终读到一致的索引与文件
+    """
+    meta_name = 'meta.json'
+
+    def __init__(self, path, fields, date_col='交易日期', symbol_col='股票代码', dtype='float64', symbol_slack=500):
+        """
+        :param path: 截面数据保存的文件夹
+        :param fields: 需要整理的字段，只支持数值字段
+        :param date_col: 日期列
+        :param symbol_col: 标的列
+        :param dtype: 矩阵的数据类型
+        :param symbol_slack: 重写文件时为新标的预留的空位数量
+        """
+        self.path = path
+        self.fields = list(fields)
+        self.date_col = date_col
+        self.symbol_col = symbol_col
+        self.dtype = np.dtype(dtype)
+        self.symbol_slack = symbol_slack
+        self.meta = None
+        self.meta_mtime = None
+        self.date_dict = {}  # key: 日期，value: 行号
+        self.symbol_dict = {}  # key: 标的，value: 列号
+        self.array_dict = {}  # 每个字段打开的内存映射
+        self.lock = threading.RLock()
+
+    def __getstate__(self):
+        # 并行时会被复制到子进程，锁与打开的内存映射不能复制
+        state = self.__dict__.copy()
+        state['lock'] = None
+        state['array_dict'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def get_meta_path(self):
+        return os.path.join(self.path, self.meta_name)
+
+    def get_field_path(self, field, version=None):
+        version = self.meta['version'] if version is None else version
+        return os.path.join(self.path, f'{field}.{version}.dat')
+
+    def load_meta(self):
+        """
+        读取日期与标的的索引，其他进程更新了截面数据时重新读取
+        :return: 索引，截面数据不存在时返回None
+        """
+        with self.lock:
+            meta_path = self.get_meta_path()
+            if not os.path.exists(meta_path):
+                self.meta = None
+                return None
+            mtime = os.stat(meta_path).st_mtime_ns
+            if self.meta is not None and mtime == self.meta_mtime:
+                return self.meta
+            with open(meta_path, mode='r', encoding='utf8') as f:
+                meta = json.load(f)
+            self.set_meta(meta)
+            self.meta_mtime = mtime
+            return meta
+
+    def set_meta(self, meta):
+        self.meta = meta
+        self.date_dict = {date: i for i, date in enumerate(meta['dates'])}
+        self.symbol_dict = {symbol: i for i, symbol in enumerate(meta['symbols'])}
+        self.array_dict = {}
+
+    def save_meta(self, meta):
+        """
+        写出索引，先写临时文件再替换，读取的进程不会读到写了一半的索引
+        """
+        tmp_path = f'{self.get_meta_path()}.{os.getpid()}.tmp'
+        with open(tmp_path, mode='w', encoding='utf8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self.get_meta_path())
+        self.set_meta(meta)
+        self.meta_mtime = os.stat(self.get_meta_path()).st_mtime_ns
+
+    def get_array(self, field, mode='r'):
+        """
+        打开字段的内存映射
+        :param field: 字段名称
+        :param mode: 'r'只读，'r+'读写
+        :return: （日期数量，标的容量）的矩阵
+        """
+        meta = self.meta
+        if mode == 'r' and field in self.array_dict:
+            return self.array_dict[field]
+        array = np.memmap(self.get_field_path(field), dtype=self.dtype, mode=mode,
+                          shape=(len(meta['dates']), meta['capacity']))
+        if mode == 'r':
+            self.array_dict[field] = array
+        return array
+
+    def create(self, dates, symbols):
+        """
+        按照新的日期与标的重写所有字段的文件，原有的数据复制到新的位置
+        :param dates: 排好序的日期
+        :param symbols: 标的，原有的标的排在前面，保持原来的顺序
+        :return:
+        """
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            old_meta = self.load_meta()
+            version = old_meta['version'] + 1 if old_meta else 0
+            capacity = len(symbols) + self.symbol_slack
+            date_array = np.array(dates)
+            for field in self.fields:
+                new_array = np.memmap(self.get_field_path(field, version), dtype=self.dtype, mode='w+',
+                                      shape=(len(dates), capacity))
+                new_array[:] = np.nan
+                if old_meta and field in old_meta['fields'] and old_meta['dates']:
+                    old_array = self.get_array(field)
+                    symbol_count = len(old_meta['symbols'])
+                    row_array = np.searchsorted(date_array, np.array(old_meta['dates']))
+                    # 分块复制，内存占用不随数据量增长
+                    for start in range(0, len(row_array), 1000):
+                        new_array[row_array[start:start + 1000], :symbol_count] = \
+                            old_array[start:start + 1000, :symbol_count]
+                new_array.flush()
+                del new_array
+            self.save_meta({'version': version, 'dates': list(dates), 'symbols': list(symbols),
+                            'capacity': capacity, 'fields': self.fields, 'dtype': self.dtype.name})
+            # 删除旧版本的文件，正在读取旧版本的进程不受影响
+            for name in os.listdir(self.path):
+                if name.endswith('.dat') and not name.endswith(f'.{version}.dat'):
+                    os.remove(os.path.join(self.path, name))
+
+    def append_dates(self, dates):
+        """
+        在所有字段的文件末尾追加新的日期，不重写原有的数据
+        :param dates: 排在原有日期之后的新日期
+        :return:
+        """
+        with self.lock:
+            meta = dict(self.meta)
+            block = np.full((len(dates), meta['capacity']), np.nan, dtype=self.dtype).tobytes()
+            for field in self.fields:
+                with open(self.get_field_path(field), mode='ab') as f:
+                    f.write(block)
+            meta['dates'] = meta['dates'] + list(dates)
+            self.save_meta(meta)
+
+    def clear(self):
+        """
+        删除截面数据，重新生成前使用
+        """
+        with self.lock:
+            if os.path.exists(self.get_meta_path()):
+                os.remove(self.get_meta_path())
+            if os.path.isdir(self.path):
+                for name in os.listdir(self.path):
+                    if name.endswith('.dat'):
+                        os.remove(os.path.join(self.path, name))
+            self.meta = None
+            self.meta_mtime = None
+            self.date_dict, self.symbol_dict, self.array_dict = {}, {}, {}
+
+    def update(self, df):
+        """
+        把日线数据写入截面数据，新的日期追加到末尾，新的标的使用预留的空位
+        :param df: 包含日期列、标的列与字段的数据
+        :return:
+        """
+        if df.empty:
+            return
+        df = df[df[self.symbol_col].notna() & df[self.date_col].notna()]
+        date_list = pd.to_datetime(df[self.date_col]).dt.strftime('%Y-%m-%d').unique().tolist()
+        symbol_list = df[self.symbol_col].astype(str).unique().tolist()
+        with self.lock:
+            meta = self.load_meta()
+            if meta is None:
+                self.create(sorted(date_list), sorted(symbol_list))
+            else:
+                new_date_list = sorted(set(date_list) - set(self.date_dict))
+                new_symbol_list = sorted(set(symbol_list) - set(self.symbol_dict))
+                symbol_count = len(meta['symbols']) + len(new_symbol_list)
+                # 字段发生变化、日期插入到中间或者空位用完时重写文件，新增的字段需要重新生成才有历史数据
+                if meta['fields'] != self.fields or symbol_count > meta['capacity'] or \
+                        (new_date_list and meta['dates'] and new_date_list[0] < meta['dates'][-1]):
+                    self.create(sorted(meta['dates'] + new_date_list), meta['symbols'] + new_symbol_list)
+                else:
+                    if new_symbol_list:
+                        self.save_meta({**meta, 'symbols': meta['symbols'] + new_symbol_list})
+                    if new_date_list:
+                        self.append_dates(new_date_list)
+            self.write_values(df)
+
+    def write_values(self, df):
+        """
+        写入数据，日期与标的需要已经在索引中
+        :param df: 包含日期列、标的列与字段的数据
+        :return:
+        """
+        with self.lock:
+            row_array = pd.to_datetime(df[self.date_col]).dt.strftime('%Y-%m-%d').map(self.date_dict).to_numpy()
+            col_array = df[self.symbol_col].astype(str).map(self.symbol_dict).to_numpy()
+            for field in self.fields:
+                array = self.get_array(field, mode='r+')
+                if field in df.columns:
+                    array[row_array, col_array] = pd.to_numeric(df[field], errors='coerce').to_numpy(self.dtype)
+                array.flush()
+                del array
+
+    def dates(self):
+        meta = self.load_meta()
+        return pd.to_datetime(meta['dates']) if meta else pd.DatetimeIndex([])
+
+    def symbols(self):
+        meta = self.load_meta()
+        return list(meta['symbols']) if meta else []
+
+    def cross_section(self, date, fields=None):
+        """
+        某一天所有标的的截面数据
+        :param date: 日期
+        :param fields: 字段，为空时返回所有字段
+        :return: index为标的，columns为字段，当天没有数据的标的不返回
+        """
+        with self.lock:
+            meta = self.load_meta()
+            fields = fields or self.fields
+            row = self.date_dict.get(pd.to_datetime(date).strftime('%Y-%m-%d')) if meta else None
+            if row is None:
+                return pd.DataFrame(columns=fields, index=pd.Index([], name=self.symbol_col))
+            symbol_count = len(meta['symbols'])
+            data = {field: np.array(self.get_array(field)[row, :symbol_count]) for field in fields}
+            symbol_index = pd.Index(meta['symbols'], name=self.symbol_col)
+        return pd.DataFrame(data, index=symbol_index).dropna(how='all')
+
+    def frame(self, field, start=None, end=None, symbols=None):
+        """
+        单个字段的（日期 × 标的）矩阵
+        :param field: 字段名称
+        :param start: 开始日期（包含），为空时不限制
+        :param end: 结束日期（包含），为空时不限制
+        :param symbols: 标的，为空时返回所有标的
+        :return: index为日期，columns为标的
+        """
+        with self.lock:
+            meta = self.load_meta()
+            if meta is None:
+                return pd.DataFrame()
+            date_index = pd.to_datetime(meta['dates'])
+            start_row = 0 if start is None else date_index.searchsorted(pd.to_datetime(start), side='left')
+            end_row = len(date_index) if end is None else date_index.searchsorted(pd.to_datetime(end), side='right')
+            symbol_count = len(meta['symbols'])
+            if symbols is None:
+                col_array = np.arange(symbol_count)
+                symbol_list = meta['symbols']
+            else:
+                symbol_list = [symbol for symbol in symbols if symbol in self.symbol_dict]
+                col_array = np.array([self.symbol_dict[symbol] for symbol in symbol_list], dtype=int)
+            value = np.array(self.get_array(field)[start_row:end_row][:, col_array])
+        return pd.DataFrame(value, index=pd.Index(date_index[start_row:end_row], name=self.date_col),
+                            columns=pd.Index(symbol_list, name=self.symbol_col))
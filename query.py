@@ -0,0 +1,216 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from plugins.StockStrategy.storage import ParquetStorage, align_float_dtypes, write_feather
+
+
+class DataQuery(object):
+    """
+    全量数据的读取接口，按标的、日期范围与列读取。
+    csv第一次读取时转换为不压缩的arrow文件，之后通过内存映射只读取需要的列，全量数据更新后重新转换；parquet直接按列读取。
+    最近读取的数据缓存在内存中，超过内存上限时淘汰最久没有使用的数据
+    """
+
+    def __init__(self, api, cache_bytes=512 * 1024 * 1024, columnar_path=None):
+        """
+        :param api: BaseDataApi，提供全量数据路径、存储格式与数据的读取
+        :param cache_bytes: 内存缓存的上限，单位字节，0表示不缓存
+        :param columnar_path: csv转换成arrow文件的保存路径，为空时保存在全量数据路径下的temp/columnar
+        """
+        self.api = api
+        self.cache_bytes = cache_bytes
+        self.columnar_path = columnar_path or os.path.join(api.all_data_path, 'temp', 'columnar')
+        self.cache_dict = OrderedDict()  # key: (产品, 标的, 列)，value: (文件签名, 数据, 字节数)
+        self.cache_size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hit': 0, 'miss': 0, 'evict': 0}
+
+    def get_path(self, product, symbol):
+        return os.path.join(self.api.all_data_path, product, symbol + self.api.storage.suffix)
+
+    def get_date_col(self, product):
+        parse_dates = self.api.up_data_info[product].get('parse_dates') or []
+        return parse_dates[0] if parse_dates else None
+
+    @staticmethod
+    def get_signature(path):
+        """
+        全量数据文件的签名，文件发生变化时签名随之变化，用于判断缓存是否有效
+        :param path: 全量数据路径
+        :return: 文件不存在时返回None
+        """
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            return f'{stat.st_size}_{stat.st_mtime_ns}'
+        part_list = ParquetStorage.get_part_list(path)
+        if not part_list:
+            return None
+        stat = os.stat(part_list[-1])
+        return f'{len(part_list)}_{os.path.basename(part_list[-1])}_{stat.st_size}_{stat.st_mtime_ns}'
+
+    def symbols(self, product):
+        """
+        产品下所有标的的名称
+        :param product: 产品ID
+        :return:
+        """
+        product_path = os.path.join(self.api.all_data_path, product)
+        suffix = self.api.storage.suffix
+        symbol_list = []
+        for root, dirs, files in os.walk(product_path):
+            # csv的每个标的是一个文件，parquet的每个标的是一个文件夹
+            name_list = [f for f in (files if suffix == '.csv' else dirs) if f.endswith(suffix)]
+            dirs[:] = [d for d in dirs if not d.endswith(suffix)]
+            symbol_list += [os.path.relpath(os.path.join(root, name), product_path)[:-len(suffix)]
+                            for name in name_list]
+        return sorted(symbol_list)
+
+    def read_columnar(self, product, symbol, path, signature, columns=None):
+        """
+        通过内存映射读取csv转换后的arrow文件，arrow文件不存在或者与csv不一致时重新转换
+        :param product: 产品ID
+        :param symbol: 标的名称
+        :param path: csv路径
+        :param signature: csv的文件签名
+        :param columns: 只读取指定的列，为空时读取所有列
+        :return:
+        """
+        arrow_path = os.path.join(self.columnar_path, product, symbol + '.arrow')
+        if os.path.exists(arrow_path):
+            try:
+                table = feather.read_table(arrow_path, columns=columns, memory_map=True)
+                if (table.schema.metadata or {}).get(b'signature', b'').decode() == signature:
+                    return table.to_pandas()
+            except (OSError, ValueError, KeyError):  # 文件损坏或者列不存在时重新转换
+                pass
+        df = self.api.read_file(path, product, downcast=True)
+        os.makedirs(os.path.dirname(arrow_path), exist_ok=True)
+        # 多个线程可能同时转换同一个标的，各自写临时文件再替换
+        tmp_path = f'{arrow_path}.{os.getpid()}_{threading.get_ident()}.tmp'
+        write_feather(df, tmp_path, metadata={'signature': signature})
+        os.replace(tmp_path, arrow_path)
+        return df[columns] if columns else df
+
+    def read_symbol(self, product, symbol, columns=None):
+        """
+        读取单个标的指定列的全部数据，优先使用内存缓存
+        :param product: 产品ID
+        :param symbol: 标的名称
+        :param columns: 只读取指定的列，为空时读取所有列
+        :return:
+        """
+        path = self.get_path(product, symbol)
+        signature = self.get_signature(path)
+        if signature is None:
+            return pd.DataFrame(columns=columns)
+        key = (product, symbol, tuple(columns) if columns else None)
+        with self.lock:
+            if key in self.cache_dict and self.cache_dict[key][0] == signature:
+                self.cache_dict.move_to_end(key)
+                self.stats['hit'] += 1
+                return self.cache_dict[key][1]
+            self.stats['miss'] += 1
+
+        if self.api.storage.suffix == '.csv':
+            df = self.read_columnar(product, symbol, path, signature, columns)
+        else:
+            df_list = [pq.read_table(part, columns=columns, memory_map=True).to_pandas()
+                       for part in ParquetStorage.get_part_list(path)]
+            df = pd.concat(align_float_dtypes(df_list), ignore_index=True) if len(df_list) > 1 else df_list[0]
+        self.put(key, signature, df)
+        return df
+
+    def put(self, key, signature, df):
+        """
+        放入内存缓存，超过上限时淘汰最久没有使用的数据
+        """
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.cache_bytes:
+            return
+        with self.lock:
+            if key in self.cache_dict:
+                self.cache_size -= self.cache_dict.pop(key)[2]
+            self.cache_dict[key] = (signature, df, size)
+            self.cache_size += size
+            while self.cache_size > self.cache_bytes:
+                _, (_, _, _size) = self.cache_dict.popitem(last=False)
+                self.cache_size -= _size
+                self.stats['evict'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.cache_dict.clear()
+            self.cache_size = 0
+
+    def load_symbol(self, product, symbol, start=None, end=None, columns=None):
+        """
+        读取单个标的在日期范围内的数据
+        :param product: 产品ID
+        :param symbol: 标的名称
+        :param start: 开始日期（包含），为空时不限制
+        :param end: 结束日期（包含），为空时不限制
+        :param columns: 只读取指定的列，为空时读取所有列
+        :return:
+        """
+        date_col = self.get_date_col(product)
+        if (start is not None or end is not None) and date_col is None:
+            raise ValueError(f'{product}没有日期列，不能按日期读取')
+        read_columns = columns
+        if columns and (start is not None or end is not None) and date_col not in columns:
+            read_columns = list(columns) + [date_col]
+        df = self.read_symbol(product, symbol, read_columns)
+        if df.empty or (start is None and end is None):
+            return df.copy()
+        condition = pd.Series(True, index=df.index)
+        if start is not None:
+            condition &= df[date_col] >= pd.to_datetime(start)
+        if end is not None:
+            condition &= df[date_col] <= pd.to_datetime(end)
+        df = df[condition]
+        return df[list(columns)].reset_index(drop=True) if columns else df.reset_index(drop=True)
+
+    def load_batch(self, product, symbols=None, start=None, end=None, columns=None, max_workers=4):
+        """
+        并发读取多个标的的数据
+        :param product: 产品ID
+        :param symbols: 标的名称列表，为空时读取产品下所有标的
+        :param start: 开始日期（包含），为空时不限制
+        :param end: 结束日期（包含），为空时不限制
+        :param columns: 只读取指定的列，为空时读取所有列
+        :param max_workers: 并发的线程数
+        :return: {标的名称: 数据}
+        """
+        symbol_list = self.symbols(product) if symbols is None else list(symbols)
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+            df_list = list(pool.map(lambda symbol: self.load_symbol(product, symbol, start, end, columns),
+                                    symbol_list))
+        return dict(zip(symbol_list, df_list))
+
+    def load(self, product, symbols=None, start=None, end=None, columns=None, max_workers=4):
+        """
+        读取一个或者多个标的在日期范围内的数据
+        :param product: 产品ID
+        :param symbols: 标的名称，为列表时返回所有标的合并后的数据，为空时读取产品下所有标的
+        :param start: 开始日期（包含），为空时不限制
+        :param end: 结束日期（包含），为空时不限制
+        :param columns: 只读取指定的列，为空时读取所有列
+        :param max_workers: 读取多个标的时并发的线程数
+        :return:
+        """
+        if isinstance(symbols, str):
+            return self.load_symbol(product, symbols, start, end, columns)
+        df_dict = self.load_batch(product, symbols, start, end, columns, max_workers)
+        df_list = [df for df in df_dict.values() if not df.empty]
+        if not df_list:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(align_float_dtypes(df_list), ignore_index=True)
+
+    def info(self):
+        with self.lock:
+            return {**self.stats, 'count': len(self.cache_dict), 'bytes': self.cache_size}
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# 格式中的列类型对应的arrow类型，解析时直接转换，不需要再推断
+arrow_type_dict = {
+    'float32': pa.float32(),
+    'float64': pa.float64(),
+    'int64': pa.int64(),
+    'bool': pa.bool_(),
+    'category': pa.dictionary(pa.int32(), pa.string()),
+    'datetime': pa.timestamp('ns'),
+}
+
+
+def can_downcast(value):
+    """
+    判断一组浮点数转换为float32后，能否按十进制还原为原来的float64（与align_float_dtypes的还原方式一致）
+    :param value: 不包含空值的float64数组
+    :return:
+    """
+    # 数值过大或过小时float32写出csv会变成科学计数法，与原来的格式不一致，也不使用
+    abs_value = np.abs(value[value != 0])
+    if len(abs_value) and (abs_value.min() < 1e-3 or abs_value.max() >= 1e5):
+        return False
+    # float32转换为字符串时保留最短的十进制表示，需要检查整列，抽样无法保证其他的值不丢失精度
+    return np.array_equal(value.astype('float32').astype(str).astype('float64'), value)
+
+
+def downcast_float(df, col_list):
+    """
+    把能够无损还原的float64列转换为float32，减少内存占用。每个文件单独检查，只用于查询，不用于合并写出
+    :param df: 数据
+    :param col_list: 格式中为float32的列
+    :return:
+    """
+    for col in col_list:
+        if col in df.columns and df[col].dtype == 'float64' and can_downcast(df[col].dropna().to_numpy()):
+            df[col] = df[col].astype('float32')
+    return df
+
+
+def infer_column_type(series, category_ratio=0.5):
+    """
+    根据已经解析的数据推断一列的类型
+    :param series: 一列数据
+    :param category_ratio: 不重复的值占比低于该值的字符串列使用category
+    :return: 格式中的列类型，无法确定时返回None，解析时交给解析器推断
+    """
+    dtype = series.dtype
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'bool'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'int64'
+    if pd.api.types.is_float_dtype(dtype):
+        value = series.dropna().to_numpy(dtype='float64')
+        if len(value) == 0:
+            return None
+        # float32只是查询时可以使用的类型，合并与写出时仍然按float64解析，见CsvStorage.read_schema
+        return 'float32' if can_downcast(value) else 'float64'
+    if isinstance(dtype, pd.CategoricalDtype):
+        return 'category'
+    if pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+        value = series.dropna()
+        if len(value) and pd.api.types.infer_dtype(value, skipna=True) == 'string' and \
+                value.nunique() <= len(value) * category_ratio:
+            return 'category'
+    return None
+
+
+class SchemaRegistry(object):
+    """
+    每个产品的数据格式：第一行是否为表头说明，所有的列名，以及每一列的类型。
+    第一次读取某个产品的数据时根据解析结果推断，保存在本地，之后按照格式一次解析，不需要再推断类型
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: 格式保存的文件夹，为空时只保存在内存中
+        """
+        self.path = path
+        self.schema_dict = {}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # 并行时会被复制到子进程，锁不能复制
+        state = self.__dict__.copy()
+        state['lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def get_path(self, product):
+        return os.path.join(self.path, f'{product}.json')
+
+    def get(self, product):
+        """
+        获取产品的数据格式
+        :param product: 产品ID
+        :return: 数据格式，没有时返回None
+        """
+        with self.lock:
+            if product in self.schema_dict:
+                return self.schema_dict[product]
+        if not self.path or not os.path.exists(self.get_path(product)):
+            return None
+        try:
+            with open(self.get_path(product), mode='r', encoding='utf8') as f:
+                schema = json.load(f)
+        except ValueError:  # 文件损坏时重新推断
+            return None
+        with self.lock:
+            self.schema_dict[product] = schema
+        return schema
+
+    def infer(self, product, df, skiprows, data_info=None):
+        """
+        根据已经解析的数据推断产品的数据格式并保存
+        :param product: 产品ID
+        :param df: 解析出来的数据
+        :param skiprows: 第一行是否为表头说明，是为1，否为0
+        :param data_info: 更新数据的配置，分组列与去重列保持为字符串，日期列解析为日期
+        :return:
+        """
+        data_info = data_info or {}
+        key_col_list = [data_info.get('group')] + list(data_info.get('duplicate_removal_column') or [])
+        column_dict = {}
+        for col in df.columns:
+            if col in (data_info.get('parse_dates') or []):
+                column_dict[col] = 'datetime'
+                continue
+            col_type = infer_column_type(df[col])
+            if col_type == 'category' and col in key_col_list:
+                continue
+            if col_type:
+                column_dict[col] = col_type
+        # names为所有的列名，解析时用于检查表头是否与格式一致
+        schema = {'skiprows': skiprows, 'names': list(df.columns), 'columns': column_dict}
+        with self.lock:
+            self.schema_dict[product] = schema
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+            # 多个进程可能同时推断同一个产品，各自写临时文件再替换
+            tmp_path = f'{self.get_path(product)}.{os.getpid()}_{threading.get_ident()}.tmp'
+            with open(tmp_path, mode='w', encoding='utf8') as f:
+                json.dump(schema, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.get_path(product))
+        return schema
+
+    def remove(self, product):
+        """
+        删除产品的数据格式，数据格式发生变化时，下次读取重新推断
+        :param product: 产品ID
+        :return:
+        """
+        with self.lock:
+            self.schema_dict.pop(product, None)
+        if self.path and os.path.exists(self.get_path(product)):
+            os.remove(self.get_path(product))
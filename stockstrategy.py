@@ -1,5 +1,8 @@
 # encoding:utf-8
 
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
@@ -7,10 +10,15 @@ from plugins.StockStrategy.common import *
 from common.log import logger
 from plugins.StockStrategy.config import *
 from plugins import *
-from plugins.StockStrategy.BaseDataApi import BaseDataApi
+from plugins.StockStrategy.BaseDataApi import get_base_data_api
 
-base_data_api = BaseDataApi(api_key=api_key, hid=hid, all_data_path=all_data_path,
-                            strategy_result_path=strategy_result_path)
+# 整个进程共用一个BaseDataApi，实例化时不请求网络，更新数据的配置在第一次使用时获取
+base_data_api = get_base_data_api(api_key=api_key, hid=hid, all_data_path=all_data_path,
+                                  strategy_result_path=strategy_result_path, storage_type=storage_type,
+                                  host_concurrency=host_concurrency, http_timeout=http_timeout,
+                                  strategy_publish_time=strategy_publish_time,
+                                  panel_fields_dict=panel_fields_dict, local_strategy_dict=local_strategy_dict,
+                                  local_strategy_fallback=local_strategy_fallback)
 
 @plugins.register(
     name="StockStrategy",
@@ -24,60 +32,18 @@ class StockStrategy(Plugin):
     def __init__(self):
         super().__init__()
         self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
-        self.base_data_api = BaseDataApi(api_key=api_key, hid=hid, all_data_path=all_data_path,
-                                         strategy_result_path=strategy_result_path)
+        self.base_data_api = base_data_api
+        # 策略查询在线程池中进行，不阻塞消息处理
+        self.executor = ThreadPoolExecutor(max_workers=handler_workers, thread_name_prefix='stock_strategy')
+        self.pending_dict = {}  # 进行中的查询，相同的查询共用一个future
+        self.chat_count_dict = {}  # 每个会话进行中的查询数量
+        self.lock = threading.Lock()
         logger.info("[stock_strategy] inited")
 
     def on_handle_context(self, e_context: EventContext):
         if e_context["context"].type != ContextType.TEXT:
             return
 
-        strategy_name_dict = {
-            '低价小市值': 'low-price-small-market-value',
-            '量价相关性': 'price-volume-corr-stock',
-            '小市值': 'small-market-value',
-            '伽利略': 'galileo',
-            '财务基本面小市值': 'small-market-value-and-fin',
-            '反过度自信': 'anti-over-confidence-stock',
-            '费迪南w': 'Ferdinand-WangYang',
-            '费迪南x': 'Ferdinand-XiaoXiaoZhi',
-            '低价股': 'low-price-stock',
-            # '星边系选股001': 'xbx-s-001',
-            '费迪南': 'Ferdinand',
-            '费迪南Q': 'Ferdinand-QuanQiuRen',
-            '中证1000小市值': 'small-market-value-limit',
-            '费迪南成长': 'Ferdinand-growth',
-            '哥白尼': 'copernicus',
-            '流动性溢价': 'unliquidity',
-            '北上七侠': 'seven-knights',
-            '低估值高分红': 'low-valuation-high-dividend',
-            '笛卡尔': 'descartes',
-            '皮尔逊': 'pearson',
-            '低估值': 'low-valuation',
-            '缩量': 'low-volume-stock',
-            '创造191': 'rocket-quants-191',
-            '筹码分布': 'chip-distribution',
-            '小市值基本面过滤': 'small-market-value-filter',
-            '量价小市值': 'small-market-value-price-volume-corr',
-            '科技三杰': 'three-musketeers-new',
-            '资金流': 'money-flow',
-            '散户反买': 'retail-investors',
-            '萨拉丁': 'Saladin',
-            '筹码集中度': 'chip-concentration',
-            '拿破仑': 'Napoleon-pro',
-            '俾斯麦': 'Bismarck',
-            '北上高频': 'event-nf-flow',
-            '北上七侠事件': 'seven-knights-event',
-            '资金流z': 'money-flow-zhen',
-            '资金流t': 'money-flow-TianXingZhe',
-            '资金流q': 'money-flow-QiGuai',
-            '萨拉丁d': 'DingGuoQing',
-            '萨拉丁h': 'HuangJinMieMieYang',
-            '萨拉丁l': 'lzhh',
-            '香农': 'shannon'
-        }
-
-
         content = e_context["context"].content
         logger.debug("[stock_strategy] on_handle_context. content: %s" % content)
         clist = content.split(maxsplit=3)  # 分割为4个部分: $A, 策略名, 持仓周期, 选股数量
@@ -95,12 +61,14 @@ class StockStrategy(Plugin):
                     e_context["reply"] = reply
                     e_context.action = EventAction.BREAK_PASS  # 事件结束，并跳过处理context的默认逻辑
                     return  # 退出函数，不再继续处理
-                strategy_result = self.base_data_api.get_strategy_result(strategy_name, period, select_count)
-                print(strategy_result)
-                if isinstance(strategy_result, dict) and strategy_result.get('code') == 200:
-                    message = self.format_result(strategy_result)
+                if async_reply and e_context.econtext.get("channel") is not None:
+                    message = self.submit_query(e_context, strategy_name, period, select_count)
+                    if message is None:  # 查询已提交，结果返回后再回复
+                        e_context.action = EventAction.BREAK_PASS
+                        return
                 else:
-                    message = strategy_result  # 直接将 strategy_result 赋值给 message
+                    strategy_result = self.base_data_api.get_strategy_result(strategy_name, period, select_count)
+                    message = self.get_message(strategy_result)
             else:
                 message = "格式错误，请输入 $A 策略名 持仓周期 选股数量"
         else:
@@ -112,6 +80,67 @@ class StockStrategy(Plugin):
         e_context["reply"] = reply
         e_context.action = EventAction.BREAK_PASS  # 事件结束，并跳过处理context的默认逻辑
 
+    def get_message(self, strategy_result):
+        print(strategy_result)
+        if isinstance(strategy_result, dict) and strategy_result.get('code') == 200:
+            return self.format_result(strategy_result)
+        elif strategy_result is None:
+            return "获取策略结果失败，请稍后再试"
+        return strategy_result  # 直接将 strategy_result 作为消息
+
+    def submit_query(self, e_context, strategy_name, period, select_count):
+        """
+        把策略查询提交到线程池，结果返回后通过channel回复
+        :return: 无法提交时返回需要直接回复的消息，提交成功返回None
+        """
+        context = e_context["context"]
+        channel = e_context["channel"]
+        session_id = context.get("session_id")
+        key = (strategy_name, period, select_count)
+        with self.lock:
+            # 限制每个会话同时进行的查询数量
+            if self.chat_count_dict.get(session_id, 0) >= chat_concurrency:
+                return "查询过多，请等待之前的结果返回后再试"
+            self.chat_count_dict[session_id] = self.chat_count_dict.get(session_id, 0) + 1
+            # 相同的查询正在进行时，直接等待其结果
+            future = self.pending_dict.get(key)
+            is_new = future is None
+            if is_new:
+                future = self.executor.submit(self.base_data_api.get_strategy_result, strategy_name, period,
+                                              select_count)
+                self.pending_dict[key] = future
+        # 回调在锁外注册：查询已经完成时（例如命中缓存），回调会在当前线程中立即执行，回调中需要再次获取锁
+        if is_new:
+            future.add_done_callback(lambda f: self.pop_pending(key, f))
+        future.add_done_callback(lambda f: self.send_result(f, channel, context, session_id))
+        return None
+
+    def pop_pending(self, key, future):
+        with self.lock:
+            if self.pending_dict.get(key) is future:
+                del self.pending_dict[key]
+
+    def send_result(self, future, channel, context, session_id):
+        """
+        查询完成后回复结果，并释放会话的查询名额
+        """
+        with self.lock:
+            self.chat_count_dict[session_id] -= 1
+            if self.chat_count_dict[session_id] <= 0:
+                del self.chat_count_dict[session_id]
+        try:
+            message = self.get_message(future.result())
+        except Exception as e:
+            logger.exception("[stock_strategy] get strategy result failed: %s" % e)
+            message = "获取策略结果失败，请稍后再试"
+        reply = Reply()
+        reply.type = ReplyType.TEXT
+        reply.content = message
+        try:
+            channel.send(reply, context)
+        except Exception as e:
+            logger.exception("[stock_strategy] send reply failed: %s" % e)
+
     def format_result(self, result):
         # 格式化结果为易读的格式
         message = f"选股时间: {result['select_time']}\n"
@@ -0,0 +1,369 @@
+import csv
+import io
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from plugins.StockStrategy.schema import arrow_type_dict, downcast_float
+
+# 与官方数据保持一致的表头说明，csv第一行
+csv_header_info = '数据由邢不行整理，对数据字段有疑问的，可以直接微信私信邢不行，微信号：xbx297'
+
+
+class CsvStorage(object):
+    """
+    gbk编码的csv存储，文件格式与官方下载的数据保持一致（第一行为说明，第二行为列名）
+    """
+    suffix = '.csv'
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def read(self, path, parse_dates=None, columns=None):
+        """
+        读取数据
+        :param path: 文件路径，也可以是内存中的文件对象
+        :param parse_dates: 需要解析为日期的列
+        :param columns: 只读取指定的列，为空时读取所有列
+        :return:
+        """
+        try:
+            df = pd.read_csv(path, encoding='gbk', skiprows=1, parse_dates=parse_dates, usecols=columns)
+        except:
+            if hasattr(path, 'seek'):  # 从内存中读取时，需要回到开头重新读取
+                path.seek(0)
+            df = pd.read_csv(path, encoding='gbk', parse_dates=parse_dates, usecols=columns)
+        return df
+
+    def read_schema(self, path, schema, parse_dates=None, columns=None, downcast=False):
+        """
+        按照数据格式一次解析，表头的行数与每一列的类型都已经确定，不需要推断。
+        文件的表头与格式不一致时抛出ValueError，由调用方按原来的方式解析并重新推断格式
+        :param path: 文件路径，也可以是内存中的文件对象
+        :param schema: 数据格式
+        :param parse_dates: 需要解析为日期的列，必须存在
+        :param columns: 只读取指定的列，为空时读取所有列
+        :param downcast: 是否把能够无损还原的列转换为float32，只用于查询，合并与写出时保持float64
+        :return:
+        """
+        # 每个文件都重新判断第一行是否为表头说明，不一致时跳过的行数不对，会把第一行数据当成列名
+        skiprows = self.get_skiprows(path)
+        if skiprows != schema['skiprows']:
+            raise ValueError(f'表头说明的行数为{skiprows}，与数据格式中的{schema["skiprows"]}不一致')
+        # 格式中的float32先按float64解析，是否转换为float32按照每个文件的数据单独判断
+        column_types = {col: arrow_type_dict['float64' if col_type == 'float32' else col_type]
+                        for col, col_type in schema['columns'].items()}
+        table = pa_csv.read_csv(
+            path,
+            read_options=pa_csv.ReadOptions(skip_rows=skiprows, encoding='gbk'),
+            convert_options=pa_csv.ConvertOptions(column_types=column_types, include_columns=columns,
+                                                  strings_can_be_null=True))
+        name_list = list(columns) if columns else schema['names']
+        if table.column_names != name_list:
+            raise ValueError(f'列名{table.column_names}与数据格式中的{name_list}不一致')
+        missing_list = [col for col in parse_dates or [] if (not columns or col in columns) and
+                        schema['columns'].get(col) != 'datetime']
+        if missing_list:
+            raise ValueError(f'数据格式中没有日期列{missing_list}')
+        df = table.to_pandas()
+        if downcast:
+            df = downcast_float(df, [col for col, col_type in schema['columns'].items() if col_type == 'float32'])
+        return df
+
+    def get_skiprows(self, path):
+        """
+        判断第一行是否为表头说明
+        :param path: 文件路径，也可以是内存中的文件对象
+        :return: 是为1，否为0
+        """
+        if hasattr(path, 'seek'):
+            line = path.readline()
+            path.seek(0)
+        else:
+            with open(path, 'rb') as f:
+                line = f.readline()
+        return 1 if self.is_header_info(line.decode('gbk', errors='ignore')) else 0
+
+    def read_chunks(self, path, chunk_size, parse_dates=None, columns=None):
+        """
+        分块读取数据，每次最多读取chunk_size行，内存占用与文件大小无关
+        :param path: 文件路径
+        :param chunk_size: 每块的行数
+        :param parse_dates: 需要解析为日期的列
+        :param columns: 只读取指定的列，为空时读取所有列
+        :return:
+        """
+        with pd.read_csv(path, encoding='gbk', skiprows=self.get_skiprows(path), parse_dates=parse_dates, usecols=columns,
+                         chunksize=chunk_size) as reader:
+            for chunk in reader:
+                yield chunk
+
+    @staticmethod
+    def is_header_info(line):
+        """
+        判断csv的某一行是否为官方格式的表头说明，说明行只有第一个字段有内容
+        :param line: 解码后的一行数据
+        :return:
+        """
+        fields = next(csv.reader([line]), [])
+        return line.startswith(csv_header_info) or (len(fields) > 1 and not any(fields[1:]))
+
+    def read_tail(self, path, parse_dates=None, n=1, block_size=64 * 1024):
+        """
+        读取文件末尾的n行数据，只读取文件开头的表头和末尾的若干字节，不解析整个文件
+        :param path: 文件路径
+        :param parse_dates: 需要解析为日期的列
+        :param n: 读取的行数
+        :param block_size: 每次从末尾向前读取的字节数
+        :return:
+        """
+        with open(path, 'rb') as f:
+            # 前两行中，非表头说明的那一行就是列名
+            head_line_list = [f.readline(), f.readline()]
+            data_start = len(head_line_list[0])
+            header = head_line_list[0]
+            if self.is_header_info(head_line_list[0].decode('gbk')):
+                data_start += len(head_line_list[1])
+                header = head_line_list[1]
+            # 从文件末尾向前读取，直到读取到足够的行数
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            start = end
+            tail = b''
+            while start > data_start and tail.count(b'\n') <= n:
+                start = max(start - block_size, data_start)
+                f.seek(start)
+                tail = f.read(end - start)
+        line_list = [line for line in tail.split(b'\n') if line.strip()]
+        if start > data_start:  # 第一行可能是不完整的行
+            line_list = line_list[1:]
+        text = (header + b'\n'.join(line_list[-n:] if n else [])).decode('gbk')
+        return pd.read_csv(io.StringIO(text), parse_dates=parse_dates)
+
+    def write(self, path, df):
+        """
+        全量写出数据，带上官方格式的两行表头。先写到临时文件再替换，中途中断时原有的数据不受影响
+        :param path: 文件路径
+        :param df: 需要写出的数据
+        :return:
+        """
+        df = df.copy()
+        df.columns = pd.MultiIndex.from_tuples(zip([csv_header_info] + [''] * (df.shape[1] - 1), df.columns))
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        df.to_csv(tmp_path, index=False, encoding='gbk')
+        os.replace(tmp_path, path)
+
+    def append(self, path, df):
+        """
+        在文件末尾追加数据，追加的数据列顺序需要与文件保持一致
+        :param path: 文件路径
+        :param df: 需要追加的数据
+        :return:
+        """
+        if not self.exists(path):
+            self.write(path, df)
+            return
+        # 文件末尾没有换行符时先补上，避免追加的数据接在最后一行后面
+        with open(path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(os.linesep.encode())
+        # 先在内存中生成追加的内容，再一次写入，中断时文件末尾最多只有不完整的一段，可以按原来的大小截断
+        content = df.to_csv(index=False, header=False).encode('gbk')
+        with open(path, 'ab') as f:
+            f.write(content)
+
+    def export_csv(self, path, to_path):
+        """
+        导出为官方格式的csv，本身就是csv，直接复制
+        :param path: 文件路径
+        :param to_path: 导出路径
+        :return:
+        """
+        shutil.copy(path, to_path)
+
+
+class ParquetStorage(CsvStorage):
+    """
+    分片的parquet列式存储，每个标的一个文件夹，文件夹下为按顺序编号的分片文件。
+    追加数据时只写出新的分片，读取时可以只读取指定的列，且保留每一列的数据类型。
+    """
+    suffix = '.parquet'
+    max_part_count = 64  # 分片数量超过该值时合并成一个分片，避免小文件过多
+
+    @staticmethod
+    def get_part_list(path):
+        """
+        获取文件夹下所有的分片，按照写入顺序排序
+        :param path: 文件夹路径
+        :return:
+        """
+        if not os.path.isdir(path):
+            return []
+        return sorted(os.path.join(path, f) for f in os.listdir(path) if f.startswith('part-') and f.endswith('.parquet'))
+
+    @staticmethod
+    def write_part(df, part_path):
+        """
+        写出单个分片
+        :param df:
+        :param part_path:
+        :return:
+        """
+        df = df.reset_index(drop=True)
+        try:
+            df.to_parquet(part_path, index=False)
+        except (TypeError, ValueError):
+            to_arrow_compatible(df).to_parquet(part_path, index=False)
+
+    def read(self, path, parse_dates=None, columns=None):
+        part_list = self.get_part_list(path)
+        if not part_list:
+            return pd.DataFrame()
+        df_list = [pd.read_parquet(part, columns=columns) for part in part_list]
+        return pd.concat(align_float_dtypes(df_list), ignore_index=True) if len(df_list) > 1 else df_list[0]
+
+    def read_chunks(self, path, chunk_size, parse_dates=None, columns=None):
+        # 每个分片作为一块
+        for part in self.get_part_list(path):
+            yield pd.read_parquet(part, columns=columns)
+
+    def read_tail(self, path, parse_dates=None, n=1, block_size=None):
+        # 数据按顺序写入分片，只需要读取最后一个分片
+        part_list = self.get_part_list(path)
+        if not part_list:
+            return pd.DataFrame()
+        return pd.read_parquet(part_list[-1]).tail(n).reset_index(drop=True)
+
+    @staticmethod
+    def recover(path):
+        """
+        上次替换数据时中断，原有的数据还在备份文件夹中，恢复回来
+        :param path: 文件夹路径
+        :return:
+        """
+        old_path = path + '.old'
+        if os.path.exists(old_path):
+            if os.path.exists(path):
+                shutil.rmtree(old_path)
+            else:
+                os.rename(old_path, path)
+
+    def exists(self, path):
+        self.recover(path)
+        return len(self.get_part_list(path)) > 0
+
+    def write(self, path, df):
+        # 先写到临时文件夹，原有的数据先改名为备份，再把临时文件夹改名，任何时候中断都不会丢失数据
+        self.recover(path)
+        tmp_path = path + '.tmp'
+        old_path = path + '.old'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        self.write_part(df, os.path.join(tmp_path, 'part-%05d.parquet' % 0))
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+
+    def append(self, path, df):
+        part_list = self.get_part_list(path)
+        if not part_list:
+            self.write(path, df)
+            return
+        # 分片过多时，把所有分片合并成一个
+        if len(part_list) >= self.max_part_count:
+            self.write(path, pd.concat([self.read(path), df], ignore_index=True))
+            return
+        part_index = int(os.path.basename(part_list[-1])[5:-8]) + 1
+        # 新分片中float32的列，在之前的分片中为float64时，转换为float64，保证读取时各分片的类型一致
+        float64_list = [field.name for field in pq.read_schema(part_list[-1]) if str(field.type) == 'double']
+        df = align_float_dtypes([df], float64_list)[0]
+        # 分片先写成临时文件再改名，读取时不会读到写了一半的分片
+        part_path = os.path.join(path, 'part-%05d.parquet' % part_index)
+        self.write_part(df, part_path + '.tmp')
+        os.replace(part_path + '.tmp', part_path)
+
+    def export_csv(self, path, to_path):
+        CsvStorage().write(to_path, self.read(path))
+
+
+def align_float_dtypes(df_list, float64_list=None):
+    """
+    同一列在部分数据中为float32、部分为float64时，把float32按十进制转换为float64。
+    直接转换会带上float32的精度误差，例如28.09会变成28.090000152587890
+    :param df_list: 需要合并的数据
+    :param float64_list: 额外指定需要转换为float64的列
+    :return:
+    """
+    float64_set = set(float64_list or [])
+    for df in df_list:
+        float64_set |= set(df.columns[df.dtypes == 'float64'])
+    result_list = []
+    for df in df_list:
+        col_list = [col for col in df.columns[df.dtypes == 'float32'] if col in float64_set]
+        if col_list:
+            df = df.copy()
+            for col in col_list:
+                # float32转换为字符串时保留最短的十进制表示
+                df[col] = df[col].astype(str).astype('float64')
+        result_list.append(df)
+    return result_list
+
+
+def to_arrow_compatible(df):
+    """
+    object列中混合了不同类型的数据时，arrow无法写出，统一转成字符串
+    :param df:
+    :return:
+    """
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def write_feather(df, path, metadata=None):
+    """
+    写出不压缩的arrow文件，读取时可以直接内存映射
+    :param df:
+    :param path:
+    :param metadata: 写入文件的附加信息，{str: str}
+    :return:
+    """
+    df = df.reset_index(drop=True)
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (TypeError, ValueError):
+        table = pa.Table.from_pandas(to_arrow_compatible(df), preserve_index=False)
+    if metadata:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+    feather.write_feather(table, path, compression='uncompressed')
+
+
+# 支持的存储格式
+storage_dict = {
+    'csv': CsvStorage,
+    'parquet': ParquetStorage,
+}
+
+
+def get_storage(storage_type):
+    """
+    根据存储格式获取存储对象
+    :param storage_type: 存储格式，csv或者parquet
+    :return:
+    """
+    storage_type = storage_type.lstrip('.')
+    if storage_type not in storage_dict:
+        raise ValueError(f'不支持的存储格式：{storage_type}，可选：{list(storage_dict.keys())}')
+    return storage_dict[storage_type]()
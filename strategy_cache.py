@@ -0,0 +1,125 @@
+import datetime
+import json
+import os
+import threading
+from concurrent.futures import Future
+
+
+class StrategyCache(object):
+    """
+    策略结果缓存，策略结果每个交易日最多更新一次，缓存在下一次策略结果发布时过期。
+    内存中保存一份，可选在硬盘上再保存一份，重启之后依然有效；同时发起的相同请求只会请求一次。
+    """
+
+    def __init__(self, cache_path=None, publish_time='17:00'):
+        """
+        :param cache_path: 硬盘缓存的路径，为空时只缓存在内存中
+        :param publish_time: 每个交易日策略结果的发布时间
+        """
+        self.cache_path = cache_path
+        self.publish_time = datetime.datetime.strptime(publish_time, '%H:%M').time()
+        self.memory_dict = {}  # 内存缓存，key: (过期时间, 结果)
+        self.pending_dict = {}  # 正在请求中的key
+        self.lock = threading.Lock()
+        self.stats = {'hit': 0, 'disk_hit': 0, 'miss': 0, 'coalesced': 0}
+
+    def get_expire_time(self, now=None):
+        """
+        获取下一次策略结果的发布时间，周一至周五视为交易日
+        :param now: 当前时间
+        :return:
+        """
+        now = now or datetime.datetime.now()
+        expire_time = datetime.datetime.combine(now.date(), self.publish_time)
+        if expire_time <= now:
+            expire_time += datetime.timedelta(days=1)
+        while expire_time.weekday() >= 5:  # 跳过周末
+            expire_time += datetime.timedelta(days=1)
+        return expire_time
+
+    def get_disk_path(self, key):
+        return os.path.join(self.cache_path, '_'.join(str(i) for i in key).replace('-', '_') + '.json')
+
+    def read(self, key):
+        """
+        读取未过期的缓存，先读内存，再读硬盘
+        :param key:
+        :return: 缓存的结果，没有缓存或者已经过期时返回None
+        """
+        now = datetime.datetime.now()
+        with self.lock:
+            if key in self.memory_dict:
+                expire_time, value = self.memory_dict[key]
+                if now < expire_time:
+                    self.stats['hit'] += 1
+                    return value
+                del self.memory_dict[key]
+        if not self.cache_path or not os.path.exists(self.get_disk_path(key)):
+            return None
+        try:
+            with open(self.get_disk_path(key), mode='r', encoding='utf8') as f:
+                disk_cache = json.load(f)
+            expire_time = datetime.datetime.fromtimestamp(disk_cache['expire_time'])
+        except (ValueError, KeyError):  # 缓存文件损坏时当作没有缓存
+            return None
+        if now >= expire_time:
+            return None
+        with self.lock:
+            self.memory_dict[key] = (expire_time, disk_cache['result'])
+            self.stats['disk_hit'] += 1
+        return disk_cache['result']
+
+    def write(self, key, value):
+        """
+        写入缓存，在下一次策略结果发布时过期
+        :param key:
+        :param value:
+        :return:
+        """
+        expire_time = self.get_expire_time()
+        with self.lock:
+            self.memory_dict[key] = (expire_time, value)
+        if self.cache_path:
+            os.makedirs(self.cache_path, exist_ok=True)
+            with open(self.get_disk_path(key), mode='w', encoding='utf8') as f:
+                json.dump({'expire_time': expire_time.timestamp(), 'result': value}, f, ensure_ascii=False)
+
+    def get(self, key, loader, cacheable=None):
+        """
+        获取缓存的结果，没有缓存时调用loader获取，同时发起的相同请求共用一次loader的结果
+        :param key: 缓存的key
+        :param loader: 获取结果的函数
+        :param cacheable: 判断结果是否需要缓存的函数，为空时缓存所有结果
+        :return:
+        """
+        value = self.read(key)
+        if value is not None:
+            return value
+
+        with self.lock:
+            future = self.pending_dict.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self.pending_dict[key] = Future()
+                self.stats['miss'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        if not is_leader:  # 已经有相同的请求在进行中，等待其结果
+            return future.result()
+
+        try:
+            value = loader()
+            if value is not None and (cacheable is None or cacheable(value)):
+                self.write(key, value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.pending_dict[key]
+
+    def clear(self):
+        with self.lock:
+            self.memory_dict.clear()
@@ -0,0 +1,212 @@
+import os
+import re
+import sqlite3
+import threading
+
+import pandas as pd
+
+# 选股策略的持仓周期对应的文件名
+period_dict = {
+    '周': 'week',
+    '月': 'month',
+    '自然月': 'natural_month'
+}
+
+
+def get_period_type(period):
+    """
+    把持仓周期转换成保存时使用的名称，事件策略的'x天'转换为'x'
+    :param period: 持仓周期
+    :return:
+    """
+    period = str(period)
+    if '天' in period:
+        return period.replace('天', '')
+    return period_dict.get(period, period)
+
+
+# 原有策略结果csv的文件名：策略名称_持仓周期_选股数量.csv，持仓周期本身可能包含'_'（natural_month），需要明确列出
+csv_name_pattern = re.compile(r'^(.+?)_(%s|\d+)_(\d+)\.csv$' % '|'.join(
+    sorted(period_dict.values(), key=len, reverse=True)))
+
+
+class StrategyStore(object):
+    """
+    策略结果的历史记录，保存在sqlite中，以（策略，周期，选股数量，交易日期，股票代码）为主键
+    """
+
+    def __init__(self, db_path, csv_path=None):
+        """
+        :param db_path: sqlite数据库的路径
+        :param csv_path: 原有的策略结果csv所在的文件夹，第一次创建数据库时会一次性导入
+        """
+        self.db_path = db_path
+        self.csv_path = csv_path
+        self.conn = None
+        self.lock = threading.RLock()
+
+    def get_connection(self):
+        """
+        第一次使用时再连接数据库，数据库不存在时创建表并导入原有的csv
+        :return:
+        """
+        if self.conn is not None:
+            return self.conn
+        is_new = not os.path.exists(self.db_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS strategy_result (
+                strategy TEXT NOT NULL,
+                period TEXT NOT NULL,
+                select_count INTEGER NOT NULL,
+                trade_date TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                name TEXT,
+                rank INTEGER,
+                PRIMARY KEY (strategy, period, select_count, trade_date, symbol)
+            )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_symbol_date ON strategy_result (symbol, trade_date)')
+        conn.commit()
+        self.conn = conn
+        if is_new and self.csv_path and os.path.exists(self.csv_path):
+            self.import_csv_dir(self.csv_path)
+        return conn
+
+    def upsert(self, df):
+        """
+        写入策略结果，主键相同的记录更新股票名称与排名
+        :param df: 包含strategy、period、select_count、trade_date、symbol、name、rank列的数据
+        :return:
+        """
+        if df.empty:
+            return
+        row_list = list(df[['strategy', 'period', 'select_count', 'trade_date', 'symbol', 'name', 'rank']]
+                        .astype(object).itertuples(index=False, name=None))
+        with self.lock:
+            conn = self.get_connection()
+            with conn:
+                conn.executemany('''
+                    INSERT INTO strategy_result (strategy, period, select_count, trade_date, symbol, name, rank)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (strategy, period, select_count, trade_date, symbol)
+                    DO UPDATE SET name = excluded.name, rank = excluded.rank''', row_list)
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return pd.read_sql_query(sql, self.get_connection(), params=params)
+
+    def last_selections(self, strategy, n=1, period=None, select_count=None):
+        """
+        获取策略最近n次的选股结果
+        :param strategy: 策略名称
+        :param n: 最近的次数
+        :param period: 持仓周期，为空时不限制
+        :param select_count: 选股数量，为空时不限制
+        :return:
+        """
+        condition = 'strategy = ?'
+        params = [strategy]
+        if period is not None:
+            condition += ' AND period = ?'
+            params.append(get_period_type(period))
+        if select_count is not None:
+            condition += ' AND select_count = ?'
+            params.append(int(select_count))
+        sql = f'''
+            SELECT * FROM strategy_result
+            WHERE {condition} AND trade_date IN (
+                SELECT DISTINCT trade_date FROM strategy_result WHERE {condition} ORDER BY trade_date DESC LIMIT ?)
+            ORDER BY trade_date, period, select_count, rank, symbol'''
+        return self.query(sql, params + params + [n])
+
+    def strategies_by_symbol(self, symbol, trade_date=None):
+        """
+        获取选中某只股票的所有策略
+        :param symbol: 股票代码
+        :param trade_date: 交易日期，为空时返回所有日期
+        :return:
+        """
+        if trade_date is None:
+            return self.query('SELECT * FROM strategy_result WHERE symbol = ? ORDER BY trade_date, strategy',
+                              [symbol])
+        return self.query('SELECT * FROM strategy_result WHERE symbol = ? AND trade_date = ? ORDER BY strategy',
+                          [symbol, str(pd.to_datetime(trade_date).date())])
+
+    def history(self, strategy=None, period=None, select_count=None):
+        """
+        获取策略的全部历史选股结果
+        :param strategy: 策略名称，为空时返回所有策略
+        :param period: 持仓周期，为空时不限制
+        :param select_count: 选股数量，为空时不限制
+        :return:
+        """
+        condition_list = []
+        params = []
+        for col, value in [('strategy', strategy), ('period', period), ('select_count', select_count)]:
+            if value is not None:
+                condition_list.append(f'{col} = ?')
+                params.append(get_period_type(value) if col == 'period' else value)
+        where = ('WHERE ' + ' AND '.join(condition_list)) if condition_list else ''
+        return self.query(f'SELECT * FROM strategy_result {where} ORDER BY strategy, period, select_count, trade_date, '
+                          f'rank, symbol', params)
+
+    def import_csv(self, file_path, strategy, period, select_count):
+        """
+        导入原有格式的策略结果csv
+        :param file_path: csv路径
+        :param strategy: 策略名称
+        :param period: 持仓周期
+        :param select_count: 选股数量
+        :return:
+        """
+        df = pd.read_csv(file_path, encoding='gbk')
+        df = df.rename(columns={'交易日期': 'trade_date', '股票代码': 'symbol', '股票名称': 'name', '选股排名': 'rank'})
+        # 原有csv中相同的记录保留第一条
+        df = df.drop_duplicates(subset=['trade_date', 'symbol'], keep='first')
+        df['trade_date'] = pd.to_datetime(df['trade_date']).dt.strftime('%Y-%m-%d')
+        df['strategy'] = strategy
+        df['period'] = get_period_type(period)
+        df['select_count'] = int(select_count)
+        self.upsert(df)
+        return df.shape[0]
+
+    def import_csv_dir(self, path):
+        """
+        导入文件夹下所有原有格式的策略结果csv，文件名为：策略名称_持仓周期_选股数量.csv
+        :param path: 文件夹路径
+        :return: 导入的行数
+        """
+        count = 0
+        for file_name in sorted(os.listdir(path)):
+            match = csv_name_pattern.match(file_name)
+            if not match:
+                continue
+            strategy, period, select_count = match.groups()
+            # 保存csv时策略名称中的'-'被替换成了'_'，还原回来
+            count += self.import_csv(os.path.join(path, file_name), strategy.replace('_', '-'), period, select_count)
+        return count
+
+    def export_csv(self, strategy, period, select_count, to_path):
+        """
+        导出为原有格式的策略结果csv
+        :param strategy: 策略名称
+        :param period: 持仓周期
+        :param select_count: 选股数量
+        :param to_path: 导出的文件夹
+        :return: 导出的文件路径
+        """
+        df = self.history(strategy, period, int(select_count))
+        df = df.rename(columns={'trade_date': '交易日期', 'symbol': '股票代码', 'name': '股票名称', 'rank': '选股排名'})
+        os.makedirs(to_path, exist_ok=True)
+        to_file_path = os.path.join(
+            to_path, f'{strategy.replace("-", "_")}_{get_period_type(period)}_{int(select_count)}.csv')
+        df[['交易日期', '股票代码', '股票名称', '选股排名']].to_csv(to_file_path, encoding='gbk', index=False)
+        return to_file_path
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
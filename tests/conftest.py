@@ -0,0 +1,66 @@
+"""
+测试时不需要chatgpt-on-wechat：在临时文件夹下建立plugins/StockStrategy，链接到本项目的源码，
+插件以plugins.StockStrategy的名称导入，日志、数据格式、任务数据库等写入root_path/data的文件都在临时文件夹中
+"""
+import copy
+import os
+import sys
+import tempfile
+
+import pandas as pd
+import pytest
+
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+test_root_path = tempfile.mkdtemp(prefix='stock_strategy_test_')
+plugin_path = os.path.join(test_root_path, 'plugins', 'StockStrategy')
+os.makedirs(os.path.join(plugin_path, 'data', 'log'))
+for name in os.listdir(project_path):
+    # 不链接__init__.py，避免导入依赖chatgpt-on-wechat的stockstrategy.py
+    if (name.endswith('.py') and name != '__init__.py') or name == 'rocket_plan.json':
+        os.symlink(os.path.join(project_path, name), os.path.join(plugin_path, name))
+sys.path.insert(0, test_root_path)
+
+from plugins.StockStrategy import common  # noqa: E402
+from plugins.StockStrategy.BaseDataApi import BaseDataApi  # noqa: E402
+from plugins.StockStrategy.benchmark import bench_data_info, generate_history  # noqa: E402
+from plugins.StockStrategy.job_store import JobStore  # noqa: E402
+from plugins.StockStrategy.schema import SchemaRegistry  # noqa: E402
+
+# 机器人消息写入文件，不发送
+common.notifier.sink = os.path.join(test_root_path, 'notify.log')
+
+
+@pytest.fixture
+def make_api(tmp_path):
+    """
+    生成使用临时文件夹的BaseDataApi，更新数据的配置使用性能测试的配置，不请求接口
+    """
+
+    def make(storage_type='csv', url=None):
+        api = BaseDataApi(hid='test', api_key='test', all_data_path=str(tmp_path / 'data'),
+                          strategy_result_path=str(tmp_path / 'strategy'), storage_type=storage_type,
+                          strategy_disk_cache=False, metrics_path=None)
+        api.up_data_info = copy.deepcopy(bench_data_info)
+        api.schema_registry = SchemaRegistry(str(tmp_path / 'schema'))
+        api.job_store = JobStore(str(tmp_path / 'update_job.db'))
+        api.error_path = str(tmp_path / 'error.csv')
+        api.data_info_path = str(tmp_path / 'up_data_info.json')
+        if url:
+            api.url = url
+        os.makedirs(api.all_data_path, exist_ok=True)
+        return api
+
+    return make
+
+
+@pytest.fixture
+def history():
+    """
+    生成模拟的日线数据：history(代码, 开始日期, 交易日数量)
+    """
+
+    def make(code, start='2024-01-02', periods=20, seed=0):
+        return generate_history(code, list(pd.bdate_range(start, periods=periods)), seed=seed)
+
+    return make
+
@@ -0,0 +1,134 @@
+import io
+import json
+import os
+import zipfile
+
+import pandas as pd
+import pytest
+
+from plugins.StockStrategy.benchmark import MockApiServer, bench_data_info, to_csv_bytes
+from plugins.StockStrategy.journal import MergeJournal
+
+code_list = ['sh600000', 'sz000001', 'sh600001']
+
+
+def get_payload(product, df):
+    """
+    一天的增量数据，按标的更新的产品为一个csv，按文件更新的产品为每个股票一个csv的zip
+    """
+    date_str = df['交易日期'].max().strftime('%Y-%m-%d')
+    if bench_data_info[product]['fun'] == 'update_by_group':
+        return f'{product}-{date_str}.csv', to_csv_bytes(df)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, mode='w') as zf:
+        for code, _df in df.groupby('股票代码'):
+            zf.writestr(f'{code}.csv', to_csv_bytes(_df))
+    return f'{product}-{date_str}.zip', buf.getvalue()
+
+
+@pytest.fixture
+def backfill(history):
+    """
+    每个股票25个交易日的数据，前20天为全量数据，之后3天为增量数据。
+    第二天的增量数据中重复了第一天的记录并修改了收盘价，去重时保留最后一条
+    """
+    # 超过30天的数据下载时会被跳过，使用最近的交易日
+    start = pd.bdate_range(end=pd.Timestamp.now().normalize() - pd.Timedelta(days=1), periods=25)[0]
+    df_dict = {code: history(code, start=start, periods=25, seed=i) for i, code in enumerate(code_list)}
+    day_list = []
+    for i in range(20, 23):
+        df = pd.concat([_df.iloc[[i]] for _df in df_dict.values()], ignore_index=True)
+        if i == 21:
+            old_df = pd.concat([_df.iloc[[20]] for _df in df_dict.values()], ignore_index=True)
+            old_df['收盘价'] = 99.99
+            df = pd.concat([old_df, df], ignore_index=True)
+        day_list.append(df)
+    expected_dict = {}
+    for code, df in df_dict.items():
+        df = df.iloc[:23].copy()
+        df.loc[20, '收盘价'] = 99.99
+        expected_dict[code] = df
+    return df_dict, day_list, expected_dict
+
+
+@pytest.mark.parametrize('product', list(bench_data_info))
+def test_multi_day_merge_matches_daily_merge(make_api, backfill, tmp_path, product):
+    df_dict, day_list, expected_dict = backfill
+    payload_dict = {}
+    for df in day_list:
+        payload_dict[(product, df['交易日期'].max().strftime('%Y-%m-%d'))] = get_payload(product, df)
+
+    result_list = []
+    with MockApiServer(payload_dict) as server:
+        for name in ['daily', 'multi']:
+            api = make_api(url=server.url)
+            api.all_data_path = str(tmp_path / name)
+            all_data_path = os.path.join(api.all_data_path, product)
+            os.makedirs(all_data_path)
+            for code, df in df_dict.items():
+                api.storage.write(os.path.join(all_data_path, code + '.csv'), df.iloc[:20])
+            date_file_list = []
+            for date_time in sorted(date_time for _, date_time in payload_dict):
+                ret_dict, file_name = api.download_single_data(product, date_time)
+                assert file_name
+                date_file_list.append((date_time, file_name))
+            if name == 'daily':
+                for date_time, file_name in date_file_list:
+                    api.merge_single_data(product, date_time, file_name)
+            else:
+                api.merge_multi_data(product, date_file_list)
+            result_list.append({code: api.storage.read(os.path.join(all_data_path, code + '.csv'),
+                                                       parse_dates=['交易日期']) for code in code_list})
+
+    for code in code_list:
+        pd.testing.assert_frame_equal(result_list[1][code], result_list[0][code])
+        pd.testing.assert_frame_equal(result_list[1][code], expected_dict[code], check_dtype=False)
+
+
+@pytest.mark.parametrize('rerun', ['multi', 'single'])
+@pytest.mark.parametrize('product', list(bench_data_info))
+def test_rerun_after_crash_with_other_dates(make_api, backfill, monkeypatch, product, rerun):
+    df_dict, day_list, expected_dict = backfill
+    payload_dict = {(product, df['交易日期'].max().strftime('%Y-%m-%d')): get_payload(product, df) for df in day_list}
+    with MockApiServer(payload_dict) as server:
+        api = make_api(url=server.url)
+        all_data_path = os.path.join(api.all_data_path, product)
+        os.makedirs(all_data_path)
+        for code, df in df_dict.items():
+            api.storage.write(os.path.join(all_data_path, code + '.csv'), df.iloc[:20])
+        date_file_list = [(date_time, api.download_single_data(product, date_time)[1])
+                          for date_time in sorted(date_time for _, date_time in payload_dict)]
+
+    # 合并前两天的数据时，第一个标的完成后中断，第二个标的已经写入的数据没有记录完成
+    done = MergeJournal.done
+    done_list = []
+
+    def crash(journal, symbol):
+        done_list.append(symbol)
+        if len(done_list) == 2:
+            raise KeyboardInterrupt
+        done(journal, symbol)
+
+    monkeypatch.setattr(MergeJournal, 'done', crash)
+    with pytest.raises(KeyboardInterrupt):
+        api.merge_multi_data(product, date_file_list[:2])
+    monkeypatch.setattr(MergeJournal, 'done', done)
+    journal_path = os.path.join(api.all_data_path, 'temp', product, 'journal.jsonl')
+    with open(journal_path, mode='r', encoding='utf8') as f:
+        record_list = [json.loads(line) for line in f]
+    for record in record_list:
+        if record['state'] == 'start' and record['symbol'] == done_list[1] and record['size'] is not None:
+            with open(record['path'], 'ab') as f:
+                f.write(f'{done_list[1]},半行'.encode('gbk'))
+
+    # 使用不同的日期重新合并，上次追加了一半的文件先截断，所有标的重新合并
+    if rerun == 'multi':
+        api.merge_multi_data(product, date_file_list[1:])
+    else:
+        for date_time, file_name in date_file_list[1:]:
+            api.merge_single_data(product, date_time, file_name)
+
+    assert not os.path.exists(journal_path)
+    for code in code_list:
+        df = api.storage.read(os.path.join(all_data_path, code + '.csv'), parse_dates=['交易日期'])
+        pd.testing.assert_frame_equal(df, expected_dict[code], check_dtype=False)
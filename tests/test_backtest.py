@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from plugins.StockStrategy import backtest
+from plugins.StockStrategy.backtest import Backtest, simulate_strategy
+
+product = 'stock-trading-data-pro'
+code_list = ['sh600000', 'sh600001', 'sz000001', 'sz000002', 'sz000003', 'sz000004']
+buy_cost, sell_cost = 1.2 / 10000, 1.2 / 10000 + 0.5 / 1000
+
+
+def make_panel(make_api, history, tmp_path, name, change_after=None):
+    """
+    根据模拟的日线数据生成截面数据，change_after不为空时修改该日期之后的收盘价
+    """
+    api = make_api()
+    api.all_data_path = str(tmp_path / name)
+    api.panel_fields_dict = {product: ['开盘价', '收盘价', '前收盘价', '成交量']}
+    os.makedirs(os.path.join(api.all_data_path, product))
+    for i, code in enumerate(code_list):
+        df = history(code, periods=40, seed=i)
+        if change_after is not None:
+            df.loc[df['交易日期'] > change_after, '收盘价'] *= 1.5
+        api.storage.write(os.path.join(api.all_data_path, product, code + '.csv'), df)
+    api.build_panel(product)
+    return api.get_panel(product)
+
+
+def make_signal(panel, select_count=2, freq=None, seed=0):
+    rng = np.random.default_rng(seed)
+    date_index = panel.dates()
+    if freq:
+        date_index = pd.Series(date_index, index=date_index).resample(freq).last().dropna()
+    row_list = []
+    for trade_date in date_index:
+        for rank, symbol in enumerate(rng.choice(code_list, select_count, replace=False)):
+            row_list.append({'trade_date': trade_date, 'symbol': symbol, 'rank': rank + 1})
+    return pd.DataFrame(row_list)
+
+
+def naive_equity(panel, signal_df, config):
+    """
+    逐批、逐日计算的现金与持仓，每份资金同时只持有一批，使用空闲最久的一份，没有空闲的资金时本批不买入
+    """
+    open_df, close_df, pre_close_df, volume_df = [panel.frame(field) for field in ['开盘价', '收盘价', '前收盘价', '成交量']]
+    date_index = close_df.index
+    date_count = len(date_index)
+    cap_count = config['cap_count']
+    part_list = [(1 / cap_count, -1)] * cap_count  # 每份资金当前的金额与上一批的卖出日
+    cash, hold = np.ones(date_count), np.zeros(date_count)
+    for trade_date, group in signal_df.sort_values(['trade_date', 'rank']).groupby('trade_date'):
+        buy_row = date_index.searchsorted(trade_date, side='right')
+        if buy_row >= date_count:
+            continue
+        symbol_list = [symbol for symbol in group['symbol'].head(config['select_count'])
+                       if volume_df[symbol].iloc[buy_row] > 0]
+        if isinstance(config['hold_plan'], list):
+            period = date_index.to_period('W-FRI')
+            sell_row = int(np.flatnonzero(period == period[buy_row])[-1])
+        else:
+            sell_row = min(buy_row + config['hold_plan'] - 1, date_count - 1)
+        free_list = [part for part in range(cap_count) if part_list[part][1] < buy_row]
+        if not free_list:
+            continue
+        part = min(free_list, key=lambda x: part_list[x][1])
+        start = part_list[part][0]
+        cash[buy_row:] -= start
+        value = 0
+        for symbol in symbol_list:
+            # 开盘买入，之后每天按照收盘价与前收盘价计算涨跌
+            symbol_value = start / len(symbol_list) / (1 + buy_cost)
+            for row in range(buy_row, sell_row + 1):
+                symbol_value *= close_df[symbol].iloc[row] / (
+                    open_df[symbol].iloc[row] if row == buy_row else pre_close_df[symbol].iloc[row])
+                if row < sell_row:
+                    hold[row] += symbol_value
+            value += symbol_value * (1 - sell_cost)
+        cash[sell_row:] += value
+        part_list[part] = (value, sell_row)
+    return pd.DataFrame({'cash': cash, 'hold': hold}, index=date_index)
+
+
+@pytest.mark.parametrize('config, freq', [
+    ({'cap_count': 1, 'hold_plan': ['W', 0], 'select_count': 2}, 'W-FRI'),
+    ({'cap_count': 2, 'hold_plan': 2, 'select_count': 2}, None),
+    # 持有天数超过资金份数，所有份都在持有时本批不买入
+    ({'cap_count': 2, 'hold_plan': 3, 'select_count': 3}, None),
+    ({'cap_count': 3, 'hold_plan': 5, 'select_count': 2}, None),
+])
+def test_equity_matches_naive_accounting(make_api, history, tmp_path, config, freq):
+    panel = make_panel(make_api, history, tmp_path, 'data')
+    signal_df = make_signal(panel, config['select_count'], freq)
+
+    equity = simulate_strategy(panel, signal_df, config, buy_cost, sell_cost)
+
+    naive_df = naive_equity(panel, signal_df, config)
+    np.testing.assert_allclose(equity.to_numpy(), naive_df.sum(axis=1).to_numpy(), rtol=1e-6)
+    # 不借钱买入，现金始终不为负
+    assert (naive_df['cash'] >= -1e-12).all()
+
+
+def test_equity_does_not_use_future_prices(make_api, history, tmp_path):
+    config = {'cap_count': 1, 'hold_plan': 3, 'select_count': 2}
+    change_after = pd.bdate_range('2024-01-02', periods=40)[25]
+    panel = make_panel(make_api, history, tmp_path, 'data')
+    changed_panel = make_panel(make_api, history, tmp_path, 'changed', change_after=change_after)
+    signal_df = make_signal(panel, config['select_count'])
+
+    equity = simulate_strategy(panel, signal_df, config, buy_cost, sell_cost)
+    changed_equity = simulate_strategy(changed_panel, signal_df, config, buy_cost, sell_cost)
+
+    pd.testing.assert_series_equal(equity[:change_after], changed_equity[:change_after])
+    assert not np.allclose(equity[change_after:], changed_equity[change_after:])
+
+
+def test_unsupported_plan_fields_warn(make_api, monkeypatch):
+    api = make_api()
+    message_list = []
+    monkeypatch.setattr(backtest, 'record_log', lambda msg, **kwargs: message_list.append(msg))
+    monkeypatch.setattr(Backtest, 'load_signal', lambda *args: pd.DataFrame(columns=['trade_date', 'symbol', 'rank']))
+    config = {'strategy_id': 'galileo', 'strategy_weight': 1, 'hold_plan': ['W', 0], 'select_count': 3,
+              'buy': ['base_buy', 0.02], 'sell': ['base_sell', '14:54:30']}
+
+    Backtest(api).get_task_list({'伽利略选股策略': config})
+
+    assert any('买入溢价' in msg for msg in message_list)
+    assert any('卖出时间' in msg for msg in message_list)
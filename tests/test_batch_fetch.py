@@ -0,0 +1,35 @@
+from plugins.StockStrategy.benchmark import MockApiServer
+
+strategy_list = [['galileo', '周', 3], ['galileo', '周', '3'], ['newton', '周', 3], ['galileo', '周', 3]]
+
+
+def get_hit(server, strategy):
+    return server.hit_dict.get(f'/api/data/stock-result/service/{strategy}', 0)
+
+
+def test_duplicate_keys_share_one_request(make_api):
+    with MockApiServer({}) as server:
+        api = make_api(url=server.url)
+        result_list, status_df = api.get_strategy_result_list(strategy_list)
+
+        assert get_hit(server, 'galileo') == 1 and get_hit(server, 'newton') == 1
+        assert result_list[0] == result_list[1] == result_list[3]
+        assert status_df['code'].tolist() == [200] * 4
+        assert status_df['coalesced'].tolist() == [False, True, False, True]
+        assert not status_df['cached'].any()
+
+        # 再次获取时使用缓存，不再请求
+        result_list, status_df = api.get_strategy_result_list(strategy_list)
+        assert get_hit(server, 'galileo') == 1 and get_hit(server, 'newton') == 1
+        assert status_df['cached'].tolist() == [True, False, True, False]
+        assert status_df['coalesced'].tolist() == [False, True, False, True]
+
+
+def test_duplicate_keys_without_cache(make_api):
+    with MockApiServer({}) as server:
+        api = make_api(url=server.url)
+        for _ in range(2):
+            result_list, status_df = api.get_strategy_result_list(strategy_list, use_cache=False)
+            assert not status_df['cached'].any()
+            assert status_df['coalesced'].tolist() == [False, True, False, True]
+        assert get_hit(server, 'galileo') == 2 and get_hit(server, 'newton') == 2
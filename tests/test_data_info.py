@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from plugins.StockStrategy.benchmark import MockApiServer, bench_data_info
+
+
+def load(api):
+    api.up_data_info = None
+    return api.up_data_info
+
+
+def read_cache(api):
+    with open(api.data_info_path, mode='r', encoding='utf8') as f:
+        return json.load(f)
+
+
+def test_revalidate_with_etag(make_api):
+    with MockApiServer({}) as server:
+        api = make_api(url=server.url)
+        assert load(api) == bench_data_info
+        assert read_cache(api)['etag'] == server.data_info_etag
+
+        # 缓存未过期时不请求接口
+        assert load(api) == bench_data_info
+        assert server.hit_dict['/api/data/get-data-info'] == 1
+
+        # 过期后带上ETag校验，没有更新时返回304，继续使用本地缓存
+        api.data_info_max_age = 0
+        fetch_time = read_cache(api)['fetch_time']
+        assert load(api) == bench_data_info
+        assert server.hit_dict['/api/data/get-data-info'] == 2
+        assert read_cache(api)['fetch_time'] > fetch_time
+
+
+@pytest.mark.parametrize('body', [b'<html>502 Bad Gateway</html>', b'{"code": 500, "msg": "error"}', b'[]'])
+def test_error_body_is_not_cached(make_api, body):
+    with MockApiServer({}) as server:
+        api = make_api(url=server.url)
+        load(api)
+        cache = read_cache(api)
+
+        # 接口出错时返回200与错误信息，不覆盖本地缓存
+        api.data_info_max_age = 0
+        server.data_info, server.data_info_etag = body, '"v2"'
+        assert load(api) == bench_data_info
+        assert read_cache(api) == cache
+
+
+def test_error_without_cache_raises(make_api, tmp_path):
+    with MockApiServer({}, data_info=b'{"code": 500, "msg": "error"}') as server:
+        api = make_api(url=server.url)
+        with pytest.raises(ValueError):
+            load(api)
+        assert not (tmp_path / 'up_data_info.json').exists()
+
+        # 没有缓存错误的结果，接口恢复后重新获取
+        server.data_info_status = 404
+        with pytest.raises(ValueError):
+            api.up_data_info
+        server.data_info, server.data_info_status = bench_data_info, 200
+        assert api.up_data_info == bench_data_info
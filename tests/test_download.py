@@ -0,0 +1,133 @@
+import gzip
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+body = os.urandom(64 * 1024)
+
+
+class FileServer(object):
+    """
+    本地的文件服务器：客户端接受gzip时压缩传输，支持Range与If-Range
+    """
+
+    def __init__(self, etag='"v1"', range_offset=0):
+        self.etag = etag
+        # 返回的Content-Range起始位置与请求的偏移量，用于模拟服务器返回错误的范围
+        self.range_offset = range_offset
+        self.header_list = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.get_handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_port}/download/test.zip'
+
+    def get_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.header_list.append(dict(self.headers))
+                match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+                if match and self.headers.get('If-Range', server.etag) == server.etag:
+                    start = int(match.group(1)) + server.range_offset
+                    content = body[start:]
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+                else:
+                    content = body
+                    self.send_response(200)
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    content = gzip.compress(content)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('ETag', server.etag)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+        return Handler
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def file_server():
+    server_list = []
+
+    def make(**kwargs):
+        server_list.append(FileServer(**kwargs))
+        return server_list[-1]
+
+    yield make
+    for server in server_list:
+        server.stop()
+
+
+def write_part(path, size, etag):
+    with open(os.path.join(path, 'test.zip.part'), 'wb') as f:
+        f.write(body[:size])
+    if etag:
+        with open(os.path.join(path, 'test.zip.part.etag'), 'w', encoding='utf8') as f:
+            f.write(etag)
+
+
+def read_file(path):
+    with open(os.path.join(path, 'test.zip'), 'rb') as f:
+        return f.read()
+
+
+def test_download_without_compression(make_api, file_server, tmp_path):
+    api = make_api()
+    server = file_server()
+
+    assert api.download_file(server.url, 'test.zip', str(tmp_path))
+
+    assert server.header_list[0]['Accept-Encoding'] == 'identity'
+    assert read_file(tmp_path) == body
+    assert not os.path.exists(tmp_path / 'test.zip.part.etag')
+
+
+def test_resume_with_same_etag(make_api, file_server, tmp_path):
+    api = make_api()
+    server = file_server()
+    write_part(tmp_path, 1000, '"v1"')
+
+    assert api.download_file(server.url, 'test.zip', str(tmp_path))
+
+    assert server.header_list[0]['Range'] == 'bytes=1000-'
+    assert server.header_list[0]['If-Range'] == '"v1"'
+    assert read_file(tmp_path) == body
+
+
+@pytest.mark.parametrize('etag', ['"v0"', None])
+def test_changed_file_downloads_from_start(make_api, file_server, tmp_path, etag):
+    api = make_api()
+    server = file_server()
+    # 已下载的部分来自旧版本的文件或者不知道版本，不能拼接
+    write_part(tmp_path, 1000, etag)
+
+    assert api.download_file(server.url, 'test.zip', str(tmp_path))
+
+    assert read_file(tmp_path) == body
+
+
+def test_wrong_content_range_downloads_from_start(make_api, file_server, tmp_path):
+    api = make_api()
+    server = file_server(range_offset=10)
+    write_part(tmp_path, 1000, '"v1"')
+
+    assert api.download_file(server.url, 'test.zip', str(tmp_path))
+
+    assert len(server.header_list) == 2
+    assert 'Range' not in server.header_list[1]
+    assert read_file(tmp_path) == body
@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from plugins.StockStrategy import BaseDataApi
+from plugins.StockStrategy.http_client import TokenBucket
+
+date_list = [d.strftime('%Y-%m-%d') for d in pd.bdate_range('2024-01-02', periods=8)]
+
+
+class KlineServer(object):
+    """
+    模拟的指数k线接口，每页最多返回page_size根k线，从后往前分页
+    """
+
+    def __init__(self, kline_dict, page_size=3):
+        self.kline_dict = kline_dict
+        self.page_size = page_size
+        self.request_list = []
+        self.lock = threading.Lock()
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        index, _, start_time, end_time, _, _ = params['param'].split(',')
+        with self.lock:
+            self.request_list.append((index, start_time, end_time))
+        day_list = [row for row in self.kline_dict[index]
+                    if row[0] >= start_time and (not end_time or row[0] <= end_time)][-self.page_size:]
+        text = 'kline_dayqfq=' + json.dumps({'code': 0, 'data': {index: {'day': day_list}}})
+        return SimpleNamespace(text=text)
+
+
+def make_kline(count, seed=0):
+    return [[date, str(10 + i + seed), str(11 + i + seed), str(12 + i + seed), str(9 + i + seed), str(1000 + i)]
+            for i, date in enumerate(date_list[:count])]
+
+
+@pytest.fixture
+def kline_server(monkeypatch):
+    server = KlineServer({'sh000001': make_kline(5), 'sz399001': make_kline(5, seed=1)})
+    monkeypatch.setattr(BaseDataApi, 'requests', SimpleNamespace(get=server.get))
+    return server
+
+
+def read_index(api, index):
+    return pd.read_csv(f'{api.all_data_path}/index/{index}.csv', encoding='gbk')
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=20, capacity=2)
+    start_time = time.time()
+    thread_list = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(4)]) for _ in range(3)]
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    # 12个令牌，开始时可以突发2个，其余10个按照每秒20个生成
+    assert time.time() - start_time >= 10 / 20 - 0.05
+
+
+def test_fetch_pages_backwards(kline_server):
+    acquire_list = []
+    df = BaseDataApi.BaseDataApi.fetch_index_data('sh000001', '1900-01-01',
+                                                  SimpleNamespace(acquire=lambda: acquire_list.append(1)))
+
+    assert df['candle_end_time'].tolist() == date_list[:5]
+    assert df.columns.tolist() == ['candle_end_time', 'open', 'high', 'low', 'close', 'amount', 'info']
+    # 每一页请求前都取一个令牌
+    assert len(acquire_list) == len(kline_server.request_list) == 3
+
+
+def test_incremental_update(make_api, kline_server, monkeypatch):
+    api = make_api()
+    index_list = list(kline_server.kline_dict)
+    monkeypatch.setattr(api, 'get_index_drop_date', lambda: None)
+    api.update_stock_index(index_list, max_workers=2, request_rate=100)
+    for index in index_list:
+        assert read_index(api, index)['candle_end_time'].tolist() == date_list[:5]
+
+    # 增量更新只请求最后日期之后的k线，交易时间内当天没有走完的k线不保存
+    kline_server.request_list.clear()
+    kline_server.kline_dict = {index: make_kline(8, seed=i) for i, index in enumerate(index_list)}
+    monkeypatch.setattr(api, 'get_index_drop_date', lambda: date_list[7])
+    api.update_stock_index(index_list, max_workers=2, request_rate=100)
+
+    assert {start_time for _, start_time, _ in kline_server.request_list} == {date_list[4]}
+    for i, index in enumerate(index_list):
+        df = read_index(api, index)
+        assert df['candle_end_time'].tolist() == date_list[:7]
+        assert df['close'].tolist() == [float(row[2]) for row in make_kline(7, seed=i)]
+
+    # 全量更新时重新获取全部历史数据
+    monkeypatch.setattr(api, 'get_index_drop_date', lambda: None)
+    api.update_stock_index(index_list, incremental=False, max_workers=2, request_rate=100)
+    assert read_index(api, index_list[0])['candle_end_time'].tolist() == date_list
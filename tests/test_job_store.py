@@ -0,0 +1,97 @@
+import pandas as pd
+
+from plugins.StockStrategy.job_store import JobStore
+
+product = 'stock-trading-data-pro'
+
+
+def get_job(store, date_time):
+    return store.jobs(product=product).set_index('date_time').loc[date_time]
+
+
+def test_error_backs_off_until_retry(tmp_path):
+    store = JobStore(str(tmp_path / 'job.db'), retry_delay=300)
+    store.add(product, '2024-01-02')
+    assert store.due_jobs(['pending'])['date_time'].tolist() == ['2024-01-02']
+
+    store.mark_running(product, '2024-01-02')
+    store.mark_error(product, '2024-01-02', 'timeout')
+    job = get_job(store, '2024-01-02')
+    assert (job['state'], job['attempts'], job['last_error']) == ('error', 1, 'timeout')
+    # 退避期间不会执行
+    assert store.due_jobs(['pending', 'error']).empty
+
+    assert store.retry(product) == 1
+    assert store.due_jobs(['error'])['date_time'].tolist() == ['2024-01-02']
+    assert get_job(store, '2024-01-02')['attempts'] == 0
+
+
+def test_delay_doubles_up_to_max_delay(tmp_path):
+    store = JobStore(str(tmp_path / 'job.db'), retry_delay=100, max_retry_delay=250)
+    store.add(product, '2024-01-02')
+    delay_list = []
+    for _ in range(3):
+        store.mark_running(product, '2024-01-02')
+        store.mark_error(product, '2024-01-02')
+        job = get_job(store, '2024-01-02')
+        delay_list.append((pd.Timestamp(job['next_eligible']) - pd.Timestamp(job['updated_at'])).total_seconds())
+    assert delay_list == [100, 200, 250]
+
+
+def test_stops_at_max_attempts(tmp_path):
+    store = JobStore(str(tmp_path / 'job.db'), max_attempts=3, retry_delay=0)
+    store.add(product, '2024-01-02')
+    for attempts in range(1, 4):
+        assert not store.due_jobs(['pending', 'error']).empty
+        store.mark_running(product, '2024-01-02')
+        store.mark_error(product, '2024-01-02')
+        assert get_job(store, '2024-01-02')['attempts'] == attempts
+    # 达到次数上限后不再自动重试
+    assert store.due_jobs(['pending', 'error']).empty
+
+
+def test_add_keeps_existing_jobs(tmp_path):
+    store = JobStore(str(tmp_path / 'job.db'), retry_delay=300)
+    for date_time in ['2024-01-02', '2024-01-03']:
+        store.add(product, date_time)
+        store.mark_running(product, date_time)
+    store.mark_error(product, '2024-01-02', 'timeout')
+    store.mark_done(product, '2024-01-03')
+
+    # 最新日期中再次出现的任务只更新优先级，新的日期添加为等待执行
+    for date_time in ['2024-01-02', '2024-01-03', '2024-01-04']:
+        store.add(product, date_time, priority=1)
+
+    df = store.jobs(product=product).set_index('date_time')
+    assert df['state'].tolist() == ['error', 'done', 'pending']
+    assert df['attempts'].tolist() == [1, 1, 0]
+    assert df['priority'].tolist() == [1, 1, 1]
+    assert store.due_jobs(['pending', 'error'])['date_time'].tolist() == ['2024-01-04']
+
+
+def test_recover_running_jobs(tmp_path):
+    store = JobStore(str(tmp_path / 'job.db'))
+    store.add(product, '2024-01-02')
+    store.mark_running(product, '2024-01-02')
+
+    assert JobStore(store.db_path).recover() == 1
+    assert get_job(store, '2024-01-02')['state'] == 'pending'
+
+
+def test_force_add_resets_jobs(tmp_path):
+    store = JobStore(str(tmp_path / 'job.db'), retry_delay=300)
+    for date_time in ['2024-01-02', '2024-01-03']:
+        store.add(product, date_time)
+        store.mark_running(product, date_time)
+    store.mark_error(product, '2024-01-02', 'timeout')
+    store.mark_done(product, '2024-01-03')
+
+    # 手动指定的日期重新设置为立即执行
+    for date_time in ['2024-01-02', '2024-01-03']:
+        store.add(product, date_time, force=True)
+
+    df = store.jobs(product=product).set_index('date_time')
+    assert df['state'].tolist() == ['pending', 'pending']
+    assert df['attempts'].tolist() == [0, 0]
+    assert df['last_error'].isna().all()
+    assert store.due_jobs(['pending'])['date_time'].tolist() == ['2024-01-02', '2024-01-03']
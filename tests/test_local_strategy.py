@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+
+from plugins.StockStrategy.local_strategy import LocalStrategy
+
+
+def to_str(index):
+    return [date.strftime('%Y-%m-%d') for date in index]
+
+
+@pytest.mark.parametrize('end, select_list, buy_list', [
+    # 周三的数据，本周还没有结束，最近的选股日为上周五
+    ('2024-01-10', ['2024-01-05'], ['2024-01-08']),
+    # 周五为本周最后一个交易日，买入日为下一个工作日
+    ('2024-01-12', ['2024-01-05', '2024-01-12'], ['2024-01-08', '2024-01-15']),
+])
+def test_week_drops_unfinished_period(end, select_list, buy_list):
+    select_index, buy_index = LocalStrategy.get_select_dates(pd.bdate_range('2024-01-02', end), '周')
+    assert to_str(select_index) == select_list
+    assert to_str(buy_index) == buy_list
+
+
+@pytest.mark.parametrize('period', ['月', '自然月'])
+def test_month_drops_unfinished_period(period):
+    select_index, buy_index = LocalStrategy.get_select_dates(pd.bdate_range('2024-01-02', '2024-02-15'), period)
+    assert to_str(select_index) == ['2024-01-31']
+    assert to_str(buy_index) == ['2024-02-01']
+
+    select_index, _ = LocalStrategy.get_select_dates(pd.bdate_range('2024-01-02', '2024-02-29'), period)
+    assert to_str(select_index) == ['2024-01-31', '2024-02-29']
+
+
+def test_event_period_selects_every_day():
+    date_index = pd.bdate_range('2024-01-02', '2024-01-10')
+    select_index, buy_index = LocalStrategy.get_select_dates(date_index, '5天')
+    assert to_str(select_index) == to_str(date_index)
+    assert to_str(buy_index) == to_str(date_index[1:]) + ['2024-01-11']
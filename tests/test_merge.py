@@ -0,0 +1,124 @@
+import os
+
+import pandas as pd
+import pytest
+
+from plugins.StockStrategy.benchmark import to_csv_bytes
+from plugins.StockStrategy.journal import MergeJournal
+
+product = 'stock-trading-data-pro'
+
+
+def get_path(api, code):
+    return os.path.join(api.all_data_path, product, code + api.storage.suffix)
+
+
+@pytest.mark.parametrize('storage_type', ['csv', 'parquet'])
+def test_append_newer_rows(make_api, history, storage_type):
+    api = make_api(storage_type)
+    df = history('sh600000', periods=25)
+    path = get_path(api, 'sh600000')
+    os.makedirs(os.path.dirname(path))
+    api.storage.write(path, df.iloc[:20])
+    before = open(path, 'rb').read() if storage_type == 'csv' else None
+
+    assert api.append_data(path, df.iloc[20:], product)
+
+    if storage_type == 'csv':
+        # 追加时不重写原有的内容
+        assert open(path, 'rb').read().startswith(before)
+    result = api.storage.read(path, parse_dates=['交易日期'])
+    pd.testing.assert_frame_equal(result, df, check_dtype=False)
+
+
+@pytest.mark.parametrize('storage_type', ['csv', 'parquet'])
+def test_overlap_falls_back_to_rewrite(make_api, history, storage_type):
+    api = make_api(storage_type)
+    df = history('sh600000', periods=25)
+    path = get_path(api, 'sh600000')
+    os.makedirs(os.path.dirname(path))
+    api.storage.write(path, df.iloc[:20])
+    # 与全量数据最后一天重叠，且收盘价发生了变化
+    new_df = df.iloc[19:].copy()
+    new_df.loc[new_df.index[0], '收盘价'] = 99.99
+
+    assert not api.append_data(path, new_df, product)
+    api.update_group_data(new_df, 'sh600000', os.path.join(api.all_data_path, product), product)
+
+    result = api.storage.read(path, parse_dates=['交易日期'])
+    assert result.shape[0] == 25
+    assert result['交易日期'].is_monotonic_increasing
+    # 按照配置保留最后一条
+    assert result.loc[19, '收盘价'] == 99.99
+    assert not api.append_data(path, df.iloc[:1], product)
+
+
+def write_daily_file(path, df):
+    with open(path, 'wb') as f:
+        f.write(to_csv_bytes(df))
+
+
+@pytest.mark.parametrize('chunk_size, buffer_rows', [(4, 1000000), (4, 10), (3, 1)])
+def test_chunked_group_flush_matches_whole_file(make_api, history, tmp_path, chunk_size, buffer_rows):
+    code_list = ['sh600000', 'sh600001', 'sz000001', 'sz000002', 'sz000003']
+    df_dict = {code: history(code, periods=26, seed=i) for i, code in enumerate(code_list)}
+    # 增量数据从全量数据的最后一天开始，按股票代码排序，每个股票的数据会被分到不同的块中
+    new_df = pd.concat([df.iloc[19:] for df in df_dict.values()], ignore_index=True)
+    file_path = str(tmp_path / 'daily.csv')
+    write_daily_file(file_path, new_df)
+
+    result_list = []
+    for name, kwargs in [('whole', {}), ('chunk', {'chunk_size': chunk_size, 'buffer_rows': buffer_rows})]:
+        api = make_api()
+        api.all_data_path = str(tmp_path / name)
+        all_data_path = os.path.join(api.all_data_path, product)
+        for code, df in df_dict.items():
+            os.makedirs(all_data_path, exist_ok=True)
+            api.storage.write(get_path(api, code), df.iloc[:20])
+        api.update_by_group(file_path, all_data_path, product, **kwargs)
+        result_list.append({code: api.storage.read(get_path(api, code), parse_dates=['交易日期'])
+                            for code in code_list})
+
+    for code, df in df_dict.items():
+        pd.testing.assert_frame_equal(result_list[1][code], result_list[0][code])
+        pd.testing.assert_frame_equal(result_list[1][code], df, check_dtype=False)
+
+
+@pytest.mark.parametrize('storage_type', ['csv', 'parquet'])
+def test_journal_recovers_partial_append(make_api, history, tmp_path, monkeypatch, storage_type):
+    api = make_api(storage_type)
+    all_data_path = os.path.join(api.all_data_path, product)
+    os.makedirs(all_data_path)
+    df_dict = {code: history(code, periods=25, seed=i) for i, code in enumerate(['sh600000', 'sz000001'])}
+    for code, df in df_dict.items():
+        api.storage.write(get_path(api, code), df.iloc[:20])
+    file_path = str(tmp_path / 'daily.csv')
+    write_daily_file(file_path, pd.concat([df.iloc[20:] for df in df_dict.values()], ignore_index=True))
+
+    # 上次合并时sh600000已经完成，sz000001追加到一半时中断
+    journal = MergeJournal(str(tmp_path / 'journal.jsonl'))
+    api.update_group_data(df_dict['sh600000'].iloc[20:], 'sh600000', all_data_path, product, journal)
+    api.append_data(get_path(api, 'sz000001'), df_dict['sz000001'].iloc[20:22], product, journal, 'sz000001')
+    if storage_type == 'csv':
+        with open(get_path(api, 'sz000001'), 'ab') as f:
+            f.write('sz000001,半行'.encode('gbk'))
+
+    journal = MergeJournal(journal.path)
+    assert journal.recover() == {'sh600000'}
+    pd.testing.assert_frame_equal(api.storage.read(get_path(api, 'sz000001'), parse_dates=['交易日期']),
+                                  df_dict['sz000001'].iloc[:20], check_dtype=False)
+
+    merge_list = []
+    update_group_data = api.update_group_data
+
+    def record_merge(df, file_name, *args):
+        merge_list.append(file_name)
+        return update_group_data(df, file_name, *args)
+
+    monkeypatch.setattr(api, 'update_group_data', record_merge)
+    api.update_by_group(file_path, all_data_path, product, journal=journal)
+
+    assert merge_list == ['sz000001']
+    for code, df in df_dict.items():
+        pd.testing.assert_frame_equal(api.storage.read(get_path(api, code), parse_dates=['交易日期']), df,
+                                      check_dtype=False)
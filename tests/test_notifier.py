@@ -0,0 +1,73 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from plugins.StockStrategy import common
+from plugins.StockStrategy.common import Notifier
+
+
+def read_sink(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, mode='r', encoding='utf8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_merge_messages_in_window(tmp_path):
+    sink = str(tmp_path / 'notify.log')
+    notifier = Notifier(window=60, sink=sink)
+    for content in ['下载失败', '下载失败', '合并失败']:
+        assert notifier.put(content, robot_type='waring')
+    notifier.put('更新完成')
+    # 时间窗口没有结束时不发送
+    time.sleep(0.1)
+    assert read_sink(sink) == []
+
+    assert notifier.flush(timeout=5)
+    message_dict = {message['robot_type']: message['content'] for message in read_sink(sink)}
+    assert message_dict == {'waring': '下载失败（2次）\n合并失败', 'info': '更新完成'}
+    assert notifier.stats['put'] == 4 and notifier.stats['sent'] == 2
+
+
+def test_split_long_messages(tmp_path):
+    sink = str(tmp_path / 'notify.log')
+    notifier = Notifier(window=60, sink=sink)
+    for i in range(3):
+        notifier.put(str(i) * 1500)
+    assert notifier.flush(timeout=5)
+    assert [message['content'] for message in read_sink(sink)] == [str(i) * 1500 for i in range(3)]
+
+
+def test_rate_limit(tmp_path):
+    notifier = Notifier(window=0, rate_limit=(2, 0.5), sink=str(tmp_path / 'notify.log'))
+    start_time = time.time()
+    for content in ['a', 'b', 'c']:
+        notifier.put(content)
+        assert notifier.flush(timeout=5)
+    assert time.time() - start_time >= 0.5
+    assert notifier.stats['sent'] == 3
+
+
+def test_drop_when_queue_is_full(tmp_path):
+    notifier = Notifier(queue_size=1, sink=str(tmp_path / 'notify.log'))
+    notifier.start = lambda: None  # 不启动后台线程，队列不会被消费
+    assert notifier.put('a')
+    assert not notifier.put('b')
+    assert notifier.stats['dropped'] == 1
+
+
+def test_flush_on_shutdown(tmp_path):
+    sink = str(tmp_path / 'notify.log')
+    # 时间窗口远大于进程运行时间，消息只能在退出时发送
+    code = '\n'.join([
+        'from plugins.StockStrategy import common',
+        f'common.notifier.sink = {sink!r}',
+        'common.notifier.window = 3600',
+        'common.notifier.put("更新完成")',
+        'common.notifier.put("下载失败", robot_type="waring")',
+    ])
+    root_path = os.path.dirname(os.path.dirname(os.path.dirname(common.__file__)))
+    subprocess.run([sys.executable, '-c', code], cwd=root_path, check=True, timeout=60)
+    assert sorted(message['content'] for message in read_sink(sink)) == ['下载失败', '更新完成']
@@ -0,0 +1,73 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from plugins.StockStrategy.benchmark import to_csv_bytes
+
+product = 'stock-trading-data-pro'
+field_list = ['开盘价', '收盘价', '前收盘价', '成交量']
+
+
+def make_days(history):
+    """
+    3个标的20天的全量数据，之后3天的增量数据：第二天新上市一个标的，并修改了第一天的收盘价
+    """
+    df_dict = {code: history(code, periods=23, seed=i) for i, code in enumerate(['sh600000', 'sz000001', 'sh600001'])}
+    new_df = history('sz000009', periods=23, seed=9).iloc[21:]
+    day_list = []
+    for i in range(20, 23):
+        df = pd.concat([_df.iloc[[i]] for _df in df_dict.values()], ignore_index=True)
+        if i == 21:
+            old_df = pd.concat([_df.iloc[[20]] for _df in df_dict.values()], ignore_index=True)
+            old_df['收盘价'] = 99.99
+            df = pd.concat([old_df, df, new_df.iloc[[0]]], ignore_index=True)
+        elif i == 22:
+            df = pd.concat([df, new_df.iloc[[1]]], ignore_index=True)
+        day_list.append(df)
+    return df_dict, day_list
+
+
+def make_panel_api(make_api, tmp_path, name, storage_type):
+    api = make_api(storage_type)
+    api.all_data_path = str(tmp_path / name)
+    api.panel_fields_dict = {product: field_list}
+    os.makedirs(os.path.join(api.all_data_path, product))
+    return api
+
+
+@pytest.mark.parametrize('storage_type', ['csv', 'parquet'])
+@pytest.mark.parametrize('mode', ['daily', 'multi', 'chunks'])
+def test_incremental_update_matches_rebuild(make_api, history, tmp_path, storage_type, mode):
+    df_dict, day_list = make_days(history)
+    api = make_panel_api(make_api, tmp_path, 'incremental', storage_type)
+    all_data_path = os.path.join(api.all_data_path, product)
+    for code, df in df_dict.items():
+        api.storage.write(os.path.join(all_data_path, code + api.storage.suffix), df.iloc[:20])
+    api.build_panel(product)
+
+    # 合并增量数据时同步更新截面数据
+    file_path_list = []
+    for i, df in enumerate(day_list):
+        file_path_list.append(str(tmp_path / f'day_{i}.csv'))
+        with open(file_path_list[-1], 'wb') as f:
+            f.write(to_csv_bytes(df))
+    if mode == 'multi':
+        api.update_by_group(file_path_list, all_data_path, product)
+    else:
+        for file_path in file_path_list:
+            api.update_by_group(file_path, all_data_path, product, chunk_size=2 if mode == 'chunks' else None)
+
+    # 用合并后的全量数据重新生成
+    rebuild_api = make_panel_api(make_api, tmp_path, 'rebuild', storage_type)
+    shutil.copytree(all_data_path, os.path.join(rebuild_api.all_data_path, product), dirs_exist_ok=True)
+    panel = api.get_panel(product)
+    rebuild_panel = rebuild_api.build_panel(product)
+
+    assert panel.symbols() == ['sh600000', 'sh600001', 'sz000001', 'sz000009']
+    assert len(panel.dates()) == 23
+    for field in field_list:
+        pd.testing.assert_frame_equal(panel.frame(field).sort_index(axis=1), rebuild_panel.frame(field),
+                                      check_exact=True)
+    assert panel.frame('收盘价').iloc[20, :3].tolist() == [99.99] * 3
@@ -0,0 +1,77 @@
+import os
+
+import pandas as pd
+import pytest
+
+from plugins.StockStrategy.query import DataQuery
+
+product = 'stock-trading-data-pro'
+code_list = ['sh600000', 'sh600001', 'sz000001']
+
+
+@pytest.fixture(params=['csv', 'parquet'])
+def api(request, make_api, history):
+    api = make_api(request.param)
+    os.makedirs(os.path.join(api.all_data_path, product))
+    for i, code in enumerate(code_list):
+        api.storage.write(get_path(api, code), history(code, periods=20, seed=i))
+    return api
+
+
+def get_path(api, code):
+    return os.path.join(api.all_data_path, product, code + api.storage.suffix)
+
+
+def test_load_range_and_columns(api, history):
+    query = DataQuery(api)
+    df = query.load(product, 'sh600001', start='2024-01-05', end='2024-01-12', columns=['收盘价'])
+
+    expected = history('sh600001', periods=20, seed=1)
+    expected = expected[(expected['交易日期'] >= '2024-01-05') & (expected['交易日期'] <= '2024-01-12')]
+    assert df.columns.tolist() == ['收盘价']
+    assert df['收盘价'].tolist() == pytest.approx(expected['收盘价'].tolist())
+    assert query.load(product).shape[0] == 20 * len(code_list)
+
+
+def test_evicts_least_recently_used(api):
+    # 先把csv转换为arrow文件，之后的读取都从arrow文件读取
+    DataQuery(api).load(product)
+    query = DataQuery(api)
+    query.load(product)
+    size_list = sorted(size for _, _, size in query.cache_dict.values())
+    # 最多缓存两个标的
+    query = DataQuery(api, cache_bytes=size_list[1] + size_list[2] + size_list[0] // 2)
+    for code in [code_list[0], code_list[1], code_list[0], code_list[2]]:
+        query.load(product, code)
+
+    assert query.info()['evict'] == 1
+    assert [key[1] for key in query.cache_dict] == [code_list[0], code_list[2]]
+    query.load(product, code_list[0])
+    assert query.info()['hit'] == 2 and query.info()['miss'] == 3
+    assert query.info()['bytes'] <= query.cache_bytes
+
+
+def test_too_large_data_is_not_cached(api):
+    query = DataQuery(api, cache_bytes=0)
+    query.load(product, code_list[0])
+    query.load(product, code_list[0])
+    assert query.info()['count'] == 0 and query.info()['miss'] == 2
+
+
+def test_invalidates_after_update(api, history):
+    query = DataQuery(api)
+    df = query.load(product, code_list[0])
+    # 返回的是副本，修改不影响缓存
+    df['收盘价'] = 0
+    assert (query.load(product, code_list[0])['收盘价'] > 0).all()
+    assert query.info()['hit'] == 1
+
+    new_df = history(code_list[0], periods=25, seed=0)
+    api.storage.append(get_path(api, code_list[0]), new_df.iloc[20:])
+
+    df = query.load(product, code_list[0])
+    assert query.info()['miss'] == 2
+    assert df['交易日期'].tolist() == new_df['交易日期'].tolist()
+    assert df['收盘价'].tolist() == pytest.approx(new_df['收盘价'].tolist())
+    # 重新启动后，csv转换的arrow文件也随着全量数据更新
+    assert DataQuery(api).load(product, code_list[0]).shape[0] == 25
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from plugins.StockStrategy.benchmark import to_csv_bytes
+from plugins.StockStrategy.schema import infer_column_type
+
+product = 'stock-trading-data-pro'
+
+
+def write_csv(path, df, header_info=True):
+    content = to_csv_bytes(df)
+    if not header_info:
+        content = content.split(b'\n', 1)[1]
+    with open(path, 'wb') as f:
+        f.write(content)
+    return str(path)
+
+
+def test_infer_checks_whole_column():
+    value = pd.Series(np.full(20001, 1.5))
+    assert infer_column_type(value) == 'float32'
+    value[1] = 1.23456789
+    assert infer_column_type(value) == 'float64'
+
+
+def test_merge_keeps_float64_precision(make_api, history, tmp_path):
+    api = make_api()
+    df = history('sh600000', periods=25)
+    df['复权因子'] = 1.23456789
+    # 增量数据的复权因子都是1.0，推断出的格式为float32
+    new_df = df.iloc[19:].copy()
+    new_df['复权因子'] = 1.0
+    api.read_file(write_csv(tmp_path / 'daily.csv', new_df), product)
+    assert api.schema_registry.get(product)['columns']['复权因子'] == 'float32'
+    all_data_path = os.path.join(api.all_data_path, product)
+    os.makedirs(all_data_path)
+    api.storage.write(os.path.join(all_data_path, 'sh600000.csv'), df.iloc[:20])
+
+    api.update_group_data(new_df, 'sh600000', all_data_path, product)
+
+    result = api.read_file(os.path.join(all_data_path, 'sh600000.csv'), product)
+    assert result['复权因子'].dtype == np.float64
+    assert result['复权因子'].tolist() == [1.23456789] * 19 + [1.0] * 6
+    # 查询时每个文件单独判断能否使用float32
+    query_df = api.read_file(os.path.join(all_data_path, 'sh600000.csv'), product, downcast=True)
+    assert query_df['复权因子'].dtype == np.float64
+    assert api.read_file(str(tmp_path / 'daily.csv'), product, downcast=True)['复权因子'].dtype == np.float32
+
+
+def test_header_mismatch_falls_back(make_api, history, tmp_path):
+    api = make_api()
+    df = history('sh600000', periods=5)
+    api.read_file(write_csv(tmp_path / 'a.csv', df), product)
+    assert api.schema_registry.get(product)['skiprows'] == 1
+
+    # 没有表头说明的文件不能跳过第一行
+    result = api.read_file(write_csv(tmp_path / 'b.csv', df, header_info=False), product)
+
+    pd.testing.assert_frame_equal(result, df, check_dtype=False)
+    assert api.schema_registry.get(product)['skiprows'] == 0
+
+
+def test_column_mismatch_falls_back(make_api, history, tmp_path):
+    api = make_api()
+    df = history('sh600000', periods=5)
+    api.read_file(write_csv(tmp_path / 'a.csv', df), product)
+
+    new_df = df.assign(新增字段=1.5)
+    result = api.read_file(write_csv(tmp_path / 'b.csv', new_df), product)
+
+    pd.testing.assert_frame_equal(result, new_df, check_dtype=False)
+    assert '新增字段' in api.schema_registry.get(product)['names']
@@ -0,0 +1,161 @@
+"""
+插件依赖chatgpt-on-wechat提供的bridge、plugins与common.log，测试时用最小的替代实现，只测试插件自身的查询逻辑
+"""
+import importlib
+import logging
+import sys
+import threading
+from concurrent.futures import Future
+from enum import Enum
+from types import ModuleType
+
+import pytest
+
+import plugins
+
+
+class ContextType(Enum):
+    TEXT = 1
+
+
+class ReplyType(Enum):
+    TEXT = 1
+
+
+class Reply(object):
+    def __init__(self, type=None, content=None):
+        self.type = type
+        self.content = content
+
+
+class Event(Enum):
+    ON_HANDLE_CONTEXT = 1
+
+
+class EventAction(Enum):
+    CONTINUE = 1
+    BREAK = 2
+    BREAK_PASS = 3
+
+
+class EventContext(object):
+    def __init__(self, event=None, econtext=None):
+        self.event = event
+        self.econtext = econtext or {}
+        self.action = EventAction.CONTINUE
+
+    def __getitem__(self, key):
+        return self.econtext[key]
+
+    def __setitem__(self, key, value):
+        self.econtext[key] = value
+
+
+class Plugin(object):
+    def __init__(self):
+        self.handlers = {}
+
+
+class Context(object):
+    def __init__(self, content, session_id):
+        self.type = ContextType.TEXT
+        self.content = content
+        self.kwargs = {'session_id': session_id}
+
+    def get(self, key, default=None):
+        return self.kwargs.get(key, default)
+
+
+class Channel(object):
+    def __init__(self):
+        self.reply_list = []
+        self.event = threading.Event()
+
+    def send(self, reply, context):
+        self.reply_list.append(reply.content)
+        self.event.set()
+
+
+class ResultApi(object):
+    """
+    立即返回策略结果，相当于命中缓存
+    """
+
+    def __init__(self):
+        self.call_list = []
+
+    def get_strategy_result(self, strategy, period, select_count):
+        self.call_list.append((strategy, period, select_count))
+        return {'code': 200, 'select_time': '2024-01-05', 'buy_time': '2024-01-08',
+                'result': [{'name': '浦发银行', 'symbol': 'sh600000'}]}
+
+
+class DoneExecutor(object):
+    """
+    在提交时就执行完成的线程池，模拟注册回调之前查询已经完成
+    """
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+@pytest.fixture
+def plugin(monkeypatch):
+    bridge = ModuleType('bridge')
+    context_module = ModuleType('bridge.context')
+    context_module.ContextType = ContextType
+    reply_module = ModuleType('bridge.reply')
+    reply_module.Reply, reply_module.ReplyType = Reply, ReplyType
+    common = ModuleType('common')
+    log_module = ModuleType('common.log')
+    log_module.logger = logging.getLogger('stock_strategy_test')
+    for name, module in [('bridge', bridge), ('bridge.context', context_module), ('bridge.reply', reply_module),
+                         ('common', common), ('common.log', log_module)]:
+        monkeypatch.setitem(sys.modules, name, module)
+    for name, value in [('register', lambda **kwargs: lambda cls: cls), ('Plugin', Plugin), ('Event', Event),
+                        ('EventAction', EventAction), ('EventContext', EventContext)]:
+        monkeypatch.setattr(plugins, name, value, raising=False)
+    module = importlib.import_module('plugins.StockStrategy.stockstrategy')
+    instance = module.StockStrategy()
+    instance.base_data_api = ResultApi()
+    executor = instance.executor
+    yield instance
+    executor.shutdown(wait=True)
+
+
+def run_with_timeout(fn, timeout=5):
+    thread = threading.Thread(target=fn, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), '查询没有在限定时间内返回，可能发生了死锁'
+
+
+def make_event(channel, session_id='s1'):
+    return EventContext(Event.ON_HANDLE_CONTEXT, {'context': Context('$A galileo 周 3', session_id),
+                                                  'channel': channel})
+
+
+def test_instant_result_does_not_deadlock(plugin):
+    plugin.executor = DoneExecutor()
+    channel = Channel()
+
+    run_with_timeout(lambda: plugin.submit_query(make_event(channel), 'galileo', '周', '3'))
+
+    assert '浦发银行 (sh600000)' in channel.reply_list[0]
+    assert plugin.pending_dict == {} and plugin.chat_count_dict == {}
+
+
+def test_instant_results_from_worker_pool(plugin):
+    channel = Channel()
+
+    def submit_all():
+        for i in range(50):
+            assert plugin.submit_query(make_event(channel, session_id=f's{i}'), 'galileo', '周', '3') is None
+
+    run_with_timeout(submit_all)
+    plugin.executor.shutdown(wait=True)
+
+    assert len(channel.reply_list) == 50
+    assert plugin.pending_dict == {} and plugin.chat_count_dict == {}
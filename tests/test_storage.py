@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from plugins.StockStrategy.storage import ParquetStorage, csv_header_info, get_storage
+
+
+@pytest.mark.parametrize('storage_type', ['csv', 'parquet'])
+def test_write_append_read(tmp_path, history, storage_type):
+    storage = get_storage(storage_type)
+    path = str(tmp_path / ('sh600000' + storage.suffix))
+    df = history('sh600000', periods=30)
+
+    storage.write(path, df.iloc[:20])
+    storage.append(path, df.iloc[20:])
+
+    result = storage.read(path, parse_dates=['交易日期'])
+    pd.testing.assert_frame_equal(result, df, check_dtype=False)
+    tail = storage.read_tail(path, parse_dates=['交易日期'], n=2)
+    assert tail['交易日期'].tolist() == df['交易日期'].iloc[-2:].tolist()
+
+
+def test_csv_keeps_official_header(tmp_path, history):
+    storage = get_storage('csv')
+    path = str(tmp_path / 'sh600000.csv')
+    storage.write(path, history('sh600000', periods=3))
+    with open(path, encoding='gbk') as f:
+        assert f.readline().startswith(csv_header_info)
+        assert f.readline().startswith('股票代码,')
+
+
+def test_parquet_append_aligns_float32_part(tmp_path, history):
+    storage = ParquetStorage()
+    path = str(tmp_path / 'sh600000.parquet')
+    df = history('sh600000', periods=4)
+    storage.write(path, df.iloc[:2])
+    new_df = df.iloc[2:].copy()
+    new_df['收盘价'] = new_df['收盘价'].astype('float32')
+    storage.append(path, new_df)
+
+    result = storage.read(path)
+    assert len(ParquetStorage.get_part_list(path)) == 2
+    assert result['收盘价'].dtype == np.float64
+    assert result['收盘价'].tolist() == df['收盘价'].tolist()
+
+
+def test_unknown_storage_type():
+    with pytest.raises(ValueError):
+        get_storage('xlsx')
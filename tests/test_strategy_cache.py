@@ -0,0 +1,87 @@
+import datetime
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from plugins.StockStrategy import strategy_cache
+from plugins.StockStrategy.strategy_cache import StrategyCache
+
+key = ('galileo', '周', '3')
+
+
+class FakeDatetime(datetime.datetime):
+    """
+    可以设置当前时间的datetime
+    """
+    current = None
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+@pytest.fixture
+def set_now(monkeypatch):
+    monkeypatch.setattr(strategy_cache, 'datetime', SimpleNamespace(datetime=FakeDatetime,
+                                                                    timedelta=datetime.timedelta))
+
+    def set_time(text):
+        FakeDatetime.current = FakeDatetime.strptime(text, '%Y-%m-%d %H:%M:%S')
+
+    return set_time
+
+
+@pytest.mark.parametrize('now, expire_time', [
+    ('2024-01-05 16:59:59', '2024-01-05 17:00:00'),  # 周五发布之前
+    ('2024-01-05 17:00:00', '2024-01-08 17:00:00'),  # 周五发布之后，跳过周末
+    ('2024-01-06 10:00:00', '2024-01-08 17:00:00'),
+    ('2024-01-08 18:00:00', '2024-01-09 17:00:00'),
+])
+def test_expire_time(now, expire_time):
+    cache = StrategyCache()
+    assert str(cache.get_expire_time(datetime.datetime.strptime(now, '%Y-%m-%d %H:%M:%S'))) == expire_time
+
+
+def test_expires_at_publish_time(set_now, tmp_path):
+    cache = StrategyCache(str(tmp_path), publish_time='17:00')
+    set_now('2024-01-05 16:00:00')
+    assert cache.get(key, lambda: {'code': 200, 'result': [1]}) == {'code': 200, 'result': [1]}
+
+    set_now('2024-01-05 16:59:59')
+    assert cache.get(key, lambda: {'code': 200, 'result': [2]})['result'] == [1]
+    # 重启之后从硬盘读取
+    assert StrategyCache(str(tmp_path)).get(key, lambda: {'code': 200, 'result': [2]})['result'] == [1]
+
+    set_now('2024-01-05 17:00:00')
+    assert cache.get(key, lambda: {'code': 200, 'result': [3]})['result'] == [3]
+    assert StrategyCache(str(tmp_path)).read(key)['result'] == [3]
+    assert cache.stats['miss'] == 2
+
+
+def test_uncacheable_result_is_not_written(tmp_path):
+    cache = StrategyCache(str(tmp_path))
+    cache.get(key, lambda: {'code': 1005}, cacheable=lambda value: value['code'] == 200)
+    assert cache.read(key) is None
+
+
+def test_concurrent_requests_share_one_load():
+    cache = StrategyCache()
+    call_list = []
+
+    def loader():
+        call_list.append(1)
+        time.sleep(0.2)
+        return {'code': 200, 'result': []}
+
+    result_list = []
+    thread_list = [threading.Thread(target=lambda: result_list.append(cache.get(key, loader))) for _ in range(4)]
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+
+    assert len(call_list) == 1
+    assert result_list == [{'code': 200, 'result': []}] * 4
+    assert cache.stats['miss'] == 1 and cache.stats['coalesced'] == 3
@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+
+from plugins.StockStrategy.strategy_store import StrategyStore, csv_name_pattern, get_period_type
+
+
+@pytest.mark.parametrize('file_name, expected', [
+    ('galileo_natural_month_3.csv', ('galileo', 'natural_month', '3')),
+    ('galileo_month_3.csv', ('galileo', 'month', '3')),
+    ('rocket_v2_week_10.csv', ('rocket_v2', 'week', '10')),
+    ('event_5_0.csv', ('event', '5', '0')),
+])
+def test_csv_name_pattern(file_name, expected):
+    assert csv_name_pattern.match(file_name).groups() == expected
+
+
+@pytest.mark.parametrize('strategy, period', [
+    ('galileo', '自然月'),
+    ('rocket-v2', '周'),
+    ('event', '5天'),
+])
+def test_export_import_round_trip(tmp_path, strategy, period):
+    store = StrategyStore(str(tmp_path / 'a.db'))
+    df = pd.DataFrame({
+        'trade_date': ['2024-01-31', '2024-01-31', '2024-02-29'],
+        'symbol': ['sh600000', 'sz000001', 'sh600000'],
+        'name': ['浦发银行', '平安银行', '浦发银行'],
+        'rank': [1, 2, 1],
+    })
+    store.upsert(df.assign(strategy=strategy, period=get_period_type(period), select_count=3))
+    store.export_csv(strategy, period, 3, str(tmp_path / 'csv'))
+
+    new_store = StrategyStore(str(tmp_path / 'b.db'))
+    assert new_store.import_csv_dir(str(tmp_path / 'csv')) == 3
+    pd.testing.assert_frame_equal(new_store.history(), store.history())
+
@@ -0,0 +1,123 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from plugins.StockStrategy import BaseDataApi
+from plugins.StockStrategy.benchmark import MockApiServer, bench_data_info, generate_all_data, generate_history, \
+    generate_payload, get_code_list, get_date_list
+from plugins.StockStrategy.metrics import metrics
+
+product = 'stock-trading-data-pro'
+stock_count, years, days = 6, 1, 2
+
+
+def get_expected(code):
+    history_list, daily_list = get_date_list(days, years)
+    return generate_history(code, history_list + daily_list)
+
+
+def check_all_data(api, product_list):
+    for _product in product_list:
+        for code in get_code_list(stock_count):
+            df = api.storage.read(os.path.join(api.all_data_path, _product, code + api.storage.suffix),
+                                  parse_dates=['交易日期'])
+            pd.testing.assert_frame_equal(df, get_expected(code), check_dtype=False)
+
+
+@pytest.mark.parametrize('storage_type', ['csv', 'parquet'])
+def test_parallel_dispatch_merges_all_symbols(make_api, tmp_path, monkeypatch, storage_type):
+    # 只有一个cpu时joblib在当前进程中串行执行，按照3个cpu启动工作进程
+    monkeypatch.setattr(BaseDataApi, 'cpu_count', lambda: 3)
+    api = make_api(storage_type)
+    generate_all_data(api.all_data_path, stock_count, years, days, storage_type=storage_type)
+    all_data_path = os.path.join(api.all_data_path, product)
+    for date in get_date_list(days, years)[1]:
+        file_name, content, _ = generate_payload(product, date, stock_count, years, days)
+        file_path = str(tmp_path / file_name)
+        with open(file_path, 'wb') as f:
+            f.write(content)
+        # 工作进程通过内存映射读取按标的排好序的增量数据
+        api.update_by_group(file_path, all_data_path, product, multi_process=True)
+
+    assert not os.listdir(os.path.join(api.all_data_path, 'temp', 'dispatch'))
+    check_all_data(api, [product])
+
+
+def get_payload_dict():
+    """
+    所有产品每天的增量数据
+    """
+    payload_dict = {}
+    for _product in bench_data_info:
+        for date in get_date_list(days, years)[1]:
+            file_name, content, _ = generate_payload(_product, date, stock_count, years, days)
+            payload_dict[(_product, date.strftime('%Y-%m-%d'))] = (file_name, content)
+    return payload_dict
+
+
+def run_update_all(make_api, monkeypatch, metrics_path=None, **kwargs):
+    """
+    通过MockApiServer下载并合并所有产品的增量数据
+    """
+    monkeypatch.setattr(BaseDataApi, 'cpu_count', lambda: 3)
+    with MockApiServer(get_payload_dict()) as server:
+        api = make_api(url=server.url)
+        api.metrics_path = metrics_path
+        generate_all_data(api.all_data_path, stock_count, years, days)
+        product_list = list(bench_data_info)
+        api.update_all_data(product_list, {_product: _product for _product in product_list}, **kwargs)
+    return api
+
+
+def test_concurrent_update_all_data(make_api, monkeypatch):
+    api = run_update_all(make_api, monkeypatch, max_workers=4, multi_process=True)
+
+    check_all_data(api, list(bench_data_info))
+    status = api.job_store.status()
+    assert status['done'].tolist() == [days] * len(bench_data_info)
+    assert status[['pending', 'running', 'error']].to_numpy().sum() == 0
+
+
+def test_export_stage_metrics(make_api, monkeypatch, tmp_path):
+    metrics_path = str(tmp_path / 'metrics')
+    run_update_all(make_api, monkeypatch, metrics_path=metrics_path, max_workers=4, multi_process=True)
+
+    json_list = [name for name in os.listdir(metrics_path) if name.endswith('.json')]
+    assert len(json_list) == 1 and os.path.exists(os.path.join(metrics_path, 'stock_update.prom'))
+    with open(os.path.join(metrics_path, json_list[0]), mode='r', encoding='utf8') as f:
+        stat_dict = {(stage['product'], stage['stage']): stage for stage in json.load(f)['stages']}
+    for _product in bench_data_info:
+        assert stat_dict[(_product, 'download')]['count'] == days
+        assert stat_dict[(_product, 'merge')]['count'] == days
+    # 工作进程中每个股票每天的记录都合并到了主进程
+    assert stat_dict[(product, 'append')]['count'] == stat_dict[(product, 'append')]['rows'] == stock_count * days
+    assert stat_dict[('stock-fin-data-xbx', 'write')]['count'] == stock_count * days
+    with open(os.path.join(metrics_path, 'stock_update.prom'), mode='r', encoding='utf8') as f:
+        prom = f.read()
+    assert f'stock_update_stage_rows_total{{product="{product}",stage="append"}} {stock_count * days}' in prom
+
+
+def test_explicit_date_runs_again(make_api):
+    date_list = [date.strftime('%Y-%m-%d') for date in get_date_list(days, years)[1]]
+
+    def get_merge_count():
+        return sum(stage['count'] for stage in metrics.report()['stages'] if stage['stage'] == 'merge')
+
+    with MockApiServer(get_payload_dict()) as server:
+        api = make_api(url=server.url)
+        generate_all_data(api.all_data_path, stock_count, years, days)
+        api.update_all_data([product], {product: product})
+        assert get_merge_count() == days
+
+        # 最新日期中已经完成的任务不再执行
+        api.update_all_data([product], {product: product})
+        assert get_merge_count() == 0
+
+        # 手动指定的日期即使已经完成也重新执行
+        api.update_all_data([product], {product: product}, date_time=date_list[0])
+        assert get_merge_count() == 1
+
+    assert api.job_store.jobs(product=product)['state'].tolist() == ['done'] * days
+    check_all_data(api, [product])